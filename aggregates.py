@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+"""aggregates.py -- checks the counters kept on the competitions
+
+Usage: python aggregates.py [--fix] [comp_id ...]
+
+Every competition row keeps the total points of its tasks, its players,
+teams and spectators, and its accepted flags, so that no page counts
+them. The routes that change them adjust the counters in the same
+transaction. This command counts everything again from the tables and
+prints the counters that drifted; with --fix it also stores the counts.
+"""
+
+import argparse
+import json
+import sys
+
+from sqlalchemy import text
+
+
+# How each counter is counted from the tables: total score of the tasks,
+# members of the ranked teams, ranked teams, members of the spectator teams
+# and flags accepted, one per player and task
+COUNTS = [
+    ('points', 'SELECT ifnull(sum(tc.score), 0) FROM task_competition tc '
+               'WHERE tc.comp_id = competitions.id'),
+    ('players', 'SELECT count(*) FROM team_player tp JOIN teams t ON t.id = tp.team_id '
+                'WHERE t.comp_id = competitions.id AND t.spectator = 0'),
+    ('teams', 'SELECT count(*) FROM teams t '
+              'WHERE t.comp_id = competitions.id AND t.spectator = 0'),
+    ('spectators', 'SELECT count(*) FROM team_player tp JOIN teams t ON t.id = tp.team_id '
+                   'WHERE t.comp_id = competitions.id AND t.spectator != 0'),
+    ('solves', 'SELECT count(*) FROM flags f '
+               'WHERE f.comp_id = competitions.id'),
+]
+
+COUNTERS = tuple(name for name, _ in COUNTS)
+
+# Single statements, so that both run on one snapshot of the database
+_compare = 'SELECT id, %s, %s FROM competitions' % (
+    ', '.join(COUNTERS), ', '.join('(%s) AS counted_%s' % (query, name) for name, query in COUNTS))
+
+_recount = 'UPDATE competitions SET %s WHERE id = :comp_id' % (
+    ', '.join('%s = (%s)' % (name, query) for name, query in COUNTS))
+
+
+def adjust(connection, comp_id, **deltas):
+    """
+    Adds to the counters of a competition, e.g. adjust(connection, 1,
+    teams=1, players=1), in the transaction of the connection
+    """
+
+    deltas = dict((name, delta) for name, delta in deltas.items() if delta)
+    if not deltas:
+        return
+    for name in deltas:
+        if name not in COUNTERS:
+            raise ValueError('Unknown counter %s' % name)
+
+    assignments = ', '.join('%s = %s + :%s' % (name, name, name) for name in sorted(deltas))
+    connection.execute(
+        text('UPDATE competitions SET %s WHERE id = :comp_id' % assignments),
+        comp_id=comp_id, **deltas)
+
+
+def score_task(connection, comp_id, task_id, score):
+    """
+    Counts a new score for a task of a competition, 0 to remove it. Must run
+    before task_competition is changed, in the same transaction.
+    """
+
+    connection.execute(
+        text(
+            '''
+            UPDATE competitions SET points = points + :score - ifnull(
+                (SELECT score FROM task_competition WHERE task_id = :task_id AND comp_id = :comp_id), 0)
+            WHERE id = :comp_id
+            '''),
+        comp_id=comp_id, task_id=task_id, score=score)
+
+
+def delete_task(connection, task_id):
+    """
+    Uncounts the score and the solves of a task in every competition. Must
+    run before the task is deleted, in the same transaction.
+    """
+
+    connection.execute(
+        text(
+            '''
+            UPDATE competitions SET
+                points = points - ifnull(
+                    (SELECT score FROM task_competition WHERE task_id = :task_id AND comp_id = competitions.id), 0),
+                solves = solves - (SELECT count(*) FROM flags WHERE task_id = :task_id AND comp_id = competitions.id)
+            WHERE id IN (SELECT comp_id FROM task_competition WHERE task_id = :task_id
+                         UNION SELECT comp_id FROM flags WHERE task_id = :task_id)
+            '''),
+        task_id=task_id)
+
+
+def check(engine, comp_ids=None, fix=False):
+    """
+    Compares the counters of competitions to a fresh count
+
+    Args:
+        engine: SQLAlchemy engine of the database
+        comp_ids: competitions to check, all by default
+        fix: count the competitions that drifted again and store the counts
+    Returns:
+        A list of (comp_id, counter, stored, counted) for every counter that
+        drifted.
+    """
+
+    drift = []
+    with engine.begin() as connection:
+        for row in connection.execute(text(_compare)):
+            if comp_ids is not None and row['id'] not in comp_ids:
+                continue
+            for name in COUNTERS:
+                if row[name] != row['counted_' + name]:
+                    drift.append((row['id'], name, row[name], row['counted_' + name]))
+
+        if fix:
+            for comp_id in sorted(set(entry[0] for entry in drift)):
+                connection.execute(text(_recount), comp_id=comp_id)
+    return drift
+
+
+if __name__ == '__main__':
+    import storage
+
+    parser = argparse.ArgumentParser(description='Checks the counters kept on the competitions.')
+    parser.add_argument('comp_ids', metavar='comp_id', type=int, nargs='*')
+    parser.add_argument('--fix', action='store_true', help='store the fresh counts')
+    args = parser.parse_args()
+
+    with open('config.json', 'rb') as f:
+        config = json.loads(f.read())
+
+    db = storage.connect(config['db'], config.get('storage'))
+    drift = check(db.engine, args.comp_ids or None, args.fix)
+    for comp_id, name, stored, counted in drift:
+        print('competition %d: %s is %s, counted %s' % (comp_id, name, stored, counted))
+    if not drift:
+        print('No drift')
+    elif args.fix:
+        print('Fixed %d counters' % len(drift))
+    sys.exit(1 if drift and not args.fix else 0)
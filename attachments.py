@@ -0,0 +1,177 @@
+"""
+Task attachments, stored once per content.
+"""
+
+import errno
+import hashlib
+import io
+import os
+import re
+import tempfile
+import time
+
+from sqlalchemy import text
+
+
+DIGEST = re.compile(r'^[0-9a-f]{64}$')
+
+
+class _HashedFile(io.FileIO):
+    """File that hashes what is written to it, in the order it is written"""
+
+    def __init__(self, fd):
+        io.FileIO.__init__(self, fd, 'r+')
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        written = io.FileIO.write(self, data)
+        self.sha256.update(memoryview(data)[:written])
+        self.size += written
+        return written
+
+
+class Upload(object):
+    """
+    A temporary file in the store, so an upload goes to disk once and can
+    then be renamed into place. The content is hashed chunk by chunk as the
+    file buffer writes it out, so storing it does not read it back; it must
+    only be appended to.
+    """
+
+    chunk_size = 1 << 16
+
+    def __init__(self, directory):
+        fd, self.path = tempfile.mkstemp(dir=directory)
+        self._raw = _HashedFile(fd)
+        self._file = io.BufferedRandom(self._raw, self.chunk_size)
+        # werkzeug writes a multipart body line by line, into the buffer
+        self.write = self._file.write
+
+    def __getattr__(self, name):
+        # read, readline, seek, tell and flush for werkzeug
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def digest(self):
+        """Returns the hex SHA-256 and the size of the content"""
+
+        self._file.flush()
+        return self._raw.sha256.hexdigest(), self._raw.size
+
+    def close(self):
+        """Closes the file, and removes it unless it was stored"""
+
+        self._file.close()
+        try:
+            os.remove(self.path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+
+class AttachmentStore(object):
+    """
+    Files named after the SHA-256 of their content, so the same binary
+    uploaded for several tasks is stored once and its URL never changes.
+
+    The attachments table counts the tasks using each file, and a file is
+    deleted with its last reference. A file is moved into place or removed
+    inside the transaction that changes its count, under the SQLite write
+    lock, so it cannot be removed while another upload adds it again.
+    """
+
+    chunk_size = 1 << 16
+
+    def __init__(self, engine, root):
+        """
+        Args:
+            engine: SQLAlchemy engine of the database
+            root: directory of the files, which nginx serves
+        """
+
+        self._engine = engine
+        self.root = root
+
+    def path(self, digest):
+        """Returns the path of the file with the given hash"""
+
+        return os.path.join(self.root, digest[:2], digest[2:])
+
+    def exists(self, digest):
+        return bool(DIGEST.match(digest)) and os.path.isfile(self.path(digest))
+
+    def upload(self):
+        """
+        Returns a new Upload in the temporary directory of the store, on the
+        same filesystem as the files so that storing it is a rename
+        """
+
+        directory = os.path.join(self.root, 'tmp')
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        return Upload(directory)
+
+    def add(self, stream):
+        """
+        Stores the content of a file object and takes a reference to it. An
+        Upload of this store is moved into place, anything else is copied.
+
+        Returns:
+            The hex SHA-256 of the content.
+        """
+
+        if isinstance(stream, Upload) and os.path.dirname(stream.path) == os.path.join(self.root, 'tmp'):
+            return self._store(stream)
+
+        upload = self.upload()
+        try:
+            while True:
+                chunk = stream.read(self.chunk_size)
+                if not chunk:
+                    break
+                upload.write(chunk)
+            return self._store(upload)
+        finally:
+            upload.close()
+
+    def _store(self, upload):
+        digest, size = upload.digest()
+        os.chmod(upload.path, 0o644)
+
+        with self._engine.begin() as connection:
+            connection.execute(
+                text('INSERT OR IGNORE INTO attachments (sha256, size, refs, created) VALUES (:sha256, :size, 0, :now)'),
+                sha256=digest, size=size, now=int(time.time() * 1000))
+            connection.execute(
+                text('UPDATE attachments SET refs = refs + 1 WHERE sha256 = :sha256'),
+                sha256=digest)
+
+            path = self.path(digest)
+            if not os.path.isfile(path):
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                os.rename(upload.path, path)
+        return digest
+
+    def release(self, digest):
+        """Drops a reference to a file, and the file with its last one"""
+
+        with self._engine.begin() as connection:
+            connection.execute(
+                text('UPDATE attachments SET refs = refs - 1 WHERE sha256 = :sha256'),
+                sha256=digest)
+            refs = connection.execute(
+                text('SELECT refs FROM attachments WHERE sha256 = :sha256'),
+                sha256=digest).scalar()
+            if refs is not None and refs <= 0:
+                connection.execute(
+                    text('DELETE FROM attachments WHERE sha256 = :sha256'),
+                    sha256=digest)
+                try:
+                    os.remove(self.path(digest))
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
@@ -0,0 +1,93 @@
+"""
+Write-behind log of every flag submission attempt.
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+
+log = logging.getLogger(__name__)
+
+
+class AttemptLog(object):
+    """
+    Buffers submission attempts in memory and appends them to the attempts
+    table in batches from a background thread, one transaction per flush.
+
+    A crash loses at most the attempts of the last flush interval. A batch
+    that could not be written goes back to the front of the buffer for the
+    next flush. When the buffer is full, the newest attempts are counted in
+    dropped instead of slowing down submissions.
+    """
+
+    max_flag = 256
+
+    def __init__(self, engine, interval=1.0, capacity=50000):
+        self._engine = engine
+        self._interval = interval
+        self._capacity = capacity
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        self._pid = None
+        self.dropped = 0
+        atexit.register(self.flush)
+
+    def _ensure_thread(self):
+        # Also restarts the flusher in a worker forked after it was started
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._buffer.clear()
+            thread = threading.Thread(target=self._run, name='attempt-log')
+            thread.daemon = True
+            thread.start()
+
+    def record(self, comp_id, task_id, team_id, user_id, flag, correct):
+        """Queues one attempt, task_id is None for unknown flags"""
+
+        self._ensure_thread()
+        if len(self._buffer) >= self._capacity:
+            self.dropped += 1
+            return
+        self._buffer.append((comp_id, task_id, team_id, user_id, flag[:self.max_flag],
+                             bool(correct), int(time.time() * 1000)))
+
+    def _run(self):
+        while True:
+            time.sleep(self._interval)
+            try:
+                self.flush()
+            except Exception:
+                log.exception('Could not write submission attempts')
+
+    def flush(self):
+        """Writes everything buffered so far in one transaction"""
+
+        batch = []
+        while self._buffer and len(batch) < self._capacity:
+            batch.append(self._buffer.popleft())
+        if not batch:
+            return
+
+        try:
+            with self._engine.begin() as connection:
+                connection.execute(
+                    '''
+                    INSERT INTO attempts (comp_id, task_id, team_id, user_id, flag, correct, timestamp)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ''',
+                    batch)
+        except Exception:
+            # Retried first by the next flush, ahead of what came meanwhile
+            self._buffer.extendleft(reversed(batch))
+            while len(self._buffer) > self._capacity:
+                self._buffer.pop()
+                self.dropped += 1
+            raise
@@ -0,0 +1,1236 @@
+#!/usr/bin/env python
+
+"""bench.py -- micro benchmarks for the hot paths of the platform
+
+Usage: python bench.py <benchmark>
+"""
+
+import sys
+
+if __name__ == '__main__' and sys.argv[1:2] == ['events']:
+    # SSE is served by gevent workers, benchmark it the same way
+    from gevent import monkey
+    monkey.patch_all()
+
+import math
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine, event
+
+import aggregates
+import migrate
+import scoring
+import storage
+from attachments import AttachmentStore
+from catalog import CatalogRegistry
+from events import EventStream
+from queries import Queries
+from passwords import PasswordHasher
+from provisioning import ProvisioningQueue
+from ranking import RankIndex
+from roster import import_roster
+from ratelimit import TokenBuckets
+from submissions import SubmissionEngine
+from utils import execute, execute_all
+
+
+def timeit(fn, repeat):
+    start = time.time()
+    for _ in range(repeat):
+        fn()
+    return (time.time() - start) / repeat * 1e6
+
+
+def bench_rank(sizes=(100, 1000, 10000, 50000), sql_limit=2000):
+    """Rank lookups, leaderboard pages and score updates vs team count"""
+
+    print('%8s %12s %12s %12s %14s' % ('teams', 'rank (us)', 'page (us)', 'update (us)', 'sql rank (us)'))
+    for n in sizes:
+        teams = [(i, random.randint(0, 50) * 100, random.randint(0, 10 ** 6)) for i in range(n)]
+        index = RankIndex(teams)
+
+        rank = timeit(lambda: index.rank(random.randrange(n)), 2000)
+        page = timeit(lambda: index.page(random.randrange(n), 10), 2000)
+        update = timeit(lambda: index.update(random.randrange(n), random.randint(0, 50) * 100,
+                                             random.randint(0, 10 ** 6)), 2000)
+
+        sql = '-'
+        if n <= sql_limit:
+            conn = sqlite3.connect(':memory:')
+            conn.execute('CREATE TABLE teams (id INTEGER PRIMARY KEY, comp_id INTEGER, spectator BOOLEAN, score INTEGER, timestamp BIGINT)')
+            conn.executemany('INSERT INTO teams VALUES (?, 1, 0, ?, ?)', teams)
+            query = '''
+                SELECT (SELECT count(*)+1 FROM teams t2
+                        WHERE t.id != t2.id AND t2.spectator = 0 AND (t2.score > t.score OR (t2.score == t.score AND t2.timestamp <= t.timestamp))
+                       ) as rank
+                FROM teams t WHERE comp_id = 1 AND t.id = ? AND t.spectator = 0'''
+            sql = '%.1f' % timeit(lambda: conn.execute(query, (random.randrange(n),)).fetchall(), 50)
+
+        print('%8d %12.1f %12.1f %12.1f %14s' % (n, rank, page, update, sql))
+
+
+def bench_events(subscribers=5000, publishes=20):
+    """Fanout latency and memory of idle SSE subscribers on one stream"""
+
+    stream = EventStream()
+    received = [0]
+    lock = threading.Lock()
+
+    def subscriber():
+        for chunk in stream.subscribe(keepalive=60):
+            if chunk.startswith('id:'):
+                with lock:
+                    received[0] += 1
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    for _ in range(subscribers):
+        t = threading.Thread(target=subscriber)
+        t.daemon = True
+        t.start()
+    time.sleep(1)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss
+
+    latencies = []
+    for i in range(publishes):
+        expected = received[0] + subscribers
+        start = time.time()
+        stream.publish('score', {'team': i, 'score': i * 100, 'rank': 1})
+        while received[0] < expected:
+            time.sleep(0)
+        latencies.append(time.time() - start)
+
+    latencies.sort()
+    print('subscribers: %d' % subscribers)
+    print('memory per subscriber: %.1f KiB' % (float(rss) / subscribers))
+    print('publish -> all delivered: median %.1f ms, max %.1f ms' % (
+        latencies[len(latencies) // 2] * 1000, latencies[-1] * 1000))
+
+
+SCHEMA = [
+    'CREATE TABLE competitions (id INTEGER PRIMARY KEY, solves INTEGER NOT NULL DEFAULT 0)',
+    'CREATE TABLE task_competition (task_id INTEGER, comp_id INTEGER, score INTEGER, PRIMARY KEY (task_id, comp_id))',
+    'CREATE TABLE teams (id INTEGER PRIMARY KEY, name TEXT NOT NULL, secret TEXT, comp_id INTEGER, spectator BOOLEAN, score INTEGER, timestamp BIGINT)',
+    'CREATE TABLE team_player (team_id INTEGER, user_id INTEGER, PRIMARY KEY (team_id, user_id))',
+    'CREATE TABLE flags (task_id INTEGER, user_id INTEGER, comp_id INTEGER, timestamp BIGINT, PRIMARY KEY (task_id, user_id, comp_id))',
+    'CREATE TABLE task_stats (comp_id INTEGER, task_id INTEGER, solves INTEGER NOT NULL, first_team_id INTEGER, first_timestamp BIGINT, last_timestamp BIGINT, PRIMARY KEY (comp_id, task_id))',
+    'CREATE TABLE task_solve_hours (comp_id INTEGER, task_id INTEGER, hour INTEGER, solves INTEGER NOT NULL, PRIMARY KEY (comp_id, task_id, hour))',
+    'CREATE TABLE task_solves (comp_id INTEGER, task_id INTEGER, team_id INTEGER, ranked BOOLEAN NOT NULL, timestamp BIGINT NOT NULL, PRIMARY KEY (comp_id, task_id, team_id))',
+]
+
+
+def create_db(path, teams, players, tasks):
+    """Creates a competition database, returns the shuffled (team, user, task) solves"""
+
+    conn = sqlite3.connect(path)
+    for statement in SCHEMA:
+        conn.execute(statement)
+    conn.execute('INSERT INTO competitions (id) VALUES (1)')
+    conn.executemany('INSERT INTO task_competition VALUES (?, 1, ?)', [(t, 100) for t in range(tasks)])
+    conn.executemany('INSERT INTO teams VALUES (?, ?, \'\', 1, 0, 0, 0)', [(t, str(t)) for t in range(teams)])
+    conn.executemany('INSERT INTO team_player VALUES (?, ?)',
+                     [(t, t * players + p) for t in range(teams) for p in range(players)])
+    conn.commit()
+    conn.close()
+
+    jobs = [(t, t * players + p, task) for t in range(teams) for p in range(players) for task in range(tasks)]
+    random.shuffle(jobs)
+    return jobs
+
+
+def legacy_submit(engine, comp_id, task_id, team_id, user_id, points, timestamp):
+    """
+    The statements submit() used to run, each on its own autocommitted
+    connection as dataset does, without a transaction
+    """
+
+    user_solved = engine.execute('SELECT * FROM flags WHERE task_id = ? AND user_id = ? AND comp_id = ?',
+                                 task_id, user_id, comp_id).fetchall()
+    team_solved = engine.execute(
+        '''SELECT * FROM flags f JOIN team_player tp JOIN teams t ON f.user_id = tp.user_id AND tp.team_id = t.id
+        WHERE f.task_id = ? AND f.comp_id = ? AND t.id = ?''', task_id, comp_id, team_id).fetchall()
+    if not user_solved:
+        engine.execute('INSERT INTO flags VALUES (?, ?, ?, ?)', task_id, user_id, comp_id, timestamp)
+    if not team_solved:
+        points = engine.execute('SELECT score FROM task_competition WHERE task_id = ? AND comp_id = ?',
+                                task_id, comp_id).fetchone()[0]
+        score = engine.execute('SELECT score FROM teams WHERE id = ?', team_id).fetchone()[0]
+        engine.execute('UPDATE teams SET score = ?, timestamp = ? WHERE id = ?', score + points, timestamp, team_id)
+
+
+def bench_submit(teams=200, players=3, tasks=20, threads=8):
+    """
+    Concurrent correct submissions by every player of every team.
+    Checks that no team is credited twice for a task.
+    """
+
+    directory = tempfile.mkdtemp()
+    try:
+        for name in ('legacy', 'engine'):
+            path = os.path.join(directory, name + '.db')
+            jobs = create_db(path, teams, players, tasks)
+            chunks = [jobs[i::threads] for i in range(threads)]
+
+            engine = create_engine('sqlite:///' + path, connect_args={'timeout': 30, 'check_same_thread': False})
+            if name == 'legacy':
+                def worker(chunk):
+                    for team_id, user_id, task_id in chunk:
+                        legacy_submit(engine, 1, task_id, team_id, user_id, 100, int(time.time() * 1000))
+            else:
+                solves = SubmissionEngine(engine)
+
+                def worker(chunk):
+                    for team_id, user_id, task_id in chunk:
+                        solves.record(1, task_id, team_id, user_id, 100, int(time.time() * 1000))
+
+            workers = [threading.Thread(target=worker, args=(chunk,)) for chunk in chunks]
+            start = time.time()
+            for w in workers:
+                w.start()
+            for w in workers:
+                w.join()
+            elapsed = time.time() - start
+
+            conn = sqlite3.connect(path)
+            wrong = conn.execute('SELECT count(*) FROM teams WHERE score != ?', (tasks * 100,)).fetchone()[0]
+            conn.close()
+
+            print('%-7s %6d submissions in %6.2fs: %7.0f/s, %d/%d teams with a wrong score' % (
+                name, len(jobs), elapsed, len(jobs) / elapsed, wrong, teams))
+    finally:
+        shutil.rmtree(directory)
+
+
+PROFILES = [
+    ('default', {}),
+    ('wal', {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'busy_timeout': 5000,
+             'cache_size': -16000, 'mmap_size': 268435456, 'temp_store': 'MEMORY'}),
+]
+
+
+def profile_engine(path, profile, readonly=False):
+    engine = create_engine('sqlite:///' + path, connect_args={'timeout': 30, 'check_same_thread': False})
+
+    @event.listens_for(engine, 'connect')
+    def _configure(dbapi_connection, connection_record):
+        storage.apply_profile(dbapi_connection, profile, readonly)
+
+    return engine
+
+
+def bench_storage(teams=200, players=3, tasks=10, writers=4, readers=8):
+    """
+    Scoreboard reads on read-only connections while every player submits,
+    for each storage profile.
+    """
+
+    scoreboard = ('SELECT id, name, score FROM teams WHERE comp_id = 1 AND spectator = 0 '
+                  'ORDER BY score DESC, timestamp ASC LIMIT 50')
+
+    directory = tempfile.mkdtemp()
+    try:
+        print('%-8s %10s %10s %12s %12s' % ('profile', 'writes/s', 'reads/s', 'read p50 ms', 'read p99 ms'))
+        for name, profile in PROFILES:
+            path = os.path.join(directory, name + '.db')
+            jobs = create_db(path, teams, players, tasks)
+            chunks = [jobs[i::writers] for i in range(writers)]
+
+            solves = SubmissionEngine(profile_engine(path, profile))
+            reads = profile_engine(path, profile, readonly=True)
+            done = threading.Event()
+            latencies = []
+
+            def write(chunk):
+                for team_id, user_id, task_id in chunk:
+                    solves.record(1, task_id, team_id, user_id, 100, int(time.time() * 1000))
+
+            def read():
+                own = []
+                with reads.connect() as connection:
+                    while not done.is_set():
+                        start = time.time()
+                        connection.execute(scoreboard).fetchall()
+                        own.append(time.time() - start)
+                latencies.extend(own)
+
+            threads = [threading.Thread(target=read) for _ in range(readers)]
+            threads += [threading.Thread(target=write, args=(chunk,)) for chunk in chunks]
+            start = time.time()
+            for t in threads:
+                t.start()
+            for t in threads[readers:]:
+                t.join()
+            elapsed = time.time() - start
+            done.set()
+            for t in threads[:readers]:
+                t.join()
+
+            latencies.sort()
+            print('%-8s %10.0f %10.0f %12.2f %12.2f' % (
+                name, len(jobs) / elapsed, len(latencies) / elapsed,
+                latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000))
+    finally:
+        shutil.rmtree(directory)
+
+
+# Queries issued by server.py and submissions.py on hot paths, with the
+# parameters used against the generated database
+QUERIES = [
+    ('get_team',
+     'SELECT * FROM teams t JOIN team_player tp ON t.id = tp.team_id AND tp.user_id = :user_id AND t.comp_id = :comp_id LIMIT 1'),
+    ('get_flags',
+     'SELECT f.task_id FROM flags f WHERE f.user_id = :user_id'),
+    ('get_comp_score',
+     'SELECT ifnull(total(score), 0) as score FROM task_competition WHERE comp_id = :comp_id'),
+    ('get_tasks_done',
+     'SELECT f.task_id FROM flags f JOIN team_player tp JOIN teams t ON f.user_id = tp.user_id AND tp.team_id = t.id '
+     'WHERE f.comp_id = :comp_id AND t.id = :team_id'),
+    ('load_rank_index',
+     'SELECT id, score, timestamp FROM teams WHERE comp_id = :comp_id AND spectator = 0'),
+    ('get_total_users',
+     'SELECT ifnull(count(*), 0) as count FROM users u JOIN team_player tp JOIN teams t ON u.id = tp.user_id AND tp.team_id = t.id '
+     'WHERE t.spectator = 0 AND t.comp_id = :comp_id'),
+    ('login',
+     'SELECT * FROM users WHERE username = :username LIMIT 1'),
+    ('register',
+     'SELECT * FROM users WHERE shell_username = :username LIMIT 1'),
+    ('join_team',
+     'SELECT * FROM teams WHERE secret = :secret AND comp_id = :comp_id'),
+    ('competition_tasks',
+     'SELECT * FROM tasks t, task_competition tc WHERE t.id = tc.task_id AND tc.comp_id = :comp_id'),
+    ('submit_teammate_check',
+     'SELECT 1 FROM flags f JOIN team_player tp ON f.user_id = tp.user_id '
+     'WHERE tp.team_id = :team_id AND f.task_id = :task_id AND f.comp_id = :comp_id AND f.user_id != :user_id'),
+]
+
+
+def fill_db(path, comps=4, teams=500, players=3, tasks=40, attempts=20):
+    """Fills a migrated database with a few busy competitions"""
+
+    conn = sqlite3.connect(path)
+    conn.executemany('INSERT INTO competitions (id, secret, spectator_secret) VALUES (?, ?, ?)',
+                     [(c, 's%d' % c, 'v%d' % c) for c in range(1, comps + 1)])
+    conn.executemany('INSERT INTO tasks (id, name, flag, category) VALUES (?, ?, ?, 1)',
+                     [(t, 'task%d' % t, 'flag%d' % t) for t in range(1, tasks + 1)])
+    conn.executemany('INSERT INTO task_competition VALUES (?, ?, 100)',
+                     [(t, c) for c in range(1, comps + 1) for t in range(1, tasks + 1)])
+
+    users = []
+    team_rows = []
+    members = []
+    flags = []
+    log = []
+    for c in range(1, comps + 1):
+        for i in range(teams):
+            team_id = len(team_rows) + 1
+            team_rows.append((team_id, 'team%d' % team_id, 'secret%d' % team_id, c, 0, 0, random.randint(0, 10 ** 6)))
+            for p in range(players):
+                user_id = len(users) + 1
+                users.append((user_id, 'user%d' % user_id, 'shell%d' % user_id))
+                members.append((team_id, user_id))
+                for task_id in random.sample(range(1, tasks + 1), random.randint(0, tasks // 4)):
+                    flags.append((task_id, user_id, c, random.randint(0, 10 ** 6)))
+                for _ in range(attempts):
+                    log.append((c, random.randint(1, tasks), team_id, user_id, 'x', 0, 0))
+    conn.executemany('INSERT INTO users (id, username, shell_username) VALUES (?, ?, ?)', users)
+    conn.executemany('INSERT INTO teams VALUES (?, ?, ?, ?, ?, ?, ?)', team_rows)
+    conn.executemany('INSERT INTO team_player VALUES (?, ?)', members)
+    conn.executemany('INSERT OR IGNORE INTO flags VALUES (?, ?, ?, ?)', flags)
+    conn.executemany('INSERT INTO attempts VALUES (?, ?, ?, ?, ?, ?, ?)', log)
+    conn.commit()
+    conn.execute('ANALYZE')
+    conn.close()
+    return len(team_rows), len(users)
+
+
+def bench_plans(repeat=200):
+    """
+    Query plans and timings of the hot queries, before and after the index
+    migration. The output is kept in migrations/query_plans.txt.
+    """
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'ctf.db')
+        url = 'sqlite:///' + path
+        migrate.upgrade(url, '0002')
+        n_teams, n_users = fill_db(path)
+        params = {'comp_id': 2, 'team_id': n_teams // 2, 'user_id': n_users // 2, 'task_id': 7,
+                  'username': 'user%d' % (n_users // 2), 'secret': 'secret%d' % (n_teams // 2)}
+
+        results = {}
+        for revision in ('0002', 'head'):
+            migrate.upgrade(url, revision)
+            conn = sqlite3.connect(path)
+            for name, query in QUERIES:
+                plan = [row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + query, params)]
+                elapsed = timeit(lambda: conn.execute(query, params).fetchall(), repeat)
+                results.setdefault(name, []).append((plan, elapsed))
+            conn.close()
+
+        print('python bench.py plans: %d teams, %d users, %d runs per query\n' % (n_teams, n_users, repeat))
+        for name, query in QUERIES:
+            (before, before_us), (after, after_us) = results[name]
+            print('%s: %.1f us -> %.1f us' % (name, before_us, after_us))
+            print('  ' + query)
+            print('  before:')
+            for line in before:
+                print('    ' + line)
+            print('  after:')
+            for line in after:
+                print('    ' + line)
+            print('')
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_queries(repeat=2000):
+    """Per call cost of the read helpers, through dataset and through queries.py"""
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'ctf.db')
+        url = 'sqlite:///' + path
+        migrate.upgrade(url)
+        n_teams, n_users = fill_db(path)
+        db = storage.connect(url, readonly=True)
+        queries = Queries(db.engine)
+
+        user_id, team_id, comp_id = n_users // 2, n_teams // 2, 2
+        page = range(team_id, team_id + 10)
+        cases = [
+            ('get_user_by_id',
+             lambda: list(db.query('SELECT * FROM users WHERE id = :user_id', user_id=user_id)),
+             lambda: queries.get_user_by_id(user_id)),
+            ('get_team',
+             lambda: list(db.query('SELECT * FROM teams t JOIN team_player tp ON t.id = tp.team_id AND tp.user_id = :user_id AND t.comp_id = :comp_id LIMIT 1',
+                                   user_id=user_id, comp_id=comp_id)),
+             lambda: queries.get_team(user_id, comp_id)),
+            ('get_task',
+             lambda: db['tasks'].find_one(id=7),
+             lambda: queries.get_task(7)),
+            ('get_tasks_done',
+             lambda: list(db.query('SELECT f.task_id FROM flags f JOIN team_player tp JOIN teams t ON f.user_id = tp.user_id AND tp.team_id = t.id '
+                                   'WHERE f.comp_id = :comp_id AND t.id = :team_id', comp_id=comp_id, team_id=team_id)),
+             lambda: queries.get_tasks_done(team_id, comp_id)),
+            ('scoreboard teams',
+             lambda: list(db['teams'].find(id=page)),
+             lambda: queries.get_teams(page)),
+        ]
+
+        print('%-18s %14s %14s' % ('helper', 'dataset (us)', 'queries (us)'))
+        for name, old, new in cases:
+            old()
+            new()
+            print('%-18s %14.1f %14.1f' % (name, timeit(old, repeat), timeit(new, repeat)))
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_catalog(tasks=60, repeat=2000):
+    """Task metadata of a task page view, read from the database and from the catalog"""
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'ctf.db')
+        url = 'sqlite:///' + path
+        migrate.upgrade(url)
+        fill_db(path, comps=1, teams=50, tasks=tasks, attempts=0)
+        db = storage.connect(url, readonly=True)
+        queries = Queries(db.engine)
+        catalogs = CatalogRegistry(lambda comp_id: (queries.get_categories(), queries.get_competition_tasks(comp_id)))
+
+        def database():
+            queries.get_categories()
+            sorted(queries.get_competition_tasks(1), key=lambda x: x['score'])
+            queries.get_task(7)
+            queries.get_comp_score(1)
+
+        def catalog():
+            catalog = catalogs.get(1)
+            catalog.get(7)
+            catalog.total_score
+
+        print('database  %8.1f us per page view' % timeit(database, repeat))
+        print('catalog   %8.1f us per page view' % timeit(catalog, repeat))
+        print('rebuild   %8.1f us per edit' % timeit(lambda: (catalogs.invalidate(1), catalogs.get(1)), repeat // 10))
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_aggregates(repeat=2000):
+    """Cost of the competition counters read on every page, counted and kept, and of a full check"""
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'ctf.db')
+        url = 'sqlite:///' + path
+        migrate.upgrade(url)
+        n_teams, n_users = fill_db(path)
+        db = storage.connect(url)
+        print('%d teams, %d users, %d counters fixed after the fill' % (
+            n_teams, n_users, len(aggregates.check(db.engine, fix=True))))
+
+        counted = dict(aggregates.COUNTS)
+        conn = sqlite3.connect(path)
+        for name in ('points', 'players'):
+            query = 'SELECT (%s) FROM competitions WHERE id = 2' % counted[name]
+            kept = 'SELECT %s FROM competitions WHERE id = 2' % name
+            print('%-8s counted %8.1f us, kept %6.1f us' % (
+                name, timeit(lambda: conn.execute(query).fetchone(), repeat),
+                timeit(lambda: conn.execute(kept).fetchone(), repeat)))
+        conn.close()
+
+        start = time.time()
+        drift = aggregates.check(db.engine)
+        print('check of every competition: %.1f ms, %d counters drifted' % ((time.time() - start) * 1000, len(drift)))
+    finally:
+        shutil.rmtree(directory)
+
+
+TEAM_SOLVES = '''
+    SELECT f.task_id, tp.team_id, min(f.timestamp) AS timestamp
+    FROM flags f
+    JOIN team_player tp ON tp.user_id = f.user_id
+    JOIN teams t ON t.id = tp.team_id AND t.comp_id = f.comp_id AND t.spectator = 0
+    WHERE f.comp_id = :comp_id
+    GROUP BY f.task_id, tp.team_id
+'''
+
+
+def bench_task_stats(repeat=200):
+    """Task statistics of a competition counted from the flags, and read from the kept tables"""
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'ctf.db')
+        url = 'sqlite:///' + path
+        migrate.upgrade(url)
+        n_teams, n_users = fill_db(path, comps=1, teams=2000, tasks=40)
+        conn = sqlite3.connect(path)
+        solves = conn.execute('SELECT count(*) FROM flags').fetchone()[0]
+        conn.execute('INSERT INTO task_stats (comp_id, task_id, solves, first_team_id, first_timestamp) '
+                     'SELECT 1, task_id, count(*), min(team_id), min(timestamp) FROM (%s) GROUP BY task_id' % TEAM_SOLVES,
+                     {'comp_id': 1})
+        conn.execute('INSERT INTO task_solve_hours (comp_id, task_id, hour, solves) '
+                     'SELECT 1, task_id, timestamp / 3600000, count(*) FROM (%s) GROUP BY task_id, timestamp / 3600000' % TEAM_SOLVES,
+                     {'comp_id': 1})
+        conn.commit()
+
+        def counted():
+            conn.execute('SELECT task_id, count(*), min(timestamp) FROM (%s) GROUP BY task_id' % TEAM_SOLVES,
+                         {'comp_id': 1}).fetchall()
+            conn.execute('SELECT timestamp / 3600000, count(*) FROM (%s) GROUP BY timestamp / 3600000' % TEAM_SOLVES,
+                         {'comp_id': 1}).fetchall()
+
+        queries = Queries(storage.connect(url, readonly=True).engine)
+
+        def kept():
+            queries.get_task_stats(1)
+            queries.get_solve_hours(1)
+
+        print('%d teams, %d flags, 40 tasks' % (n_teams, solves))
+        print('counted from flags %8.1f us per view' % timeit(counted, repeat))
+        print('kept tables        %8.1f us per view' % timeit(kept, repeat))
+        conn.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def legacy_recompute(conn, comp_id, start, end):
+    """Team scores rebuilt row by row, one query and one update per team"""
+
+    values = dict(conn.execute('SELECT task_id, score FROM task_competition WHERE comp_id = ?', (comp_id,)))
+    for (team_id,) in conn.execute('SELECT id FROM teams WHERE comp_id = ?', (comp_id,)).fetchall():
+        score = timestamp = 0
+        for task_id, solved in conn.execute(
+                'SELECT f.task_id, min(f.timestamp) FROM flags f JOIN team_player tp ON tp.user_id = f.user_id '
+                'WHERE tp.team_id = ? AND f.comp_id = ? GROUP BY f.task_id', (team_id, comp_id)):
+            if task_id in values and solved > start and (end is None or solved < end):
+                score += values[task_id]
+                timestamp = max(timestamp, solved)
+        conn.execute('UPDATE teams SET score = ?, timestamp = ? WHERE id = ?', (score, timestamp, team_id))
+
+
+def bench_recompute(teams=10000, players=2, tasks=40):
+    """Scores of every team of a competition rebuilt after task values changed"""
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'ctf.db')
+        url = 'sqlite:///' + path
+        migrate.upgrade(url)
+        fill_db(path, comps=1, teams=teams, players=players, tasks=tasks, attempts=0)
+        engine = storage.connect(url).engine
+        conn = sqlite3.connect(path)
+        solves = conn.execute('SELECT count(*) FROM flags').fetchone()[0]
+        print('%d teams, %d flags, %d tasks' % (teams, solves, tasks))
+
+        def rescore():
+            conn.execute('UPDATE task_competition SET score = abs(random() % 500) + 1')
+            conn.commit()
+
+        rescore()
+        start = time.time()
+        legacy_recompute(conn, 1, 0, None)
+        conn.commit()
+        legacy = time.time() - start
+        expected = conn.execute('SELECT id, score, timestamp FROM teams ORDER BY id').fetchall()
+
+        conn.execute('UPDATE teams SET score = 0, timestamp = 0')
+        conn.commit()
+        start = time.time()
+        with engine.begin() as connection:
+            scoring.rebuild_solvers(connection, 1, 0, None)
+            changed = scoring.recompute(connection, 1)
+        elapsed = time.time() - start
+        same = conn.execute('SELECT id, score, timestamp FROM teams ORDER BY id').fetchall() == expected
+
+        rescore()
+        start = time.time()
+        with engine.begin() as connection:
+            edited = scoring.recompute(connection, 1)
+        after_edit = time.time() - start
+
+        print('row by row               %7.0f ms' % (legacy * 1000))
+        print('solver sets and scores   %7.0f ms, %d teams changed, same scores: %s' % (elapsed * 1000, changed, same))
+        print('scores after task edits  %7.0f ms, %d teams changed' % (after_edit * 1000, edited))
+        conn.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def legacy_dynamic_submit(conn, model, task_id, team_id, user_id, points, timestamp):
+    """A decaying solve rescoring every solver of the task one by one"""
+
+    conn.execute('BEGIN IMMEDIATE')
+    conn.execute('INSERT INTO flags VALUES (?, ?, 1, ?)', (task_id, user_id, timestamp))
+    solvers = [row[0] for row in conn.execute(
+        'SELECT team_id FROM task_solves WHERE comp_id = 1 AND task_id = ?', (task_id,))]
+    solvers.append(team_id)
+    conn.execute('INSERT INTO task_solves VALUES (1, ?, ?, 1, ?)', (task_id, team_id, timestamp))
+    value = model.value(points, len(solvers))
+    for solver in solvers:
+        old = conn.execute('SELECT score FROM teams WHERE id = ?', (solver,)).fetchone()[0]
+        previous = model.value(points, len(solvers) - 1) if solver != team_id else 0
+        conn.execute('UPDATE teams SET score = ? WHERE id = ?', (old - previous + value, solver))
+    conn.execute('UPDATE teams SET timestamp = ? WHERE id = ?', (timestamp, team_id))
+    conn.execute('COMMIT')
+
+
+def bench_dynamic(teams=5000, window=500):
+    """
+    Every team solving one decaying task in turn, so the last solves move
+    thousands of earlier solvers. Checks the scores and the ranking.
+    """
+
+    model = scoring.LinearDecay(decay=teams, minimum=10)
+    directory = tempfile.mkdtemp()
+    try:
+        for name in ('row by row', 'batched'):
+            path = os.path.join(directory, 'ctf.db')
+            if os.path.exists(path):
+                os.remove(path)
+            create_db(path, teams, 1, 1)
+            ranking = RankIndex((t, 0, 0) for t in range(teams))
+            latencies = []
+
+            if name == 'row by row':
+                conn = sqlite3.connect(path, isolation_level=None)
+                for t in range(teams):
+                    start = time.time()
+                    legacy_dynamic_submit(conn, model, 0, t, t, 500, t + 1)
+                    latencies.append(time.time() - start)
+                for team_id, score, timestamp in conn.execute('SELECT id, score, timestamp FROM teams'):
+                    ranking.update(team_id, score, timestamp)
+                conn.close()
+            else:
+                engine = create_engine('sqlite:///' + path, connect_args={'check_same_thread': False})
+                solves = SubmissionEngine(engine)
+                for t in range(teams):
+                    def update_ranking(score, timestamp, moved, team_id=t):
+                        ranking.update(team_id, score, timestamp)
+                        ranking.update_many(row[:3] for row in moved)
+
+                    start = time.time()
+                    solves.record(1, 0, t, t, 500, t + 1, on_scored=update_ranking, model=model)
+                    latencies.append(time.time() - start)
+
+            conn = sqlite3.connect(path)
+            expected = model.value(500, teams)
+            wrong = conn.execute('SELECT count(*) FROM teams WHERE score != ?', (expected,)).fetchone()[0]
+            ordered = [team_id for team_id, rank in ranking.page(0, teams)] == list(range(teams))
+            conn.close()
+
+            last = latencies[-window:]
+            print('%-10s %d solves in %6.2fs, last %d: %6.2f ms per solve, %d wrong scores, ranking %s' % (
+                name, teams, sum(latencies), window, sum(last) / len(last) * 1000, wrong,
+                'ok' if ordered else 'wrong'))
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_ratelimit(keys=100000, checks=200000, workers=4):
+    """Cost of one token bucket check, alone and with several processes"""
+
+    directory = tempfile.mkdtemp()
+    try:
+        buckets = TokenBuckets(os.path.join(directory, 'buckets'))
+        names = ['team:%d' % i for i in range(keys)]
+
+        def run():
+            for i in range(checks):
+                buckets.take(names[i % keys], 1.0, 10)
+
+        start = time.time()
+        run()
+        single = (time.time() - start) / checks * 1e6
+        print('1 process:  %.2f us per check' % single)
+
+        start = time.time()
+        children = []
+        for _ in range(workers):
+            pid = os.fork()
+            if pid == 0:
+                run()
+                os._exit(0)
+            children.append(pid)
+        for pid in children:
+            os.waitpid(pid, 0)
+        elapsed = time.time() - start
+        print('%d processes: %.2f us per check, %.0f checks/s in total' % (
+            workers, elapsed / checks * 1e6, workers * checks / elapsed))
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_provisioning(users=200, useradd=0.05, threads=8, workers=2):
+    """
+    Registration latency with the shell account created inline, as before,
+    and with it queued, against a stand-in for useradd that sleeps
+    """
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'ctf.db')
+        migrate.upgrade('sqlite:///' + path)
+        db = storage.connect('sqlite:///' + path, {'journal_mode': 'WAL', 'synchronous': 'NORMAL',
+                                                   'busy_timeout': 5000, 'pool_size': threads})
+
+        def create_account(username, password_hash):
+            time.sleep(useradd)
+
+        queue = ProvisioningQueue(db.engine, create_account)
+
+        def register(name, inline):
+            start = time.time()
+            user_id = db['users'].insert(dict(username=name, shell_username=name))
+            if inline:
+                create_account(name, 'x')
+            else:
+                queue.enqueue(user_id, name, 'x')
+            return time.time() - start
+
+        for inline in (True, False):
+            label = 'inline' if inline else 'queued'
+            latencies = []
+
+            def client(t):
+                for i in range(t, users, threads):
+                    latencies.append(register('%s%d' % (label, i), inline))
+
+            start = time.time()
+            clients = [threading.Thread(target=client, args=(t,)) for t in range(threads)]
+            for thread in clients:
+                thread.start()
+            for thread in clients:
+                thread.join()
+            elapsed = time.time() - start
+            latencies.sort()
+            print('%s: %.0f registrations/s, median %.1f ms, p99 %.1f ms' % (
+                label, users / elapsed, latencies[len(latencies) // 2] * 1000,
+                latencies[len(latencies) * 99 // 100] * 1000))
+
+        start = time.time()
+        queue.start(workers)
+        while queue.unfinished():
+            time.sleep(0.05)
+        print('        %d accounts created by %d workers in %.1f s' % (users, workers, time.time() - start))
+    finally:
+        shutil.rmtree(directory)
+
+
+def legacy_execute(cmd, timeout=60):
+    """utils.execute before the execution engine, spinning on is_running"""
+
+    from spur import LocalShell
+
+    process = LocalShell().spawn(cmd, store_pid=True)
+    start_time = time.time()
+    while process.is_running():
+        if time.time() - start_time > timeout:
+            process.send_signal(9)
+            raise RuntimeError(cmd)
+    return process.wait_for_result()
+
+
+def bench_execute(commands=20, duration=0.1, batch=40, concurrency=8):
+    """CPU time spent waiting on a command, and throughput of a batch"""
+
+    def cpu():
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_utime + usage.ru_stime
+
+    cmd = ['sleep', str(duration)]
+    for label, run in (('legacy', legacy_execute), ('execute', execute)):
+        start, used = time.time(), cpu()
+        for _ in range(commands):
+            run(cmd)
+        print('%-8s %.1f ms CPU per command of %.0f ms' % (
+            label, (cpu() - used) / commands * 1000, (time.time() - start) / commands * 1000))
+
+    start = time.time()
+    for _ in range(batch):
+        legacy_execute(cmd)
+    print('legacy   batch of %d: %.1f commands/s' % (batch, batch / (time.time() - start)))
+
+    start = time.time()
+    execute_all([cmd] * batch, concurrency=concurrency)
+    print('execute  batch of %d, %d at a time: %.1f commands/s' % (
+        batch, concurrency, batch / (time.time() - start)))
+
+
+def bench_roster(users=10000, team_size=3):
+    """
+    Registration of a roster through roster.py, with the passwords hashed
+    on one core and on all of them, against one register form per user
+    """
+
+    from werkzeug.security import generate_password_hash
+    from utils import hash_password
+
+    rows = [dict(username='user%d' % i, password='password%d' % i, team='team%d' % (i // team_size))
+            for i in range(users)]
+
+    for label, processes in (('form', None), ('1 process', 1), ('all %d cores' % multiprocessing.cpu_count(), None)):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'ctf.db')
+            migrate.upgrade('sqlite:///' + path)
+            conn = sqlite3.connect(path)
+            conn.execute("INSERT INTO competitions (id, secret, spectator_secret, teams) VALUES (1, 's', 'v', 0)")
+            conn.commit()
+            conn.close()
+            db = storage.connect('sqlite:///' + path, {'journal_mode': 'WAL', 'synchronous': 'NORMAL'})
+            queue = ProvisioningQueue(db.engine, None)
+
+            start = time.time()
+            if label == 'form':
+                # What /login and team-register do for every participant
+                team_ids = {}
+                for row in rows:
+                    user_id = db['users'].insert(dict(username=row['username'], admin=False,
+                                                      password=generate_password_hash(row['password']),
+                                                      shell_username=row['username']))
+                    queue.enqueue(user_id, row['username'], hash_password(row['password']))
+                    if row['team'] not in team_ids:
+                        team_ids[row['team']] = db['teams'].insert(dict(name=row['team'], comp_id=1, secret='x',
+                                                                        spectator=False, score=0, timestamp=0))
+                        competition = db['competitions'].find_one(id=1)
+                        competition['teams'] += 1
+                        db['competitions'].update(competition, ['id'])
+                    db['team_player'].insert(dict(team_id=team_ids[row['team']], user_id=user_id))
+            else:
+                import_roster(db.engine, 1, rows, queue, processes)
+            elapsed = time.time() - start
+            print('%-12s %d users in %.1f s, %.0f users/s' % (label, users, elapsed, users / elapsed))
+        finally:
+            shutil.rmtree(directory)
+
+
+def bench_passwords(logins=2000, window=60, checks=20, threads=4):
+    """
+    Logins per second per core for each hash cost, through the helpers of
+    PasswordHasher, and the cores a wave of logins needs
+    """
+
+    from werkzeug.security import generate_password_hash, check_password_hash
+
+    cores = multiprocessing.cpu_count()
+    settings = [('pbkdf2:sha1', 1000)] + [('pbkdf2:sha256', i) for i in (1000, 5000, 10000, 50000)]
+    print('%d logins in %d s' % (logins, window))
+    for method, iterations in settings:
+        hasher = PasswordHasher(method, iterations, processes=cores, wait=3600)
+        pwhash = generate_password_hash('password', hasher.method)
+
+        start = time.time()
+        for _ in range(checks):
+            check_password_hash(pwhash, 'password')
+        per_core = checks / (time.time() - start)
+
+        def client():
+            for _ in range(checks // threads + 1):
+                hasher.check(pwhash, 'password')
+
+        clients = [threading.Thread(target=client) for _ in range(threads)]
+        start = time.time()
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        pooled = len(clients) * (checks // threads + 1) / (time.time() - start)
+
+        print('%-20s %6.1f logins/s per core, %6.1f logins/s with %d helpers, %d cores needed' % (
+            hasher.method, per_core, pooled, cores, math.ceil(logins / (per_core * window))))
+
+
+def bench_attachments(size=64 * 2 ** 20, tasks=5, downloads=5):
+    """
+    Disk used by the same attachment uploaded for several tasks, and worker
+    time per download when the worker streams it or nginx does
+    """
+
+    from io import BytesIO
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'ctf.db')
+        migrate.upgrade('sqlite:///' + path)
+        db = storage.connect('sqlite:///' + path)
+        store = AttachmentStore(db.engine, os.path.join(directory, 'attachments'))
+        content = os.urandom(size)
+
+        start = time.time()
+        for _ in range(tasks):
+            digest = store.add(BytesIO(content))
+        elapsed = time.time() - start
+        print('%d uploads of %d MB: %.0f MB/s, %d MB stored instead of %d MB' % (
+            tasks, size >> 20, tasks * size / elapsed / 2 ** 20,
+            os.path.getsize(store.path(digest)) >> 20, tasks * size >> 20))
+
+        start = time.time()
+        for _ in range(downloads):
+            with open(store.path(digest), 'rb') as f:
+                while f.read(AttachmentStore.chunk_size):
+                    pass
+        print('worker streaming: %.1f ms per download' % ((time.time() - start) / downloads * 1000))
+
+        start = time.time()
+        for _ in range(downloads):
+            store.exists(digest)
+        print('X-Accel-Redirect: %.3f ms per download' % ((time.time() - start) / downloads * 1000))
+    finally:
+        shutil.rmtree(directory)
+
+
+class MultipartBody(object):
+    """A multipart body with one file of `size` bytes, generated as it is read"""
+
+    boundary = 'benchboundary'
+
+    def __init__(self, size):
+        self.head = ('--%s\r\nContent-Disposition: form-data; name="task-file"; filename="disk.img"\r\n'
+                     'Content-Type: application/octet-stream\r\n\r\n' % self.boundary).encode('ascii')
+        self.tail = ('\r\n--%s--\r\n' % self.boundary).encode('ascii')
+        self.length = len(self.head) + size + len(self.tail)
+        self._remaining = size
+        self._block = os.urandom(2 ** 20)
+        self._pending = self.head
+
+    def read(self, size=-1):
+        while len(self._pending) < size and (self._remaining or self.tail):
+            if self._remaining:
+                block = self._block[:self._remaining]
+                self._remaining -= len(block)
+                self._pending += block
+            else:
+                self._pending += self.tail
+                self.tail = b''
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+
+def bench_upload(size=2 * 2 ** 30):
+    """
+    Time and peak memory of an attachment upload parsed by werkzeug, with
+    its default spooled file copied into the store, and with the file
+    written straight into the store
+    """
+
+    from werkzeug.formparser import parse_form_data, default_stream_factory
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'ctf.db')
+        migrate.upgrade('sqlite:///' + path)
+
+        for label in ('copied', 'streamed'):
+            pid = os.fork()
+            if pid == 0:
+                db = storage.connect('sqlite:///' + path)
+                store = AttachmentStore(db.engine, os.path.join(directory, label))
+                factory = default_stream_factory
+                if label == 'streamed':
+                    factory = lambda *args, **kwargs: store.upload()
+
+                body = MultipartBody(size)
+                environ = {'REQUEST_METHOD': 'POST', 'wsgi.input': body, 'CONTENT_LENGTH': str(body.length),
+                           'CONTENT_TYPE': 'multipart/form-data; boundary=' + body.boundary}
+                start = time.time()
+                stream, form, files = parse_form_data(environ, stream_factory=factory)
+                store.add(files['task-file'].stream)
+                files['task-file'].close()
+                elapsed = time.time() - start
+                with open('/proc/self/io') as f:
+                    written = int(dict(line.split(': ') for line in f.read().splitlines())['wchar'])
+                print('%-9s %d MB in %.1f s, %.0f MB/s, %d MB written, peak RSS %d MB' % (
+                    label, size >> 20, elapsed, size / elapsed / 2 ** 20, written >> 20,
+                    resource.getrusage(resource.RUSAGE_SELF).ru_maxrss >> 10))
+                sys.stdout.flush()
+                os._exit(0)
+            os.waitpid(pid, 0)
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_explorer(categories=6, tasks=60, views=500):
+    """Render time of a competition page with the explorer rendered for every view and cached"""
+
+    import json
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'ctf.db')
+        url = 'sqlite:///' + path
+        migrate.upgrade(url)
+        fill_db(path, comps=1, teams=50, tasks=tasks, attempts=0)
+        conn = sqlite3.connect(path)
+        conn.execute("UPDATE competitions SET active = 1, teams = 50, "
+                     "date_start = '2000-01-01 00:00', date_end = '2100-01-01 00:00'")
+        conn.executemany('INSERT OR REPLACE INTO categories (id, name) VALUES (?, ?)',
+                         [(c, 'category%d' % c) for c in range(1, categories + 1)])
+        conn.execute('UPDATE tasks SET category = 1 + id %% %d' % categories)
+        conn.commit()
+        conn.close()
+
+        with open(os.path.join(here, 'config.json')) as f:
+            config = json.load(f)
+        config.pop('rate_limits', None)
+        config.update(db=url, debug=False, language_file=os.path.join(here, config['language_file']))
+        config['channel']['file'] = os.path.join(directory, 'channel')
+        config['attachments']['path'] = os.path.join(directory, 'attachments')
+        with open(os.path.join(directory, 'config.json'), 'w') as f:
+            json.dump(config, f)
+
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.chdir(directory)
+                os.environ['SECRETKEY'] = 'bench'
+                import server
+                client = server.app.test_client()
+                with client.session_transaction() as session:
+                    session['user_id'] = 1
+
+                page = client.get('/competition/1/stats')
+                assert page.status_code == 200 and page.data.count(b'task-explorer content-load') > tasks
+
+                cached = server.explorers.get
+                for label, get in (('rendered', lambda key, version: None), ('cached', cached)):
+                    server.explorers.get = get
+                    elapsed = timeit(lambda: client.get('/competition/1/stats'), views)
+                    print('%-9s %.2f ms per page view' % (label, elapsed / 1000))
+                sys.stdout.flush()
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+    finally:
+        shutil.rmtree(directory)
+
+
+def http_client(port, path, form, cookie=None):
+    """Returns a function making one request on a kept-alive connection"""
+
+    try:
+        from httplib import HTTPConnection
+        from urllib import urlencode
+    except ImportError:
+        from http.client import HTTPConnection
+        from urllib.parse import urlencode
+
+    state = {'connection': HTTPConnection('127.0.0.1', port, timeout=30)}
+    body = urlencode(form)
+    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+    if cookie:
+        headers['Cookie'] = cookie
+
+    def request(path=path, body=body):
+        try:
+            state['connection'].request('POST', path, body, headers)
+            response = state['connection'].getresponse()
+        except Exception:
+            state['connection'].close()
+            state['connection'] = HTTPConnection('127.0.0.1', port, timeout=30)
+            raise
+        return response.status, response.getheader('Set-Cookie'), response.read(), response.getheader('ETag')
+    return request
+
+
+def login(port, username, password):
+    status, cookie = http_client(port, '/login', {
+        'username': username, 'password': password, 'login-button': ''})()[:2]
+    return cookie.split(';')[0]
+
+
+def load_client(port, cookie, route, tasks, duration, results):
+    """Sends requests of one kind back to back, then reports how many succeeded"""
+
+    if route == 'leaderboard':
+        request = http_client(port, '/competition/1/leaderboard/0', {}, cookie)
+        send = lambda: request()
+    else:
+        request = http_client(port, None, {}, cookie)
+
+        def send():
+            task_id = random.randint(1, tasks)
+            return request('/competition/1/task/%d/submit' % task_id, 'flag=flag%d' % task_id)
+
+    done = errors = 0
+    end = time.time() + duration
+    while time.time() < end:
+        try:
+            status = send()[0]
+        except Exception:
+            status = None
+        if status == 200:
+            done += 1
+        else:
+            errors += 1
+    results.put((done, errors))
+
+
+def bench_workers(workers=(1, 2, 4), clients=16, duration=10, teams=200, players=3, tasks=20):
+    """
+    Throughput of the leaderboard and submit routes under gunicorn with a
+    growing number of preloaded workers, then a check that every worker
+    serves the same leaderboard.
+    """
+
+    import json
+    import multiprocessing
+    import socket
+    import subprocess
+    from werkzeug.security import generate_password_hash
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'ctf.db')
+        url = 'sqlite:///' + path
+        migrate.upgrade(url)
+        fill_db(path, comps=1, teams=teams, players=players, tasks=tasks, attempts=0)
+        conn = sqlite3.connect(path)
+        conn.execute("UPDATE competitions SET active = 1, teams = (SELECT count(*) FROM teams), date_start = '2000-01-01 00:00', date_end = '2100-01-01 00:00'")
+        conn.execute('UPDATE users SET password = ?', (generate_password_hash('password'),))
+        conn.commit()
+        conn.close()
+
+        with open(os.path.join(here, 'config.json')) as f:
+            config = json.load(f)
+        config.pop('rate_limits', None)
+        config.update(db=url, debug=False, language_file=os.path.join(here, config['language_file']))
+        config['channel']['file'] = os.path.join(directory, 'channel')
+        with open(os.path.join(directory, 'config.json'), 'w') as f:
+            json.dump(config, f)
+
+        print('%-8s %18s %18s' % ('workers', 'leaderboard req/s', 'submit req/s'))
+        for n in workers:
+            sock = socket.socket()
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+            sock.close()
+
+            env = dict(os.environ, SECRETKEY='bench', WORKERS=str(n))
+            server = subprocess.Popen(
+                [sys.executable, '-m', 'gunicorn.app.wsgiapp', '--config', os.path.join(here, 'config', 'gunicorn.conf.py'),
+                 '--bind', '127.0.0.1:%d' % port, '--chdir', directory, '--pythonpath', here,
+                 '--log-level', 'warning', 'server:app'],
+                env=env)
+            try:
+                for _ in range(100):
+                    try:
+                        socket.create_connection(('127.0.0.1', port)).close()
+                        break
+                    except socket.error:
+                        time.sleep(0.1)
+
+                cookies = [login(port, 'user%d' % (i * players + 1), 'password') for i in range(clients)]
+                rates = []
+                for route in ('leaderboard', 'submit'):
+                    results = multiprocessing.Queue()
+                    procs = [multiprocessing.Process(target=load_client,
+                                                     args=(port, cookie, route, tasks, duration, results))
+                             for cookie in cookies]
+                    for p in procs:
+                        p.start()
+                    counts = [results.get() for _ in procs]
+                    for p in procs:
+                        p.join()
+                    rates.append(sum(done for done, errors in counts) / float(duration))
+                print('%-8d %18.0f %18.0f' % (n, rates[0], rates[1]))
+
+                # Every worker must have applied the solves of the others,
+                # and tag the page alike
+                leaderboard = http_client(port, '/competition/1/leaderboard/0', {}, cookies[0])
+                responses = [leaderboard() for _ in range(20 * n)]
+                print('         %d distinct leaderboard pages, %d ETags in %d requests' % (
+                    len(set(r[2] for r in responses)), len(set(r[3] for r in responses)), 20 * n))
+            finally:
+                server.terminate()
+                server.wait()
+    finally:
+        shutil.rmtree(directory)
+
+
+benchmarks = {
+    'rank': bench_rank,
+    'events': bench_events,
+    'submit': bench_submit,
+    'ratelimit': bench_ratelimit,
+    'provisioning': bench_provisioning,
+    'execute': bench_execute,
+    'roster': bench_roster,
+    'passwords': bench_passwords,
+    'attachments': bench_attachments,
+    'upload': bench_upload,
+    'explorer': bench_explorer,
+    'storage': bench_storage,
+    'plans': bench_plans,
+    'queries': bench_queries,
+    'catalog': bench_catalog,
+    'aggregates': bench_aggregates,
+    'task_stats': bench_task_stats,
+    'recompute': bench_recompute,
+    'dynamic': bench_dynamic,
+    'workers': bench_workers,
+}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in benchmarks:
+        print(__doc__)
+        print('Benchmarks: ' + ', '.join(sorted(benchmarks)))
+        sys.exit(1)
+
+    benchmarks[sys.argv[1]]()
@@ -0,0 +1,244 @@
+"""
+Small in-process caches.
+"""
+
+from datetime import datetime
+from threading import Lock
+
+
+DATE_FORMAT = '%Y-%m-%d %H:%M'
+
+UPCOMING = 'upcoming'
+RUNNING = 'running'
+ENDED = 'ended'
+
+
+class VersionedCache(object):
+    """
+    Keeps only the newest version of each entry: storing a new version of a
+    key replaces the old one, so the cache never outgrows its key space.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = Lock()
+
+    def get(self, key, version):
+        """Returns the value stored for (key, version) or None"""
+
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != version:
+            return None
+        return entry[1]
+
+    def set(self, key, version, value):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= version:
+                self._entries[key] = (version, value)
+        return value
+
+    def invalidate(self, match=None):
+        """Drops every entry, or the ones whose key satisfies match(key)"""
+
+        with self._lock:
+            if match is None:
+                self._entries.clear()
+            else:
+                for key in [k for k in self._entries if match(k)]:
+                    del self._entries[key]
+
+
+class Versions(object):
+    """
+    Version numbers of keys, e.g. the channel sequence number of the last
+    change to a competition. Bumping the None key bumps every key.
+    """
+
+    def __init__(self):
+        self._versions = {}
+        self._lock = Lock()
+
+    def get(self, key):
+        return max(self._versions.get(key, 0), self._versions.get(None, 0))
+
+    def bump(self, key, version):
+        with self._lock:
+            if self._versions.get(key, 0) < version:
+                self._versions[key] = version
+
+
+def make_etag(*parts):
+    """
+    Builds a strong entity tag from parts. Versions in it must be the same
+    in every worker and never reused, e.g. channel sequence numbers with
+    the epoch of the channel.
+    """
+
+    return '-'.join(str(p) for p in parts)
+
+
+_parsed_dates = {}
+
+
+def parse_date(date):
+    """
+    Parses a stored '%Y-%m-%d %H:%M' date, remembering the result.
+    Returns None for empty dates.
+    """
+
+    if not date:
+        return None
+
+    parsed = _parsed_dates.get(date)
+    if parsed is None:
+        if len(_parsed_dates) > 4096:
+            _parsed_dates.clear()
+        parsed = _parsed_dates[date] = datetime.strptime(date, DATE_FORMAT)
+    return parsed
+
+
+class CompetitionInfo(object):
+    """A competition row together with its parsed schedule"""
+
+    __slots__ = ('row', 'active', 'start', 'end')
+
+    def __init__(self, row):
+        self.row = row
+        self.active = bool(row['active'])
+        self.start = parse_date(row['date_start'])
+        self.end = parse_date(row['date_end'])
+
+    def state(self, now=None):
+        """Returns UPCOMING, RUNNING or ENDED at now (UTC)"""
+
+        if now is None:
+            now = datetime.utcnow()
+
+        if not self.active or self.start is None or now <= self.start:
+            return UPCOMING
+        if self.end is None or now < self.end:
+            return RUNNING
+        return ENDED
+
+
+class Registry(object):
+    """
+    Lazily builds one value per competition and keeps it until a route or a
+    channel message invalidates it.
+
+    Values are built without the lock, so a slow load does not hold up the
+    other competitions. A value built while an invalidation happened may
+    predate the change behind it: it serves the request that built it, but
+    is not kept, and the next request builds a new one. Changes applied
+    while a value is being built are replayed on it once it is kept.
+    """
+
+    def __init__(self, loader=None):
+        """
+        Args:
+            loader: callable taking a comp_id, whose result build() turns
+                    into the value of the competition
+        """
+
+        self._loader = loader
+        self._values = {}
+        # Changes to replay on the values being built, by comp_id
+        self._changes = {}
+        self._generation = 0
+        self._lock = Lock()
+
+    def build(self, comp_id):
+        """Returns the value of a competition, or None to keep nothing"""
+
+        raise NotImplementedError
+
+    def get(self, comp_id):
+        comp_id = int(comp_id)
+        value = self._values.get(comp_id)
+        if value is not None:
+            return value
+
+        with self._lock:
+            generation = self._generation
+            self._changes.setdefault(comp_id, [])
+        value = self.build(comp_id)
+        with self._lock:
+            if value is None:
+                self._changes.pop(comp_id, None)
+                return None
+            if generation != self._generation:
+                return value
+            kept = self._values.get(comp_id)
+            if kept is not None:
+                return kept
+            self._values[comp_id] = value
+            changes = self._changes.pop(comp_id, [])
+        for change in changes:
+            change(value)
+        return value
+
+    def peek(self, comp_id):
+        """Returns the value of a competition if it is kept, else None"""
+
+        return self._values.get(int(comp_id))
+
+    def apply(self, comp_id, change):
+        """
+        Calls change(value) with the value of a competition if it is kept.
+        While the value is being built, change is called once it is kept
+        instead; otherwise the next build sees the change anyway.
+        """
+
+        comp_id = int(comp_id)
+        with self._lock:
+            value = self._values.get(comp_id)
+            if value is None:
+                if comp_id in self._changes:
+                    self._changes[comp_id].append(change)
+                return
+        change(value)
+
+    def values(self):
+        with self._lock:
+            return list(self._values.values())
+
+    def invalidate(self, comp_id=None):
+        """Drops the value of a competition, or of all of them"""
+
+        with self._lock:
+            self._generation += 1
+            if comp_id is None:
+                self._values.clear()
+                self._changes.clear()
+            else:
+                self._values.pop(int(comp_id), None)
+                self._changes.pop(int(comp_id), None)
+
+
+class CompetitionCache(Registry):
+    """
+    Keeps the CompetitionInfo of every competition that has been looked up
+    until it is explicitly invalidated by a route that writes to it.
+    """
+
+    def __init__(self, loader):
+        """
+        Args:
+            loader: callable taking a comp_id and returning its row or None
+        """
+
+        Registry.__init__(self, loader)
+
+    def build(self, comp_id):
+        row = self._loader(comp_id)
+        return CompetitionInfo(row) if row is not None else None
+
+    def get(self, comp_id):
+        """Returns the CompetitionInfo of a competition, or None"""
+
+        try:
+            comp_id = int(comp_id)
+        except ValueError:
+            return None
+        return Registry.get(self, comp_id)
@@ -0,0 +1,66 @@
+"""
+In-memory categories and tasks of the competitions.
+"""
+
+from cache import Registry
+
+
+class Catalog(object):
+    """
+    The categories and tasks of one competition, with the tasks sorted by
+    score, grouped by category and indexed by id.
+
+    A catalog is never changed once built. An edit builds a new one, so a
+    request keeps reading the catalog it started with, without locks.
+    """
+
+    def __init__(self, categories=(), tasks=()):
+        """
+        Args:
+            categories: every category, in display order
+            tasks: the tasks of the competition with their score, without
+                   their flag
+        """
+
+        self.categories = tuple(categories)
+        self.tasks = tuple(sorted(tasks, key=lambda task: task['score']))
+        self.total_score = sum(task['score'] or 0 for task in self.tasks)
+
+        self._by_id = {}
+        self._by_category = {}
+        for task in self.tasks:
+            self._by_id[task['id']] = task
+            self._by_category.setdefault(task['category'], []).append(task)
+
+    def get(self, task_id):
+        """Returns a task of the competition by id, or None"""
+
+        try:
+            return self._by_id.get(int(task_id))
+        except (TypeError, ValueError):
+            return None
+
+    def category_tasks(self, category_id):
+        """Returns the tasks of a category, by score"""
+
+        return self._by_category.get(category_id, ())
+
+
+class CatalogRegistry(Registry):
+    """
+    Lazily builds one Catalog per competition. Admin routes that change
+    tasks or their competition mapping invalidate it, and the next request
+    builds the new one.
+    """
+
+    def __init__(self, loader):
+        """
+        Args:
+            loader: callable taking a comp_id and returning the categories
+                    and the tasks of the competition
+        """
+
+        Registry.__init__(self, loader)
+
+    def build(self, comp_id):
+        return Catalog(*self._loader(comp_id))
@@ -0,0 +1,226 @@
+"""
+Broadcast of cache invalidations and events between worker processes.
+"""
+
+import fcntl
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+
+log = logging.getLogger(__name__)
+
+
+class Channel(object):
+    """
+    An ordered log of small JSON messages that every worker process reads.
+
+    Messages live in a ring of fixed-size slots in a memory-mapped file, so
+    workers sharing the file need no broker. A writer takes a byte range
+    lock on the header, writes the next slot and then bumps the sequence
+    number in the header. Every worker reads slots up to that number, in
+    order, from its own position: all workers see all messages in the same
+    order, and the sequence number of a message can be used as its id
+    everywhere.
+
+    A worker that falls more than a ring behind has missed messages and
+    gets an overflow callback instead, after which it should drop whatever
+    the lost messages may have invalidated.
+
+    Without a path the channel only delivers to the current process, which
+    is what a single worker needs.
+
+    Sequence numbers start over with a new file, or a new process without
+    one. The random epoch of the channel tells them apart from the ones of
+    an earlier file or process.
+    """
+
+    header = struct.Struct('=QQ')   # sequence number of the last message from 1, epoch
+    slot_header = struct.Struct('=QI')   # sequence number, payload length
+
+    def __init__(self, path=None, slots=4096, slot_size=8192, interval=0.05):
+        """
+        Args:
+            path: file shared by the workers, e.g. under /dev/shm
+            slots: number of messages kept in the ring
+            slot_size: maximum size of a message in bytes, with its header
+            interval: seconds between two polls of the background reader
+        """
+
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self.interval = interval
+        self.max_message = slot_size - self.slot_header.size
+
+        self._handlers = {}
+        self._on_overflow = []
+        self._lock = threading.Lock()
+        self._pid = None
+
+        if path is None:
+            self._map = None
+            self._seq = 0
+            self.position = 0
+            self.epoch = self._new_epoch()
+            return
+
+        size = self.header.size + slots * slot_size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        except:
+            os.close(fd)
+            raise
+        self._fd = fd
+
+        # The first process to map the file gives it its epoch
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, self.header.size, 0)
+        try:
+            seq, self.epoch = self.header.unpack_from(self._map, 0)
+            if not self.epoch:
+                self.epoch = self._new_epoch()
+                self.header.pack_into(self._map, 0, seq, self.epoch)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, self.header.size, 0)
+        # Sequence number of the last message delivered in this process
+        self.position = seq
+
+    @staticmethod
+    def _new_epoch():
+        return struct.unpack('=Q', os.urandom(8))[0] or 1
+
+    def on(self, kind, handler):
+        """
+        Calls handler(seq, message) for every message of a kind. Handlers
+        run with the channel locked and must not publish.
+        """
+
+        self._handlers.setdefault(kind, []).append(handler)
+
+    def on_overflow(self, handler):
+        """
+        Calls handler(seq) when messages up to seq were lost, with the
+        channel locked
+        """
+
+        self._on_overflow.append(handler)
+
+    def _head(self):
+        return self.header.unpack_from(self._map, 0)[0]
+
+    def publish(self, kind, local=True, **fields):
+        """
+        Appends a message for all workers, then delivers everything up to it
+        in this one.
+
+        Args:
+            kind: selects the handlers of the message
+            local: False to skip the handlers of the publishing process,
+                   when it has already applied the change itself
+        Returns:
+            The sequence number of the message.
+        """
+
+        fields['kind'] = kind
+        fields['pid'] = os.getpid() if not local else None
+
+        if self._map is None:
+            with self._lock:
+                self._seq += 1
+                seq = self._seq
+                if local:
+                    self._deliver(seq, fields)
+                self.position = seq
+            return seq
+
+        payload = json.dumps(fields, separators=(',', ':')).encode('utf-8')
+        if len(payload) > self.max_message:
+            raise ValueError('Message of %d bytes does not fit a slot' % len(payload))
+
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, self.header.size, 0)
+            try:
+                seq = self._head() + 1
+                offset = self.header.size + (seq % self.slots) * self.slot_size
+                self.slot_header.pack_into(self._map, offset, seq, len(payload))
+                start = offset + self.slot_header.size
+                self._map[start:start + len(payload)] = payload
+                self.header.pack_into(self._map, 0, seq, self.epoch)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self.header.size, 0)
+
+        self.poll()
+        return seq
+
+    def poll(self):
+        """
+        Delivers the messages published since the last poll. Cheap enough
+        to run at the start of every request.
+        """
+
+        if self._map is None or self._head() == self.position:
+            return
+
+        with self._lock:
+            head = self._head()
+            while self.position < head:
+                if head - self.position > self.slots:
+                    self._overflow(head)
+                    return
+
+                seq = self.position + 1
+                offset = self.header.size + (seq % self.slots) * self.slot_size
+                slot_seq, length = self.slot_header.unpack_from(self._map, offset)
+                start = offset + self.slot_header.size
+                payload = self._map[start:start + length]
+                # The slot may have been reused while it was copied
+                if slot_seq != seq or self.slot_header.unpack_from(self._map, offset)[0] != seq:
+                    self._overflow(self._head())
+                    return
+
+                self._deliver(seq, json.loads(payload.decode('utf-8')))
+                self.position = seq
+
+    def _deliver(self, seq, message):
+        if message.get('pid') == os.getpid():
+            return
+        for handler in self._handlers.get(message['kind'], ()):
+            try:
+                handler(seq, message)
+            except Exception:
+                log.exception('Could not handle %s message', message['kind'])
+
+    def _overflow(self, head):
+        log.warning('Missed %d messages', head - self.position)
+        self.position = head
+        for handler in self._on_overflow:
+            handler(head)
+
+    def start(self):
+        """
+        Starts the background reader of this process, which delivers
+        messages to idle workers. Also restarts it in a forked worker.
+        """
+
+        if self._map is None or self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        thread = threading.Thread(target=self._run, name='channel')
+        thread.daemon = True
+        thread.start()
+
+    def _run(self, sleep=time.sleep):
+        # sleep is bound early, module globals are cleared at interpreter exit
+        while True:
+            sleep(self.interval)
+            try:
+                self.poll()
+            except Exception:
+                log.exception('Could not read the channel')
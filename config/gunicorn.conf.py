@@ -0,0 +1,18 @@
+# Multi-worker deployment, see imectf.service
+#
+# The application is loaded once in the master and forked into the workers.
+# Database connections are never shared with a forked worker, and workers
+# keep their caches consistent through the channel file of config.json.
+
+import multiprocessing
+import os
+
+# Patch before the application is preloaded, so its locks are gevent's
+from gevent import monkey
+monkey.patch_all()
+
+bind = 'unix:imectf.sock'
+workers = int(os.getenv('WORKERS', multiprocessing.cpu_count()))
+worker_class = 'gevent'
+worker_connections = 10000
+preload_app = True
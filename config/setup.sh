@@ -25,9 +25,8 @@ pip install virtualenv
 virtualenv venv
 source venv/bin/activate
 pip install -r requirements.txt
-deactivate
-
 bash config/buildTables.sh
+deactivate
 
 # create group
 groupadd competitors
@@ -89,6 +88,7 @@ ln -s /dev/null /etc/skel/.bash_history
 cp config/limits.conf /etc/security/limits.conf
 cp config/sysctl.conf /etc/sysctl.conf
 cp config/imectf.service /etc/systemd/system/imectf.service
+cp config/imectf-provisioning.service /etc/systemd/system/imectf-provisioning.service
 
 cp config/ctf.nginx /etc/nginx/sites-available/ctf.imesec.org
 ln -s /etc/nginx/sites-available/ctf.imesec.org /etc/nginx/sites-enabled/ctf.imesec.org
@@ -97,6 +97,8 @@ cp config/shellinabox /etc/default/shellinabox
 
 systemctl start imectf
 systemctl enable imectf
+systemctl start imectf-provisioning
+systemctl enable imectf-provisioning
 
 # This needs to be here
 echo 'exit 0' >> /etc/rc.local
@@ -0,0 +1,155 @@
+"""
+In-process fanout of server-sent events.
+"""
+
+import json
+from collections import deque
+from threading import Event, Lock
+
+from cache import Registry
+
+
+class EventStream(object):
+    """
+    A bounded ring buffer of formatted events that any number of subscribers
+    can wait on.
+
+    Subscribers keep no queue of their own: each one only remembers the id of
+    the last event it has seen and reads newer events straight out of the
+    shared buffer, so an idle subscriber costs a generator frame and an int.
+
+    Waiters block on an Event that is swapped for a fresh one on every
+    publish. Unlike a timed Condition.wait, which polls on Python 2, this
+    maps onto a real wait under gevent.
+
+    Ids only have to increase: with several workers they are the sequence
+    numbers of the channel messages that carried the events, so a client
+    can resume on any worker.
+    """
+
+    def __init__(self, size=256, first_id=0):
+        """
+        Args:
+            size: number of events kept for replay
+            first_id: id after which the stream has seen every event
+        """
+
+        self._buffer = deque(maxlen=size)
+        self._lock = Lock()
+        self._published = Event()
+        self.last_id = first_id
+        # Events up to this id can not be replayed
+        self._dropped_id = first_id
+
+    def publish(self, event, data, event_id=None):
+        """
+        Formats an event once and wakes up every subscriber.
+        Returns the id of the event.
+        """
+
+        payload = json.dumps(data, separators=(',', ':'))
+        with self._lock:
+            if event_id is None:
+                event_id = self.last_id + 1
+            if len(self._buffer) == self._buffer.maxlen:
+                self._dropped_id = self._buffer[0][0]
+            self.last_id = event_id
+            message = 'id: %d\nevent: %s\ndata: %s\n\n' % (event_id, event, payload)
+            self._buffer.append((event_id, message))
+            published, self._published = self._published, Event()
+
+        published.set()
+        return event_id
+
+    def reset(self, event_id):
+        """
+        Forgets every event, subscribers are told to reload. Used when
+        events up to event_id may have been lost.
+        """
+
+        with self._lock:
+            self._buffer.clear()
+            self.last_id = self._dropped_id = max(event_id, self.last_id)
+            published, self._published = self._published, Event()
+
+        published.set()
+
+    def since(self, last_id):
+        """
+        Returns the messages published after last_id, or None if some of them
+        have already been dropped from the buffer.
+        """
+
+        with self._lock:
+            if last_id >= self.last_id:
+                return []
+            if last_id < self._dropped_id:
+                return None
+            start = len(self._buffer)
+            while start > 0 and self._buffer[start - 1][0] > last_id:
+                start -= 1
+            return [self._buffer[i] for i in range(start, len(self._buffer))]
+
+    def wait(self, last_id, timeout):
+        """
+        Blocks until something newer than last_id is published or timeout
+        seconds have passed. Returns like since().
+        """
+
+        published = self._published
+        if self.last_id <= last_id:
+            published.wait(timeout)
+        return self.since(last_id)
+
+    def subscribe(self, last_id=None, keepalive=15):
+        """
+        Generates the text/event-stream body of one subscriber.
+
+        Args:
+            last_id: the Last-Event-ID sent by a reconnecting client, events
+                     after it are replayed when they are still buffered
+            keepalive: seconds of silence after which a comment is sent
+        """
+
+        if last_id is None or last_id > self.last_id:
+            last_id = self.last_id
+
+        yield 'retry: 5000\n\n'
+        while True:
+            messages = self.wait(last_id, keepalive)
+            if messages is None:
+                # The client missed more than we can replay
+                last_id = self.last_id
+                yield 'id: %d\nevent: reset\ndata: {}\n\n' % last_id
+            elif not messages:
+                yield ': keepalive\n\n'
+            else:
+                last_id = messages[-1][0]
+                yield ''.join(m for _, m in messages)
+
+
+class EventRegistry(Registry):
+    """Holds one EventStream per competition"""
+
+    def __init__(self, size=256, first_id=0):
+        """
+        Args:
+            first_id: id after which every event is published here, the
+                      channel position a worker starts reading from
+        """
+
+        Registry.__init__(self)
+        self._size = size
+        self._first_id = first_id
+
+    def build(self, comp_id):
+        return EventStream(self._size, self._first_id)
+
+    def publish(self, comp_id, event, data, event_id=None):
+        return self.get(comp_id).publish(event, data, event_id)
+
+    def reset(self, event_id):
+        """Resets every stream, see EventStream.reset"""
+
+        for stream in self.values():
+            stream.reset(event_id)
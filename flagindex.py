@@ -0,0 +1,75 @@
+"""
+In-memory lookup of tasks by flag.
+"""
+
+import hashlib
+import hmac
+import os
+
+from cache import Registry
+
+
+class FlagIndex(object):
+    """
+    Maps the flags of one competition to its tasks.
+
+    Flags are only kept as HMAC-SHA256 digests under a key generated for the
+    index, so the plain flags do not linger in memory and digests can not
+    be matched against another process.
+    """
+
+    def __init__(self, tasks=()):
+        """
+        Args:
+            tasks: iterable of (task_id, flag, score)
+        """
+
+        self._key = os.urandom(32)
+        self._by_flag = {}
+        self._by_task = {}
+        for task_id, flag, score in tasks:
+            if not flag:
+                continue
+            digest = self._digest(flag)
+            self._by_flag.setdefault(digest, (task_id, score))
+            self._by_task[task_id] = (digest, score)
+
+    def _digest(self, flag):
+        if not isinstance(flag, bytes):
+            flag = flag.encode('utf-8')
+        return hmac.new(self._key, flag, hashlib.sha256).digest()
+
+    def __contains__(self, task_id):
+        return task_id in self._by_task
+
+    def match(self, task_id, flag):
+        """Returns the score of the task if flag is its flag, else None"""
+
+        entry = self._by_task.get(task_id)
+        if entry is None or not hmac.compare_digest(entry[0], self._digest(flag)):
+            return None
+        return entry[1]
+
+    def lookup(self, flag):
+        """Returns (task_id, score) of the task a flag belongs to, or None"""
+
+        return self._by_flag.get(self._digest(flag))
+
+
+class FlagRegistry(Registry):
+    """
+    Lazily builds one FlagIndex per competition. Admin routes that change
+    tasks or their competition mapping invalidate it.
+    """
+
+    def __init__(self, loader):
+        """
+        Args:
+            loader: callable taking a comp_id and returning an iterable of
+                    (task_id, flag, score) for the tasks of the competition
+        """
+
+        Registry.__init__(self, loader)
+
+    def build(self, comp_id):
+        return FlagIndex(self._loader(comp_id))
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+"""migrate.py -- creates or upgrades the database schema in place
+
+Usage: python migrate.py [revision]
+       python migrate.py downgrade <revision>
+
+Databases built by an older config/buildTables.sh have no migration history.
+They are stamped with the baseline revision, which matches that schema,
+before the remaining migrations are applied. After an upgrade to the latest
+revision, every column the application reads must exist.
+"""
+
+import json
+import os
+import sys
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import create_engine, inspect
+
+
+BASELINE = '0001'
+# Tables created by config/buildTables.sh
+BASELINE_TABLES = ['competitions', 'categories', 'tasks', 'task_competition', 'users',
+                   'teams', 'team_player', 'flags']
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def get_config(url):
+    config = Config(os.path.join(HERE, 'alembic.ini'))
+    config.set_main_option('script_location', os.path.join(HERE, 'migrations'))
+    config.set_main_option('sqlalchemy.url', url)
+    return config
+
+
+def upgrade(url, revision='head'):
+    """
+    Upgrades the database at url to revision.
+
+    Args:
+        url: SQLAlchemy url of the database
+        revision: target revision, head for the latest
+    """
+
+    config = get_config(url)
+
+    engine = create_engine(url)
+    tables = inspect(engine).get_table_names()
+    engine.dispose()
+    if 'competitions' in tables and 'alembic_version' not in tables:
+        missing = [name for name in BASELINE_TABLES if name not in tables]
+        if missing:
+            raise RuntimeError('Not a database of config/buildTables.sh, missing %s' % ', '.join(missing))
+        command.stamp(config, BASELINE)
+
+    command.upgrade(config, revision)
+
+    if revision == 'head':
+        missing = missing_columns(url)
+        if missing:
+            raise RuntimeError('Schema incomplete after the upgrade, missing %s' % ', '.join(missing))
+
+
+def missing_columns(url):
+    """Returns the table.column names declared in queries.py that the database lacks"""
+
+    from queries import metadata
+
+    engine = create_engine(url)
+    try:
+        inspector = inspect(engine)
+        tables = inspector.get_table_names()
+        missing = []
+        for table in metadata.sorted_tables:
+            if table.name not in tables:
+                missing.append(table.name)
+                continue
+            existing = set(column['name'] for column in inspector.get_columns(table.name))
+            missing.extend('%s.%s' % (table.name, column.name) for column in table.columns
+                           if column.name not in existing)
+        return missing
+    finally:
+        engine.dispose()
+
+
+def downgrade(url, revision):
+    command.downgrade(get_config(url), revision)
+
+
+if __name__ == '__main__':
+    with open('config.json', 'rb') as f:
+        url = json.loads(f.read())['db']
+    if sys.argv[1:2] == ['downgrade'] and len(sys.argv) == 3:
+        downgrade(url, sys.argv[2])
+    elif len(sys.argv) <= 2:
+        upgrade(url, sys.argv[1] if len(sys.argv) == 2 else 'head')
+    else:
+        print(__doc__)
+        sys.exit(1)
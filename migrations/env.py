@@ -0,0 +1,46 @@
+"""
+Alembic environment of the platform database.
+"""
+
+from __future__ import with_statement
+
+import json
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy import create_engine
+
+config = context.config
+
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+
+def get_url():
+    url = config.get_main_option('sqlalchemy.url')
+    if url:
+        return url
+    with open('config.json', 'rb') as f:
+        return json.loads(f.read())['db']
+
+
+def run_migrations_offline():
+    """Writes the SQL of the migrations to stdout"""
+
+    context.configure(url=get_url(), literal_binds=True)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    engine = create_engine(get_url())
+    with engine.connect() as connection:
+        context.configure(connection=connection, render_as_batch=True)
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,50 @@
+"""Baseline schema, as created by the original config/buildTables.sh
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 10:00:00
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+TABLES = [
+    ('competitions', 'CREATE TABLE competitions (id INTEGER PRIMARY KEY, desc TEXT, date_start TEXT, date_end TEXT, active BOOLEAN, secret TEXT NOT NULL, spectator_secret TEXT NOT NULL, teams INTEGER, submissions INTEGER)'),
+    ('categories', 'CREATE TABLE categories (id INTEGER PRIMARY KEY, name TEXT)'),
+    ('tasks', 'CREATE TABLE tasks (id INTEGER PRIMARY KEY, name TEXT, desc TEXT, file TEXT, flag TEXT, category INT, FOREIGN KEY(category) REFERENCES categories(id) ON DELETE CASCADE)'),
+    ('task_competition', 'CREATE TABLE task_competition (task_id INTEGER, comp_id INTEGER, score INTEGER, PRIMARY KEY (task_id, comp_id), FOREIGN KEY(task_id) REFERENCES tasks(id) ON DELETE CASCADE, FOREIGN KEY(comp_id) REFERENCES competitions(id) ON DELETE CASCADE)'),
+    ('users', 'CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT NOT NULL, email TEXT, admin BOOLEAN, password TEXT, shell_username TEXT)'),
+    ('teams', 'CREATE TABLE teams (id INTEGER PRIMARY KEY, name TEXT NOT NULL, secret TEXT, comp_id INTEGER, spectator BOOLEAN, score INTEGER, timestamp BIGINT, FOREIGN KEY(comp_id) REFERENCES competitions(id) ON DELETE CASCADE)'),
+    ('team_player', 'CREATE TABLE team_player (team_id INTEGER, user_id INTEGER, PRIMARY KEY (team_id, user_id), FOREIGN KEY(team_id) REFERENCES teams(id) ON DELETE CASCADE, FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE)'),
+    ('flags', 'CREATE TABLE flags (task_id INTEGER, user_id INTEGER, comp_id INTEGER, timestamp BIGINT, PRIMARY KEY (task_id, user_id, comp_id), FOREIGN KEY(task_id) REFERENCES tasks(id) ON DELETE CASCADE, FOREIGN KEY(comp_id) REFERENCES competitions(id) ON DELETE CASCADE, FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE)'),
+]
+
+CATEGORIES = [
+    'Reverse Engineering',
+    'Web Exploitation',
+    'Forensics',
+    'Cryptography',
+    'Binary Exploitation',
+    'Miscellaneous',
+]
+
+
+def upgrade():
+    for name, statement in TABLES:
+        op.execute(statement)
+
+    categories = sa.table('categories', sa.column('name', sa.Text))
+    op.bulk_insert(categories, [{'name': name} for name in CATEGORIES])
+
+
+def downgrade():
+    for name, statement in reversed(TABLES):
+        op.drop_table(name)
@@ -0,0 +1,25 @@
+"""Attempts log
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 10:15:00
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # Servers started before this migration have already created it
+    op.execute('CREATE TABLE IF NOT EXISTS attempts (comp_id INTEGER, task_id INTEGER, team_id INTEGER, user_id INTEGER, flag TEXT, correct BOOLEAN, timestamp BIGINT)')
+
+
+def downgrade():
+    op.drop_table('attempts')
@@ -0,0 +1,48 @@
+"""Indexes for the lookups done on every request
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 10:30:00
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+INDEXES = [
+    # Rank index load and total teams, covering: the rowid is the team id
+    ('ix_teams_rank', 'teams', ['comp_id', 'spectator', 'score', 'timestamp']),
+    # Joining a team with its secret
+    ('ix_teams_secret', 'teams', ['secret', 'comp_id']),
+    # get_team, get_total_users and the teammate check of a submission
+    ('ix_team_player_user', 'team_player', ['user_id', 'team_id']),
+    # Teammate check of a submission and solves of a task
+    ('ix_flags_task', 'flags', ['comp_id', 'task_id', 'user_id']),
+    # get_flags and get_tasks_done
+    ('ix_flags_user', 'flags', ['user_id', 'comp_id', 'task_id']),
+    # Tasks and total score of a competition
+    ('ix_task_competition_comp', 'task_competition', ['comp_id', 'task_id', 'score']),
+    # Login and registration
+    ('ix_users_username', 'users', ['username']),
+    ('ix_users_shell_username', 'users', ['shell_username']),
+]
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns)
+    # Without statistics for the new indexes the planner may pick the
+    # least selective one
+    op.execute('ANALYZE')
+
+
+def downgrade():
+    for name, table, columns in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,27 @@
+"""Shell account provisioning queue
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 12:00:00
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.execute('CREATE TABLE provisioning (id INTEGER PRIMARY KEY, user_id INTEGER, username TEXT NOT NULL, password_hash TEXT, status TEXT NOT NULL, attempts INTEGER NOT NULL, error TEXT, next_attempt BIGINT, created BIGINT, updated BIGINT, FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE)')
+    # Claiming the next due job and looking up the job of a user
+    op.create_index('ix_provisioning_due', 'provisioning', ['status', 'next_attempt'])
+    op.create_index('ix_provisioning_user', 'provisioning', ['user_id'])
+
+
+def downgrade():
+    op.drop_table('provisioning')
@@ -0,0 +1,28 @@
+"""Content-addressed task attachments
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 13:00:00
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.execute('CREATE TABLE attachments (sha256 TEXT PRIMARY KEY, size BIGINT NOT NULL, refs INTEGER NOT NULL, created BIGINT)')
+    # Tasks uploaded before keep their file in static/files and no hash
+    op.add_column('tasks', sa.Column('file_hash', sa.Text))
+
+
+def downgrade():
+    # Needs SQLite 3.35, a batch copy of tasks would lose its ON DELETE clause
+    op.execute('ALTER TABLE tasks DROP COLUMN file_hash')
+    op.drop_table('attachments')
@@ -0,0 +1,47 @@
+"""Counters of the competitions
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 15:00:00
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+COUNTERS = ('points', 'players', 'spectators', 'solves')
+
+
+def upgrade():
+    for name in COUNTERS:
+        op.add_column('competitions', sa.Column(name, sa.Integer, nullable=False, server_default='0'))
+
+    # Counted like aggregates.py does, teams included since it may have drifted
+    op.execute(
+        '''
+        UPDATE competitions SET
+            points = (SELECT ifnull(sum(tc.score), 0) FROM task_competition tc
+                      WHERE tc.comp_id = competitions.id),
+            players = (SELECT count(*) FROM team_player tp JOIN teams t ON t.id = tp.team_id
+                       WHERE t.comp_id = competitions.id AND t.spectator = 0),
+            teams = (SELECT count(*) FROM teams t
+                     WHERE t.comp_id = competitions.id AND t.spectator = 0),
+            spectators = (SELECT count(*) FROM team_player tp JOIN teams t ON t.id = tp.team_id
+                          WHERE t.comp_id = competitions.id AND t.spectator != 0),
+            solves = (SELECT count(*) FROM flags f
+                      WHERE f.comp_id = competitions.id)
+        ''')
+
+
+def downgrade():
+    # Needs SQLite 3.35, a batch copy of competitions would lose the
+    # ON DELETE clauses of the tables referencing it
+    for name in reversed(COUNTERS):
+        op.execute('ALTER TABLE competitions DROP COLUMN %s' % name)
@@ -0,0 +1,59 @@
+"""Solve statistics of the tasks
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 16:00:00
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.execute('CREATE TABLE task_stats (comp_id INTEGER, task_id INTEGER, solves INTEGER NOT NULL, first_team_id INTEGER, first_timestamp BIGINT, last_timestamp BIGINT, PRIMARY KEY (comp_id, task_id), FOREIGN KEY(comp_id) REFERENCES competitions(id) ON DELETE CASCADE, FOREIGN KEY(task_id) REFERENCES tasks(id) ON DELETE CASCADE, FOREIGN KEY(first_team_id) REFERENCES teams(id) ON DELETE SET NULL)')
+    # Solves per hour since the epoch
+    op.execute('CREATE TABLE task_solve_hours (comp_id INTEGER, task_id INTEGER, hour INTEGER, solves INTEGER NOT NULL, PRIMARY KEY (comp_id, task_id, hour), FOREIGN KEY(comp_id) REFERENCES competitions(id) ON DELETE CASCADE, FOREIGN KEY(task_id) REFERENCES tasks(id) ON DELETE CASCADE)')
+
+    # A team solved a task with the first flag of one of its players, if it
+    # was found while the competition ran
+    op.execute(
+        '''
+        CREATE TEMP TABLE team_solves AS
+        SELECT c.id AS comp_id, f.task_id, tp.team_id, min(f.timestamp) AS timestamp
+        FROM competitions c
+        JOIN flags f ON f.comp_id = c.id
+        JOIN team_player tp ON tp.user_id = f.user_id
+        JOIN teams t ON t.id = tp.team_id AND t.comp_id = c.id AND t.spectator = 0
+        GROUP BY c.id, f.task_id, tp.team_id
+        HAVING min(f.timestamp) > strftime('%s', c.date_start) * 1000
+            AND (ifnull(c.date_end, '') = '' OR min(f.timestamp) < strftime('%s', c.date_end) * 1000)
+        ''')
+    op.execute(
+        '''
+        INSERT INTO task_stats (comp_id, task_id, solves, first_team_id, first_timestamp, last_timestamp)
+        SELECT comp_id, task_id, count(*),
+               (SELECT s.team_id FROM team_solves s
+                WHERE s.comp_id = team_solves.comp_id AND s.task_id = team_solves.task_id
+                ORDER BY s.timestamp, s.team_id LIMIT 1),
+               min(timestamp), max(timestamp)
+        FROM team_solves GROUP BY comp_id, task_id
+        ''')
+    op.execute(
+        '''
+        INSERT INTO task_solve_hours (comp_id, task_id, hour, solves)
+        SELECT comp_id, task_id, timestamp / 3600000, count(*)
+        FROM team_solves GROUP BY comp_id, task_id, timestamp / 3600000
+        ''')
+    op.execute('DROP TABLE team_solves')
+
+
+def downgrade():
+    op.drop_table('task_solve_hours')
+    op.drop_table('task_stats')
@@ -0,0 +1,55 @@
+"""Scoring model of the competitions and solver sets of the tasks
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18 17:00:00
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+COLUMNS = [
+    # static, linear or log, see scoring.py
+    sa.Column('scoring', sa.Text, nullable=False, server_default='static'),
+    # Solves after which a decaying task is worth its minimum
+    sa.Column('decay', sa.Integer, nullable=False, server_default='0'),
+    # Least value of a decaying task, in percent of its score
+    sa.Column('minimum', sa.Integer, nullable=False, server_default='0'),
+]
+
+
+def upgrade():
+    for column in COLUMNS:
+        op.add_column('competitions', column)
+
+    # Teams credited with a task, ranked unless spectators
+    op.execute('CREATE TABLE task_solves (comp_id INTEGER, task_id INTEGER, team_id INTEGER, ranked BOOLEAN NOT NULL, timestamp BIGINT NOT NULL, PRIMARY KEY (comp_id, task_id, team_id), FOREIGN KEY(comp_id) REFERENCES competitions(id) ON DELETE CASCADE, FOREIGN KEY(task_id) REFERENCES tasks(id) ON DELETE CASCADE, FOREIGN KEY(team_id) REFERENCES teams(id) ON DELETE CASCADE)')
+
+    # Like scoring.recompute: the first flag of a team for a task, if it was
+    # found while the competition ran
+    op.execute(
+        '''
+        INSERT INTO task_solves (comp_id, task_id, team_id, ranked, timestamp)
+        SELECT c.id, f.task_id, tp.team_id, t.spectator = 0, min(f.timestamp)
+        FROM competitions c
+        JOIN teams t ON t.comp_id = c.id
+        JOIN team_player tp ON tp.team_id = t.id
+        JOIN flags f ON f.user_id = tp.user_id AND f.comp_id = c.id
+        GROUP BY c.id, f.task_id, tp.team_id
+        HAVING min(f.timestamp) > strftime('%s', c.date_start) * 1000
+            AND (ifnull(c.date_end, '') = '' OR min(f.timestamp) < strftime('%s', c.date_end) * 1000)
+        ''')
+
+
+def downgrade():
+    op.drop_table('task_solves')
+    for column in reversed(COLUMNS):
+        op.execute('ALTER TABLE competitions DROP COLUMN %s' % column.name)
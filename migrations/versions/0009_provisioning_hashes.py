@@ -0,0 +1,25 @@
+"""Password hashes of finished provisioning jobs
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18 18:00:00
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # Jobs only keep the hash until they are done or failed
+    op.execute("UPDATE provisioning SET password_hash = NULL WHERE status IN ('done', 'failed')")
+
+
+def downgrade():
+    pass
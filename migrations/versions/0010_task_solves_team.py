@@ -0,0 +1,25 @@
+"""Solves of a team
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-18 18:15:00
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0010'
+down_revision = '0009'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # Scores rebuilt team by team in scoring.recompute, covering
+    op.create_index('ix_task_solves_team', 'task_solves', ['comp_id', 'team_id', 'task_id', 'timestamp'])
+
+
+def downgrade():
+    op.drop_index('ix_task_solves_team', 'task_solves')
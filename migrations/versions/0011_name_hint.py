@@ -0,0 +1,36 @@
+"""Names of the competitions and hints of the tasks
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-18 19:00:00
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0011'
+down_revision = '0010'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# Not in config/buildTables.sh: dataset added them on the first write that
+# set them, so a database may have either, both or none
+COLUMNS = [
+    ('competitions', sa.Column('name', sa.Text)),
+    ('tasks', sa.Column('hint', sa.Text)),
+]
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for table, column in COLUMNS:
+        if column.name not in [c['name'] for c in inspector.get_columns(table)]:
+            op.add_column(table, column)
+
+
+def downgrade():
+    # The columns may predate this migration, dropping them could lose data
+    pass
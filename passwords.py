@@ -0,0 +1,175 @@
+"""
+Password hashing in helper processes, off the request threads.
+"""
+
+import fcntl
+import json
+import os
+import socket
+import threading
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
+
+
+DEFAULT_METHOD = 'pbkdf2:sha256'
+DEFAULT_ITERATIONS = 10000
+
+
+class Busy(Exception):
+    """Every helper stayed busy for longer than the caller could wait"""
+    pass
+
+
+def full_method(method=DEFAULT_METHOD, iterations=DEFAULT_ITERATIONS):
+    """Returns the werkzeug method string of a hash method and cost"""
+
+    if method.startswith('pbkdf2:'):
+        return '%s:%d' % (method, iterations)
+    return method
+
+
+def hash_method(pwhash):
+    """Returns the method string a werkzeug hash was made with"""
+
+    return pwhash.split('$', 1)[0]
+
+
+def _serve(sock):
+    # Helper process: one JSON request per line, one JSON reply per line
+    fd = sock.fileno()
+    # gevent leaves its sockets non-blocking
+    fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) & ~os.O_NONBLOCK)
+    pending = b''
+    while True:
+        while b'\n' not in pending:
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                os._exit(0)
+            pending += chunk
+        line, pending = pending.split(b'\n', 1)
+        request = json.loads(line.decode('utf-8'))
+        if request['op'] == 'hash':
+            reply = generate_password_hash(request['password'], request['method'])
+        else:
+            reply = check_password_hash(request['pwhash'], request['password'])
+        reply = json.dumps(reply).encode('utf-8') + b'\n'
+        while reply:
+            reply = reply[os.write(fd, reply):]
+
+
+# Sockets of the helpers of this process, which a new helper must not keep
+# open: a helper exits when its socket is closed by the parent
+_sockets = set()
+
+
+class Helper(object):
+    """A forked process hashing passwords, and the socket to talk to it"""
+
+    def __init__(self):
+        parent, child = socket.socketpair()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                parent.close()
+                for sock in _sockets:
+                    sock.close()
+                _serve(child)
+            finally:
+                os._exit(1)
+        child.close()
+        self.pid = pid
+        self._sock = parent
+        self._pending = b''
+        _sockets.add(parent)
+
+    def call(self, **request):
+        self._sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        while b'\n' not in self._pending:
+            chunk = self._sock.recv(65536)
+            if not chunk:
+                raise IOError('Password helper %d exited' % self.pid)
+            self._pending += chunk
+        line, self._pending = self._pending.split(b'\n', 1)
+        return json.loads(line.decode('utf-8'))
+
+    def close(self):
+        _sockets.discard(self._sock)
+        self._sock.close()
+        try:
+            os.waitpid(self.pid, 0)
+        except OSError:
+            pass
+
+
+class PasswordHasher(object):
+    """
+    Hashes and checks passwords with werkzeug in a few helper processes, so
+    that a wave of logins keeps the KDF off the threads or greenlets serving
+    requests, and uses every core even under one sync worker.
+
+    A request waits at most `wait` seconds for an idle helper and then gets
+    Busy, which bounds the logins queued behind the helpers. The helpers are
+    forked on first use in every process, after gunicorn forked its workers.
+    """
+
+    def __init__(self, method=DEFAULT_METHOD, iterations=DEFAULT_ITERATIONS, processes=1, wait=10.0):
+        """
+        Args:
+            method: werkzeug hash method, e.g. pbkdf2:sha256
+            iterations: cost of pbkdf2 methods
+            processes: helper processes of each worker
+            wait: seconds a request waits for an idle helper
+        """
+
+        self.method = full_method(method, iterations)
+        self.processes = processes
+        self.wait = wait
+        self._idle = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            idle = Queue()
+            for _ in range(self.processes):
+                idle.put(Helper())
+            self._idle = idle
+            self._pid = os.getpid()
+
+    def _call(self, **request):
+        if self._pid != os.getpid():
+            self._start()
+        try:
+            helper = self._idle.get(timeout=self.wait)
+        except Empty:
+            raise Busy()
+        try:
+            result = helper.call(**request)
+        except Exception:
+            # Replace the helper, its socket may be half read
+            helper.close()
+            helper = Helper()
+            raise
+        finally:
+            self._idle.put(helper)
+        return result
+
+    def hash(self, password):
+        """Returns the hash of a password with the configured method and cost"""
+
+        return self._call(op='hash', password=password, method=self.method)
+
+    def check(self, pwhash, password):
+        return self._call(op='check', pwhash=pwhash, password=password)
+
+    def needs_upgrade(self, pwhash):
+        """Whether a hash was made with another method or cost than the configured one"""
+
+        return hash_method(pwhash) != self.method
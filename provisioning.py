@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+
+"""provisioning.py -- creates the shell accounts of registered users
+
+Usage: python provisioning.py
+
+Registration only queues a job in the provisioning table. This process
+drains the queue with the number of workers set in config.json; it must
+run as a user allowed to run useradd. The development server started with
+python server.py drains the queue itself.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import text
+
+
+log = logging.getLogger(__name__)
+
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+class ProvisioningQueue(object):
+    """
+    Shell accounts waiting to be created, kept in the provisioning table so
+    that registration only inserts a row and jobs survive restarts.
+
+    Workers claim a job by moving it from pending to running with a
+    conditional UPDATE, so any number of threads and processes can drain
+    the same queue. A failed job is retried with exponential backoff until
+    it has been tried `retries` times. A job left running by a worker that
+    died is claimed again after `stale` seconds.
+
+    With a batch task, workers claim up to `batch_size` due jobs at once and
+    create all their accounts in one pass. When the pass fails, the jobs of
+    that batch are run one by one so each gets its own error.
+
+    The password hash of a job is only kept while the job is pending or
+    running: it is cleared when the job is done or failed for good, so a
+    failed job that is retried creates an account with a locked password.
+    """
+
+    def __init__(self, engine, task, retries=5, backoff=2.0, stale=600, batch_task=None, batch_size=500):
+        """
+        Args:
+            engine: SQLAlchemy engine of the database
+            task: callable taking (username, password_hash) that creates
+                  the account, and may be called again after a failure
+            retries: attempts before a job is marked failed
+            backoff: seconds before the first retry, doubled every time
+            stale: seconds after which a running job is considered lost
+            batch_task: callable taking a list of (username, password_hash)
+                        that creates all the accounts, or None
+            batch_size: most jobs given to batch_task at once
+        """
+
+        self._engine = engine
+        self._task = task
+        self._batch_task = batch_task
+        self.retries = retries
+        self.backoff = backoff
+        self.stale = stale
+        self.batch_size = batch_size
+        self._wakeup = threading.Event()
+        self._pid = None
+
+    def enqueue(self, user_id, username, password_hash):
+        """Queues the creation of the shell account of a user"""
+
+        with self._engine.begin() as connection:
+            self.enqueue_many([(user_id, username, password_hash)], connection)
+
+    def enqueue_many(self, jobs, connection):
+        """
+        Queues the creation of many shell accounts
+
+        Args:
+            jobs: list of (user_id, username, password_hash)
+            connection: connection whose transaction also inserts the users
+        """
+
+        timestamp = now_ms()
+        connection.execute(
+            text(
+                '''
+                INSERT INTO provisioning (user_id, username, password_hash, status, attempts,
+                                          next_attempt, created, updated)
+                VALUES (:user_id, :username, :password_hash, :status, 0, :now, :now, :now)
+                '''),
+            [dict(user_id=user_id, username=username, password_hash=password_hash,
+                  status=PENDING, now=timestamp)
+             for user_id, username, password_hash in jobs])
+        self._wakeup.set()
+
+    def status(self, user_id):
+        """Returns the latest job of a user as a dict, or None"""
+
+        with self._engine.connect() as connection:
+            job = connection.execute(
+                text(
+                    '''
+                    SELECT status, attempts, error, next_attempt, updated FROM provisioning
+                    WHERE user_id = :user_id ORDER BY id DESC LIMIT 1
+                    '''),
+                user_id=user_id).first()
+        return dict(job) if job else None
+
+    def unfinished(self):
+        """Returns the jobs that are not done, oldest first"""
+
+        with self._engine.connect() as connection:
+            jobs = connection.execute(
+                text(
+                    '''
+                    SELECT id, user_id, username, status, attempts, error, next_attempt, created, updated
+                    FROM provisioning WHERE status != :done ORDER BY id
+                    '''),
+                done=DONE)
+            return [dict(job) for job in jobs]
+
+    def retry(self, job_id):
+        """
+        Queues a failed job again with a fresh retry budget. Its password
+        hash is gone, the account is created with a locked password.
+        """
+
+        with self._engine.begin() as connection:
+            result = connection.execute(
+                text(
+                    '''
+                    UPDATE provisioning SET status = :pending, attempts = 0, next_attempt = :now, updated = :now
+                    WHERE id = :id AND status = :failed
+                    '''),
+                id=job_id, pending=PENDING, failed=FAILED, now=now_ms())
+        self._wakeup.set()
+        return result.rowcount == 1
+
+    def claim(self, limit=1):
+        """
+        Takes up to limit jobs that are due, returns them as a list of dicts,
+        empty when no job is due
+        """
+
+        while True:
+            timestamp = now_ms()
+            with self._engine.begin() as connection:
+                jobs = connection.execute(
+                    text(
+                        '''
+                        SELECT id, username, password_hash, status, attempts, updated FROM provisioning
+                        WHERE (status = :pending AND next_attempt <= :now)
+                           OR (status = :running AND updated <= :stale)
+                        ORDER BY id LIMIT :limit
+                        '''),
+                    pending=PENDING, running=RUNNING, now=timestamp,
+                    stale=timestamp - int(self.stale * 1000), limit=limit).fetchall()
+                if not jobs:
+                    return []
+
+                # Another worker may have claimed some since the SELECT
+                claimed = []
+                for job in jobs:
+                    if connection.execute(
+                            text(
+                                '''
+                                UPDATE provisioning SET status = :running, updated = :now
+                                WHERE id = :id AND status = :status AND updated = :updated
+                                '''),
+                            running=RUNNING, now=timestamp, id=job['id'],
+                            status=job['status'], updated=job['updated']).rowcount:
+                        claimed.append(dict(job))
+            if claimed:
+                return claimed
+
+    def _finish(self, job, error=None):
+        attempts = job['attempts'] + 1
+        if error is None:
+            status, next_attempt = DONE, None
+        elif attempts >= self.retries:
+            status, next_attempt = FAILED, None
+        else:
+            status = PENDING
+            next_attempt = now_ms() + int(self.backoff * 2 ** (attempts - 1) * 1000)
+
+        # The hash is only needed until the account exists or the job
+        # gave up
+        with self._engine.begin() as connection:
+            connection.execute(
+                text(
+                    '''
+                    UPDATE provisioning SET status = :status, attempts = :attempts, error = :error,
+                                            next_attempt = :next_attempt, updated = :now,
+                                            password_hash = CASE WHEN :status = :pending
+                                                                 THEN password_hash END
+                    WHERE id = :id
+                    '''),
+                id=job['id'], status=status, attempts=attempts, error=error,
+                next_attempt=next_attempt, now=now_ms(), pending=PENDING)
+
+    def _run_job(self, job):
+        try:
+            self._task(job['username'], job['password_hash'])
+        except Exception as e:
+            log.exception('Could not create the shell account of %s', job['username'])
+            self._finish(job, repr(e)[:1000])
+        else:
+            self._finish(job)
+
+    def run_one(self):
+        """Runs the next due job, returns False when there was none"""
+
+        jobs = self.claim()
+        if not jobs:
+            return False
+        self._run_job(jobs[0])
+        return True
+
+    def run_batch(self):
+        """Runs the next due jobs in one pass, returns False when there were none"""
+
+        jobs = self.claim(self.batch_size)
+        if not jobs:
+            return False
+
+        try:
+            self._batch_task([(job['username'], job['password_hash']) for job in jobs])
+        except Exception:
+            log.exception('Could not create a batch of %d shell accounts', len(jobs))
+            for job in jobs:
+                self._run_job(job)
+        else:
+            for job in jobs:
+                self._finish(job)
+        return True
+
+    def start(self, workers=2, interval=1.0):
+        """
+        Starts the worker threads of this process, which also look for due
+        retries every interval seconds.
+        """
+
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        for i in range(workers):
+            thread = threading.Thread(target=self._run, args=(interval,), name='provisioning-%d' % i)
+            thread.daemon = True
+            thread.start()
+
+    def _run(self, interval):
+        run = self.run_batch if self._batch_task else self.run_one
+        while True:
+            try:
+                while run():
+                    pass
+            except Exception:
+                log.exception('Could not read the provisioning queue')
+            self._wakeup.wait(interval)
+            self._wakeup.clear()
+
+
+if __name__ == '__main__':
+    import storage
+    from utils import create_account, create_accounts
+
+    logging.basicConfig(level=logging.INFO)
+
+    with open('config.json', 'rb') as f:
+        config = json.loads(f.read())
+    settings = dict(config.get('provisioning', {}))
+    workers = settings.pop('workers', 2)
+
+    db = storage.connect(config['db'], config.get('storage'))
+    queue = ProvisioningQueue(db.engine, create_account, batch_task=create_accounts, **settings)
+    queue.start(workers)
+    while True:
+        time.sleep(3600)
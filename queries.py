@@ -0,0 +1,399 @@
+"""
+Tables of the platform and the read queries served on every request.
+"""
+
+from sqlalchemy import (MetaData, Table, Column, Integer, BigInteger, Boolean, Text,
+                        ForeignKey, select, func, bindparam, and_)
+
+
+metadata = MetaData()
+
+competitions = Table(
+    'competitions', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('name', Text),
+    Column('desc', Text),
+    Column('date_start', Text),
+    Column('date_end', Text),
+    Column('active', Boolean),
+    Column('secret', Text, nullable=False),
+    Column('spectator_secret', Text, nullable=False),
+    Column('teams', Integer),
+    Column('submissions', Integer),
+    # Counters kept by the routes, see aggregates.py
+    Column('points', Integer, nullable=False),
+    Column('players', Integer, nullable=False),
+    Column('spectators', Integer, nullable=False),
+    Column('solves', Integer, nullable=False),
+    # Scoring model, see scoring.py
+    Column('scoring', Text, nullable=False),
+    Column('decay', Integer, nullable=False),
+    Column('minimum', Integer, nullable=False),
+)
+
+categories = Table(
+    'categories', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('name', Text),
+)
+
+tasks = Table(
+    'tasks', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('name', Text),
+    Column('desc', Text),
+    Column('hint', Text),
+    Column('file', Text),
+    Column('file_hash', Text),
+    Column('flag', Text),
+    Column('category', Integer, ForeignKey('categories.id')),
+)
+
+task_competition = Table(
+    'task_competition', metadata,
+    Column('task_id', Integer, ForeignKey('tasks.id'), primary_key=True),
+    Column('comp_id', Integer, ForeignKey('competitions.id'), primary_key=True),
+    Column('score', Integer),
+)
+
+users = Table(
+    'users', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('username', Text, nullable=False),
+    Column('email', Text),
+    Column('admin', Boolean),
+    Column('password', Text),
+    Column('shell_username', Text),
+)
+
+teams = Table(
+    'teams', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('name', Text, nullable=False),
+    Column('secret', Text),
+    Column('comp_id', Integer, ForeignKey('competitions.id')),
+    Column('spectator', Boolean),
+    Column('score', Integer),
+    Column('timestamp', BigInteger),
+)
+
+team_player = Table(
+    'team_player', metadata,
+    Column('team_id', Integer, ForeignKey('teams.id'), primary_key=True),
+    Column('user_id', Integer, ForeignKey('users.id'), primary_key=True),
+)
+
+flags = Table(
+    'flags', metadata,
+    Column('task_id', Integer, ForeignKey('tasks.id'), primary_key=True),
+    Column('user_id', Integer, ForeignKey('users.id'), primary_key=True),
+    Column('comp_id', Integer, ForeignKey('competitions.id'), primary_key=True),
+    Column('timestamp', BigInteger),
+)
+
+attempts = Table(
+    'attempts', metadata,
+    Column('comp_id', Integer),
+    Column('task_id', Integer),
+    Column('team_id', Integer),
+    Column('user_id', Integer),
+    Column('flag', Text),
+    Column('correct', Boolean),
+    Column('timestamp', BigInteger),
+)
+
+task_stats = Table(
+    'task_stats', metadata,
+    Column('comp_id', Integer, ForeignKey('competitions.id'), primary_key=True),
+    Column('task_id', Integer, ForeignKey('tasks.id'), primary_key=True),
+    Column('solves', Integer, nullable=False),
+    Column('first_team_id', Integer, ForeignKey('teams.id')),
+    Column('first_timestamp', BigInteger),
+    Column('last_timestamp', BigInteger),
+)
+
+task_solve_hours = Table(
+    'task_solve_hours', metadata,
+    Column('comp_id', Integer, ForeignKey('competitions.id'), primary_key=True),
+    Column('task_id', Integer, ForeignKey('tasks.id'), primary_key=True),
+    Column('hour', Integer, primary_key=True),
+    Column('solves', Integer, nullable=False),
+)
+
+task_solves = Table(
+    'task_solves', metadata,
+    Column('comp_id', Integer, ForeignKey('competitions.id'), primary_key=True),
+    Column('task_id', Integer, ForeignKey('tasks.id'), primary_key=True),
+    Column('team_id', Integer, ForeignKey('teams.id'), primary_key=True),
+    Column('ranked', Boolean, nullable=False),
+    Column('timestamp', BigInteger, nullable=False),
+)
+
+
+class Row(tuple):
+    """
+    An immutable result row that can be read by column name, as an item or
+    an attribute, like the rows dataset returns. dict(row) copies it.
+    """
+
+    __slots__ = ()
+    _fields = ()
+    _index = {}
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, slice)):
+            return tuple.__getitem__(self, key)
+        return tuple.__getitem__(self, self._index[key])
+
+    def __getattr__(self, name):
+        try:
+            return tuple.__getitem__(self, self._index[name])
+        except KeyError:
+            raise AttributeError(name)
+
+    def get(self, key, default=None):
+        index = self._index.get(key)
+        if index is None:
+            return default
+        return tuple.__getitem__(self, index)
+
+    def keys(self):
+        return list(self._fields)
+
+    def __repr__(self):
+        return 'Row(%s)' % ', '.join('%s=%r' % item for item in zip(self._fields, self))
+
+
+_row_classes = {}
+
+
+def row_class(fields):
+    """Returns the Row subclass for a tuple of column names"""
+
+    cls = _row_classes.get(fields)
+    if cls is None:
+        cls = type('Row', (Row,), {
+            '__slots__': (),
+            '_fields': fields,
+            '_index': dict((name, i) for i, name in enumerate(fields)),
+        })
+        cls = _row_classes.setdefault(fields, cls)
+    return cls
+
+
+# Page size of the scoreboard, get_teams binds this many ids per statement
+PAGE_SIZE = 10
+
+_user_by_id = select([users]).where(users.c.id == bindparam('user_id'))
+
+_user_by_name = select([users]).where(users.c.username == bindparam('username')).limit(1)
+
+_user_by_shell_username = (select([users])
+                           .where(users.c.shell_username == bindparam('shell_username'))
+                           .limit(1))
+
+_team_of_user = (select([teams])
+                 .select_from(teams.join(team_player, teams.c.id == team_player.c.team_id))
+                 .where(and_(team_player.c.user_id == bindparam('user_id'),
+                             teams.c.comp_id == bindparam('comp_id')))
+                 .limit(1))
+
+_user_flags = select([flags.c.task_id]).where(flags.c.user_id == bindparam('user_id'))
+
+_competition = select([competitions]).where(competitions.c.id == bindparam('comp_id'))
+
+_competitions = select([competitions])
+
+_comp_score = (select([func.ifnull(func.total(task_competition.c.score), 0)])
+               .where(task_competition.c.comp_id == bindparam('comp_id')))
+
+_tasks_done = (select([flags.c.task_id])
+               .select_from(flags.join(team_player, flags.c.user_id == team_player.c.user_id))
+               .where(and_(flags.c.comp_id == bindparam('comp_id'),
+                           team_player.c.team_id == bindparam('team_id'))))
+
+_rank_entries = (select([teams.c.id, teams.c.score, teams.c.timestamp])
+                 .where(and_(teams.c.comp_id == bindparam('comp_id'),
+                             teams.c.spectator == 0)))
+
+_rank_entry = (select([teams.c.spectator, teams.c.score, teams.c.timestamp])
+               .where(teams.c.id == bindparam('team_id')))
+
+_teams_by_id = select([teams]).where(
+    teams.c.id.in_([bindparam('id%d' % i) for i in range(PAGE_SIZE)]))
+
+_total_users = select([competitions.c.players]).where(competitions.c.id == bindparam('comp_id'))
+
+_categories = select([categories]).order_by(categories.c.id)
+
+_task_stats = (select([task_stats.c.task_id, task_stats.c.solves, task_stats.c.first_team_id,
+                       task_stats.c.first_timestamp, teams.c.name.label('first_team')])
+               .select_from(task_stats.outerjoin(teams, teams.c.id == task_stats.c.first_team_id))
+               .where(task_stats.c.comp_id == bindparam('comp_id')))
+
+_solve_hours = (select([task_solve_hours.c.task_id, task_solve_hours.c.hour, task_solve_hours.c.solves])
+                .where(task_solve_hours.c.comp_id == bindparam('comp_id')))
+
+_solve_counts = (select([task_stats.c.task_id, task_stats.c.solves])
+                 .where(task_stats.c.comp_id == bindparam('comp_id')))
+
+_solver_entries = (select([teams.c.id, teams.c.spectator, teams.c.score, teams.c.timestamp])
+                   .select_from(task_solves.join(teams, teams.c.id == task_solves.c.team_id))
+                   .where(and_(task_solves.c.comp_id == bindparam('comp_id'),
+                               task_solves.c.task_id == bindparam('task_id'))))
+
+_task = select([tasks]).where(tasks.c.id == bindparam('task_id'))
+
+# Everything the task pages show, never the flag
+_competition_tasks = (select([tasks.c.id, tasks.c.name, tasks.c.desc, tasks.c.hint, tasks.c.file,
+                              tasks.c.file_hash, tasks.c.category, task_competition.c.score])
+                      .where(and_(tasks.c.id == task_competition.c.task_id,
+                                  task_competition.c.comp_id == bindparam('comp_id'))))
+
+_flag_entries = (select([tasks.c.id, tasks.c.flag, task_competition.c.score])
+                 .where(and_(tasks.c.id == task_competition.c.task_id,
+                             task_competition.c.comp_id == bindparam('comp_id'))))
+
+
+class Queries(object):
+    """
+    Runs the statements above on an engine. Each statement is compiled the
+    first time it runs and then taken from a compiled cache, so
+    a call only binds its parameters and builds Row tuples.
+
+    Only the fixed statements of this module may be run through it: the
+    compiled cache is keyed by statement object and never shrinks.
+    """
+
+    def __init__(self, engine):
+        self._engine = engine
+        self._compiled = {}
+
+    def _execute(self, statement, params):
+        # The option is set per connection: an engine copy made with
+        # execution_options would run the Engine class listeners twice
+        with self._engine.connect() as connection:
+            connection = connection.execution_options(compiled_cache=self._compiled)
+            result = connection.execute(statement, **params)
+            return result.keys(), result.fetchall()
+
+    def _all(self, statement, **params):
+        keys, rows = self._execute(statement, params)
+        cls = row_class(tuple(keys))
+        return [cls(row) for row in rows]
+
+    def _first(self, statement, **params):
+        rows = self._all(statement, **params)
+        return rows[0] if rows else None
+
+    def _tuples(self, statement, **params):
+        keys, rows = self._execute(statement, params)
+        return [tuple(row) for row in rows]
+
+    def _column(self, statement, **params):
+        keys, rows = self._execute(statement, params)
+        return [row[0] for row in rows]
+
+    def _scalar(self, statement, **params):
+        keys, rows = self._execute(statement, params)
+        return rows[0][0]
+
+    def get_user_by_id(self, user_id):
+        return self._first(_user_by_id, user_id=user_id)
+
+    def get_user_by_name(self, username):
+        return self._first(_user_by_name, username=username)
+
+    def get_user_by_shell_username(self, shell_username):
+        return self._first(_user_by_shell_username, shell_username=shell_username)
+
+    def get_team(self, user_id, comp_id):
+        """Returns the team of a user in a competition, or None"""
+
+        return self._first(_team_of_user, user_id=user_id, comp_id=comp_id)
+
+    def get_flags(self, user_id):
+        """Returns the ids of the tasks solved by a user"""
+
+        return self._column(_user_flags, user_id=user_id)
+
+    def get_competition(self, comp_id):
+        return self._first(_competition, comp_id=comp_id)
+
+    def get_competitions(self):
+        return self._all(_competitions)
+
+    def get_comp_score(self, comp_id):
+        """Returns the sum of the scores of the tasks of a competition"""
+
+        return int(self._scalar(_comp_score, comp_id=comp_id))
+
+    def get_tasks_done(self, team_id, comp_id):
+        """Returns the ids of the tasks solved by a team"""
+
+        return self._column(_tasks_done, team_id=team_id, comp_id=comp_id)
+
+    def get_rank_entries(self, comp_id):
+        """Returns (team_id, score, timestamp) of the ranked teams"""
+
+        return self._tuples(_rank_entries, comp_id=comp_id)
+
+    def get_rank_entry(self, team_id):
+        """Returns (spectator, score, timestamp) of a team, or None"""
+
+        return self._first(_rank_entry, team_id=team_id)
+
+    def get_teams(self, team_ids):
+        """Returns the teams with the given ids, in no particular order"""
+
+        rows = []
+        team_ids = list(team_ids)
+        for start in range(0, len(team_ids), PAGE_SIZE):
+            chunk = team_ids[start:start + PAGE_SIZE]
+            # Unused slots are bound to NULL, which matches no id
+            params = dict(('id%d' % i, None) for i in range(PAGE_SIZE))
+            params.update(('id%d' % i, team_id) for i, team_id in enumerate(chunk))
+            rows.extend(self._all(_teams_by_id, **params))
+        return rows
+
+    def get_total_users(self, comp_id):
+        """Returns the number of players in non-spectator teams"""
+
+        row = self._first(_total_users, comp_id=comp_id)
+        return row['players'] if row else 0
+
+    def get_task_stats(self, comp_id):
+        """Returns the solves and first blood of the solved tasks of a competition"""
+
+        return self._all(_task_stats, comp_id=comp_id)
+
+    def get_solve_hours(self, comp_id):
+        """Returns (task_id, hour, solves) of a competition, hours since the epoch"""
+
+        return self._tuples(_solve_hours, comp_id=comp_id)
+
+    def get_solve_counts(self, comp_id):
+        """Returns (task_id, solves) of the solved tasks of a competition"""
+
+        return self._tuples(_solve_counts, comp_id=comp_id)
+
+    def get_solver_entries(self, comp_id, task_id):
+        """Returns (id, spectator, score, timestamp) of the teams credited with a task"""
+
+        return self._tuples(_solver_entries, comp_id=comp_id, task_id=task_id)
+
+    def get_categories(self):
+        return self._all(_categories)
+
+    def get_task(self, task_id):
+        return self._first(_task, task_id=task_id)
+
+    def get_competition_tasks(self, comp_id):
+        """Returns the tasks of a competition with their scores, without their flags"""
+
+        return self._all(_competition_tasks, comp_id=comp_id)
+
+    def get_flag_entries(self, comp_id):
+        """Returns (task_id, flag, score) of the tasks of a competition"""
+
+        return self._tuples(_flag_entries, comp_id=comp_id)
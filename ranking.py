@@ -0,0 +1,225 @@
+"""
+In-memory scoreboard ordering.
+"""
+
+from bisect import bisect_left, insort
+from threading import Lock
+
+from cache import Registry
+
+
+class RankIndex(object):
+    """
+    Order-statistic index over the non-spectator teams of one competition.
+
+    Teams are kept sorted by (score desc, timestamp asc, id asc) in a list of
+    bounded sublists. A Fenwick tree over the sublist lengths turns positions
+    into ranks, so updates and lookups cost O(log N) plus a short memmove.
+    """
+
+    load = 512
+
+    def __init__(self, teams=()):
+        """
+        Args:
+            teams: iterable of (team_id, score, timestamp)
+        """
+
+        self._lock = Lock()
+        self._keys = {}
+        for team_id, score, timestamp in teams:
+            self._keys[team_id] = self._key(team_id, score, timestamp)
+        self._rebuild()
+
+    @staticmethod
+    def _key(team_id, score, timestamp):
+        return (-(score or 0), timestamp or 0, team_id)
+
+    def _rebuild(self):
+        keys = sorted(self._keys.values())
+        self._lists = [keys[i:i + self.load] for i in range(0, len(keys), self.load)]
+        self._maxes = [sublist[-1] for sublist in self._lists]
+        self._build_tree()
+
+    def _build_tree(self):
+        tree = [0] * (len(self._lists) + 1)
+        for i, sublist in enumerate(self._lists):
+            j = i + 1
+            tree[j] += len(sublist)
+            parent = j + (j & -j)
+            if parent < len(tree):
+                tree[parent] += tree[j]
+        self._tree = tree
+
+    def _tree_add(self, pos, delta):
+        pos += 1
+        while pos < len(self._tree):
+            self._tree[pos] += delta
+            pos += pos & -pos
+
+    def _tree_prefix(self, pos):
+        total = 0
+        while pos > 0:
+            total += self._tree[pos]
+            pos -= pos & -pos
+        return total
+
+    def _tree_find(self, index):
+        """Returns (sublist position, offset inside it) of the index-th key"""
+        pos = 0
+        step = 1
+        while step * 2 < len(self._tree):
+            step *= 2
+        while step:
+            nxt = pos + step
+            if nxt < len(self._tree) and self._tree[nxt] <= index:
+                index -= self._tree[nxt]
+                pos = nxt
+            step //= 2
+        return pos, index
+
+    def _insert(self, key):
+        if not self._maxes:
+            self._lists.append([key])
+            self._maxes.append(key)
+            self._build_tree()
+            return
+
+        pos = bisect_left(self._maxes, key)
+        if pos == len(self._maxes):
+            pos -= 1
+        sublist = self._lists[pos]
+        insort(sublist, key)
+        self._maxes[pos] = sublist[-1]
+
+        if len(sublist) > 2 * self.load:
+            self._lists[pos:pos + 1] = [sublist[:self.load], sublist[self.load:]]
+            self._maxes[pos:pos + 1] = [self._lists[pos][-1], self._lists[pos + 1][-1]]
+            self._build_tree()
+        else:
+            self._tree_add(pos, 1)
+
+    def _remove(self, key):
+        pos = bisect_left(self._maxes, key)
+        sublist = self._lists[pos]
+        del sublist[bisect_left(sublist, key)]
+
+        if sublist:
+            self._maxes[pos] = sublist[-1]
+            self._tree_add(pos, -1)
+        else:
+            del self._lists[pos]
+            del self._maxes[pos]
+            self._build_tree()
+
+    def _position(self, key):
+        pos = bisect_left(self._maxes, key)
+        return self._tree_prefix(pos) + bisect_left(self._lists[pos], key)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, team_id):
+        return team_id in self._keys
+
+    def update(self, team_id, score, timestamp):
+        """Inserts a team or moves it to its new position"""
+
+        key = self._key(team_id, score, timestamp)
+        with self._lock:
+            old = self._keys.get(team_id)
+            if old == key:
+                return
+            if old is not None:
+                self._remove(old)
+            self._insert(key)
+            self._keys[team_id] = key
+
+    def update_many(self, teams):
+        """
+        Moves many teams at once, e.g. every solver of a task whose value
+        dropped. The index is rebuilt when they are a large part of it.
+
+        Args:
+            teams: iterable of (team_id, score, timestamp)
+        """
+
+        with self._lock:
+            moves = []
+            for team_id, score, timestamp in teams:
+                key = self._key(team_id, score, timestamp)
+                old = self._keys.get(team_id)
+                if old != key:
+                    moves.append((team_id, old, key))
+            if not moves:
+                return
+
+            if len(moves) * 8 > len(self._keys):
+                for team_id, old, key in moves:
+                    self._keys[team_id] = key
+                self._rebuild()
+            else:
+                for team_id, old, key in moves:
+                    if old is not None:
+                        self._remove(old)
+                    self._insert(key)
+                    self._keys[team_id] = key
+
+    def discard(self, team_id):
+        """Removes a team from the ranking, if present"""
+
+        with self._lock:
+            old = self._keys.pop(team_id, None)
+            if old is not None:
+                self._remove(old)
+
+    def rank(self, team_id):
+        """
+        Returns the 1-based rank of a team, or 0 if it is not ranked
+        (spectators, unknown teams).
+        """
+
+        with self._lock:
+            key = self._keys.get(team_id)
+            if key is None:
+                return 0
+            return self._position(key) + 1
+
+    def page(self, offset, limit):
+        """
+        Returns a slice of the ranking as a list of (team_id, rank) tuples.
+        """
+
+        result = []
+        with self._lock:
+            if offset < 0 or offset >= len(self._keys):
+                return result
+
+            pos, index = self._tree_find(offset)
+            rank = offset + 1
+            while pos < len(self._lists) and len(result) < limit:
+                for key in self._lists[pos][index:index + limit - len(result)]:
+                    result.append((key[2], rank))
+                    rank += 1
+                pos += 1
+                index = 0
+        return result
+
+
+class RankRegistry(Registry):
+    """
+    Lazily loads one RankIndex per competition and keeps it until the
+    scores of the competition are rebuilt.
+    """
+
+    def __init__(self, loader):
+        """
+        Args:
+            loader: callable taking a comp_id and returning an iterable of
+                    (team_id, score, timestamp) for its non-spectator teams
+        """
+
+        Registry.__init__(self, loader)
+
+    def build(self, comp_id):
+        return RankIndex(self._loader(comp_id))
@@ -0,0 +1,146 @@
+"""
+Token bucket rate limiting shared by every worker process.
+"""
+
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import time
+from threading import Lock
+
+
+class TokenBuckets(object):
+    """
+    A fixed-size hash table of token buckets kept in a memory-mapped file,
+    so that all workers mapping the same file share their buckets.
+
+    The table is split into groups of slots. A key always lives in the group
+    its hash points to, and only that group is locked while its bucket is
+    refilled and charged: with a byte range lock between processes, and a
+    process-wide lock between threads, which record locks do not exclude.
+    Keys are hashed with a random secret kept at the start of the file, so
+    nobody can pick keys that fill the group of someone else's bucket.
+
+    When a group is full, the bucket touched longest ago is recycled and the
+    new key starts with the tokens that bucket has refilled to, at most its
+    own burst. Cycling keys through a group thus gains no tokens, but a new
+    key may start below its burst while its group is under pressure.
+    """
+
+    header_size = 32  # secret of the key hashes
+    slot = struct.Struct('=Qdd')  # key hash, tokens, time of last update
+    group_size = 8
+
+    def __init__(self, path, groups=8192):
+        self.path = path
+        self.groups = groups
+        self._group_bytes = self.slot.size * self.group_size
+        size = self.header_size + self._group_bytes * groups
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        except:
+            os.close(fd)
+            raise
+        self._fd = fd
+        self._lock = Lock()
+        # Hash state primed with the secret, copied for every key
+        self._seed = hashlib.md5(self._load_secret())
+
+    def _load_secret(self):
+        """Returns the secret of the file, created by the first process to map it"""
+
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, self.header_size, 0)
+        try:
+            secret = self._map[:self.header_size]
+            if secret == b'\0' * self.header_size:
+                secret = os.urandom(self.header_size)
+                self._map[:self.header_size] = secret
+            return secret
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, self.header_size, 0)
+
+    def _hash(self, key):
+        if not isinstance(key, bytes):
+            key = key.encode('utf-8')
+        digest = self._seed.copy()
+        digest.update(key)
+        # 0 marks an empty slot
+        return struct.unpack('=Q', digest.digest()[:8])[0] or 1
+
+    def take(self, key, rate, burst, cost=1.0):
+        """
+        Takes cost tokens from the bucket of key, which refills at rate
+        tokens per second up to burst tokens.
+
+        Returns:
+            0 if the tokens were taken, otherwise the number of seconds
+            until enough tokens are available.
+        """
+
+        h = self._hash(key)
+        start = self.header_size + (h % self.groups) * self._group_bytes
+        now = time.time()
+
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, self._group_bytes, start)
+            try:
+                return self._take(h, start, now, rate, burst, cost)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self._group_bytes, start)
+
+    def _take(self, h, start, now, rate, burst, cost):
+        """Refills and charges the bucket of h, its group must be locked"""
+
+        offset = None
+        oldest = None
+        for i in range(self.group_size):
+            position = start + i * self.slot.size
+            slot_hash, tokens, last = self.slot.unpack_from(self._map, position)
+            if slot_hash == h:
+                offset = position
+                break
+            if oldest is None or last < oldest[2]:
+                oldest = (position, tokens, last)
+
+        if offset is None:
+            # Empty slots have never been updated and give a full bucket
+            offset, tokens, last = oldest
+        tokens = min(burst, tokens + (now - last) * rate)
+
+        if tokens >= cost:
+            self.slot.pack_into(self._map, offset, h, tokens - cost, now)
+            return 0
+
+        self.slot.pack_into(self._map, offset, h, tokens, now)
+        return (cost - tokens) / rate
+
+
+class RateLimiter(object):
+    """
+    Named limits on top of TokenBuckets, configured as
+
+        {"file": path, "<name>": {"rate": per second, "burst": tokens}, ...}
+    """
+
+    def __init__(self, settings):
+        settings = dict(settings)
+        self.buckets = TokenBuckets(settings.pop('file'), settings.pop('groups', 8192))
+        self.limits = settings
+
+    def check(self, name, key):
+        """
+        Charges one request to the bucket of key under the limit name.
+        Returns 0 if it is allowed, else the seconds to wait. Limits that
+        are not configured always allow.
+        """
+
+        limit = self.limits.get(name)
+        if limit is None:
+            return 0
+        return self.buckets.take('%s:%s' % (name, key), limit['rate'], limit['burst'])
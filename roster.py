@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+
+"""roster.py -- registers the participants of an event in bulk
+
+Usage: python roster.py [--processes N] [--no-provision] <comp_id> <roster>
+
+The roster is a CSV file with a header, or a JSON list of objects, with the
+fields username, password and optionally team and spectator. Participants
+with the same team name are put in one new team of the competition.
+
+Every user, team and membership is inserted in one transaction, so a roster
+with an error changes nothing. The shell accounts are then created in
+batches, unless --no-provision leaves them to provisioning.py.
+"""
+
+import argparse
+import binascii
+import csv
+import functools
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+
+import bleach
+from sqlalchemy import select
+from werkzeug.security import generate_password_hash
+
+import aggregates
+from passwords import full_method
+from queries import users, teams, team_player, competitions
+from utils import hash_password, sanitize_name
+
+
+# Most players in a team, as enforced by the team registration form
+TEAM_SIZE = 3
+
+TRUE = ('1', 'true', 'yes', 'y')
+
+# Names bleach.clean leaves as they are
+SAFE_NAME = re.compile(r'^[\w .@+-]*$', re.UNICODE)
+
+
+def read_roster(path):
+    """Returns the rows of a CSV or JSON roster as a list of dicts"""
+
+    if path.endswith('.json'):
+        with open(path, 'rb') as f:
+            return json.loads(f.read().decode('utf-8'))
+
+    if sys.version_info[0] >= 3:
+        with open(path, newline='', encoding='utf-8') as f:
+            return list(csv.DictReader(f))
+    with open(path, 'rb') as f:
+        return [dict((key, value.decode('utf-8')) for key, value in row.items() if value is not None)
+                for row in csv.DictReader(f)]
+
+
+def clean(name):
+    """bleach.clean(name, tags=[]), which takes a millisecond, for untrusted names only"""
+
+    if SAFE_NAME.match(name):
+        return name
+    return bleach.clean(name, tags=[])
+
+
+def _hash(method, password):
+    return generate_password_hash(password, method), hash_password(password)
+
+
+def hash_passwords(passwords, method, processes=None):
+    """
+    Hashes passwords for the site and for the shell on every core
+
+    Returns:
+        A list of (password_hash, shell_password_hash), in order.
+    """
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(functools.partial(_hash, method), passwords, chunksize=64)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def parse_roster(rows):
+    """
+    Checks a roster and cleans its names like the registration forms do
+
+    Returns:
+        A list of (username, shell_username, password, team, spectator).
+    Raises:
+        ValueError: listing every problem found
+    """
+
+    entries = []
+    errors = []
+    for line, row in enumerate(rows, 1):
+        username = clean(row.get('username') or '').strip()
+        password = row.get('password') or ''
+        team = clean(row.get('team') or '').strip() or None
+        spectator = str(row.get('spectator') or '').strip().lower() in TRUE
+        if not username or not password:
+            errors.append('row %d: username and password are required' % line)
+            continue
+        entries.append((username, sanitize_name(username), password, team, spectator))
+
+    names, shell_names, members, spectators = set(), set(), {}, {}
+    for username, shell_username, password, team, spectator in entries:
+        if username in names or shell_username in shell_names:
+            errors.append('%s: listed twice' % username)
+        names.add(username)
+        shell_names.add(shell_username)
+        if team is not None:
+            members[team] = members.get(team, 0) + 1
+            spectators.setdefault(team, set()).add(spectator)
+
+    for team in sorted(members):
+        if members[team] > TEAM_SIZE:
+            errors.append('team %s: %d players, at most %d' % (team, members[team], TEAM_SIZE))
+        if len(spectators[team]) > 1:
+            errors.append('team %s: mixes players and spectators' % team)
+
+    if errors:
+        raise ValueError('\n'.join(errors))
+    return entries
+
+
+def import_roster(engine, comp_id, rows, queue, processes=None, method=None):
+    """
+    Registers the participants of a roster in a competition
+
+    Args:
+        engine: SQLAlchemy engine of the database
+        comp_id: competition the teams are created in
+        rows: the roster, as returned by read_roster
+        queue: ProvisioningQueue the shell accounts are queued in
+        processes: processes hashing the passwords, every core by default
+        method: werkzeug hash method, by default the one of passwords.py
+    Returns:
+        The number of users and of teams created.
+    Raises:
+        ValueError: the roster is invalid, nothing was inserted
+    """
+
+    entries = parse_roster(rows)
+    hashes = hash_passwords([entry[2] for entry in entries], method or full_method(), processes)
+
+    with engine.begin() as connection:
+        competition = connection.execute(
+            select([competitions.c.id]).where(competitions.c.id == comp_id)).first()
+        if competition is None:
+            raise ValueError('competition %s: not found' % comp_id)
+
+        taken = connection.execute(
+            select([users.c.username, users.c.shell_username])).fetchall()
+        names = set(row[0] for row in taken)
+        shell_names = set(row[1] for row in taken)
+        conflicts = ['%s: already registered' % entry[0] for entry in entries
+                     if entry[0] in names or entry[1] in shell_names]
+        if conflicts:
+            raise ValueError('\n'.join(conflicts))
+
+        team_ids = {}
+        memberships = []
+        jobs = []
+        for (username, shell_username, password, team, spectator), (web_hash, shell_hash) in zip(entries, hashes):
+            user_id = connection.execute(
+                users.insert(),
+                username=username, password=web_hash, admin=False,
+                shell_username=shell_username).inserted_primary_key[0]
+            jobs.append((user_id, shell_username, shell_hash))
+
+            if team is None:
+                continue
+            if team not in team_ids:
+                team_ids[team] = connection.execute(
+                    teams.insert(),
+                    name=team, comp_id=comp_id, spectator=spectator, score=0, timestamp=0,
+                    secret=binascii.hexlify(os.urandom(16)).decode('ascii')).inserted_primary_key[0]
+            memberships.append(dict(team_id=team_ids[team], user_id=user_id))
+
+        if memberships:
+            connection.execute(team_player.insert(), memberships)
+
+        # Like the registration form, spectator teams are not counted
+        in_teams = [entry for entry in entries if entry[3] is not None]
+        aggregates.adjust(
+            connection, comp_id,
+            teams=len(set(entry[3] for entry in in_teams if not entry[4])),
+            players=len([entry for entry in in_teams if not entry[4]]),
+            spectators=len([entry for entry in in_teams if entry[4]]))
+
+        queue.enqueue_many(jobs, connection)
+
+    return len(entries), len(team_ids)
+
+
+if __name__ == '__main__':
+    import logging
+
+    import storage
+    from channel import Channel
+    from passwords import DEFAULT_METHOD, DEFAULT_ITERATIONS
+    from provisioning import ProvisioningQueue
+    from utils import create_account, create_accounts
+
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description='Registers the participants of an event in bulk.')
+    parser.add_argument('comp_id', type=int)
+    parser.add_argument('roster')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='processes hashing the passwords, every core by default')
+    parser.add_argument('--no-provision', dest='provision', action='store_false',
+                        help='leave the shell accounts to provisioning.py')
+    args = parser.parse_args()
+
+    with open('config.json', 'rb') as f:
+        config = json.loads(f.read())
+    settings = dict(config.get('provisioning', {}))
+    settings.pop('workers', None)
+    passwords = config.get('passwords', {})
+    method = full_method(passwords.get('method', DEFAULT_METHOD), passwords.get('iterations', DEFAULT_ITERATIONS))
+
+    db = storage.connect(config['db'], config.get('storage'))
+    queue = ProvisioningQueue(db.engine, create_account, batch_task=create_accounts, **settings)
+
+    start = time.time()
+    try:
+        created, created_teams = import_roster(db.engine, args.comp_id, read_roster(args.roster),
+                                               queue, args.processes, method)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    print('%d users and %d teams registered in %.1f s' % (created, created_teams, time.time() - start))
+
+    # Running workers reload the teams and the competition
+    if 'channel' in config:
+        settings = dict(config['channel'])
+        Channel(settings.pop('file'), **settings).publish('roster', comp_id=args.comp_id)
+
+    if args.provision:
+        start = time.time()
+        while queue.run_batch():
+            pass
+        print('Shell accounts created in %.1f s' % (time.time() - start))
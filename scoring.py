@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+
+"""scoring.py -- recomputes the scores of the teams of a competition
+
+Usage: python scoring.py <comp_id> [comp_id ...]
+
+A team is credited with a task when its first flag for the task was found
+while the competition ran, like a submission is. The teams credited with
+a task are kept in task_solves, and a task is worth what the scoring model
+of its competition gives for its score and its ranked solves: the score
+itself, or less and less as more teams solve it.
+
+Submissions credit the solving team and, when the value of the task drops,
+move every other team credited with it by the difference. When task values
+or the scoring model change, every score is rebuilt from the solver sets
+with one statement. This command also rebuilds the solver sets from the
+flags first, as the recompute action of the admins does.
+"""
+
+import argparse
+import calendar
+import json
+import math
+
+from sqlalchemy import text
+
+
+class Static(object):
+    """A task is worth its score however many teams solve it"""
+
+    name = 'static'
+    dynamic = False
+
+    def __init__(self, decay=0, minimum=0):
+        pass
+
+    def value(self, score, solves):
+        return score
+
+
+class LinearDecay(object):
+    """
+    A task loses the same value with every solve after the first, down to
+    its minimum at `decay` solves
+    """
+
+    name = 'linear'
+    dynamic = True
+
+    def __init__(self, decay=0, minimum=0):
+        """
+        Args:
+            decay: solves after which a task is worth its minimum, at least 2
+            minimum: least value of a task, in percent of its score
+        """
+
+        if decay < 2 or not 0 <= minimum <= 100:
+            raise ValueError('Decay must be at least 2 solves and the minimum a percentage')
+        self.decay = decay
+        self.minimum = minimum
+
+    def value(self, score, solves):
+        if solves <= 1:
+            return score
+        floor = score * self.minimum // 100
+        return max(floor, score - (score - floor) * (solves - 1) // (self.decay - 1))
+
+
+class LogDecay(LinearDecay):
+    """
+    A task loses value quickly with its first solves and slowly after them,
+    down to its minimum at `decay` solves
+    """
+
+    name = 'log'
+
+    def value(self, score, solves):
+        if solves <= 1:
+            return score
+        floor = score * self.minimum // 100
+        return max(floor, score - int(round((score - floor) * math.log(solves) / math.log(self.decay))))
+
+
+# Scoring models by the name stored on the competitions
+MODELS = dict((model.name, model) for model in (Static, LinearDecay, LogDecay))
+
+
+def get_model(competition):
+    """
+    Returns the scoring model of a competition row
+
+    Raises:
+        ValueError: the model is unknown or its settings are invalid
+    """
+
+    name = competition.get('scoring') or Static.name
+    if name not in MODELS:
+        raise ValueError('Unknown scoring model %s' % name)
+    return MODELS[name](competition.get('decay') or 0, competition.get('minimum') or 0)
+
+
+# Credits each team of the competition with the tasks whose first flag it
+# found while the competition ran
+_solvers = '''
+INSERT INTO task_solves (comp_id, task_id, team_id, ranked, timestamp)
+SELECT :comp_id, f.task_id, tp.team_id, st.spectator = 0, min(f.timestamp)
+FROM teams st
+JOIN team_player tp ON tp.team_id = st.id
+JOIN flags f ON f.user_id = tp.user_id AND f.comp_id = :comp_id
+WHERE st.comp_id = :comp_id
+GROUP BY tp.team_id, f.task_id
+HAVING min(f.timestamp) > :start AND (:end IS NULL OR min(f.timestamp) < :end)
+'''
+
+# The ranked solves of the statistics are the ones the values depend on,
+# the first solve taking the first blood of a task solved by nobody before
+_first_solves = '''
+INSERT OR IGNORE INTO task_stats (comp_id, task_id, solves, first_team_id, first_timestamp)
+SELECT comp_id, task_id, 0, team_id, min(timestamp)
+FROM task_solves WHERE comp_id = :comp_id AND ranked
+GROUP BY task_id
+'''
+
+_solve_counts = '''
+UPDATE task_stats SET solves = (
+    SELECT count(*) FROM task_solves s
+    WHERE s.comp_id = task_stats.comp_id AND s.task_id = task_stats.task_id AND s.ranked)
+WHERE comp_id = :comp_id
+'''
+
+_task_solves = '''
+SELECT tc.task_id, tc.score, ifnull(ts.solves, 0)
+FROM task_competition tc
+LEFT JOIN task_stats ts ON ts.comp_id = tc.comp_id AND ts.task_id = tc.task_id
+WHERE tc.comp_id = :comp_id
+'''
+
+# Score and last solve of every team of the competition from the solver
+# sets and the task values. Teams without solves are reset, and only the
+# teams that changed are written. Each team reads its own solves through
+# ix_task_solves_team, and correlated subqueries keep the statement to what
+# any SQLite runs: UPDATE ... FROM needs 3.33, and a statement starting with
+# WITH would make pysqlite commit the transaction first.
+_recompute = '''
+UPDATE teams SET score = %(score)s, timestamp = %(timestamp)s
+WHERE comp_id = :comp_id AND (score IS NOT %(score)s OR timestamp IS NOT %(timestamp)s)
+'''
+
+# Aggregate of the solves of the team being updated, among the given tasks.
+# The unary + keeps SQLite from probing the index once per task instead of
+# reading the few solves of the team.
+_team_solves = '''ifnull((
+    SELECT %s FROM task_solves s
+    WHERE s.comp_id = :comp_id AND s.team_id = teams.id AND +s.task_id IN (%s)), 0)'''
+
+
+def to_millis(date):
+    """Returns a UTC datetime as epoch milliseconds, like flag timestamps, or None"""
+
+    if date is None:
+        return None
+    return calendar.timegm(date.utctimetuple()) * 1000
+
+
+def rebuild_solvers(connection, comp_id, start, end):
+    """
+    Rebuilds the solver sets of the tasks of a competition from the flags,
+    and the ranked solves of their statistics, in the transaction of the
+    connection
+
+    Args:
+        comp_id: competition whose solver sets are rebuilt
+        start: start of the competition in epoch milliseconds, None if it
+               has none and nothing is scored
+        end: end of the competition in epoch milliseconds, None if open
+    """
+
+    connection.execute(text('DELETE FROM task_solves WHERE comp_id = :comp_id'), comp_id=comp_id)
+    connection.execute(text(_solvers), comp_id=comp_id, start=start, end=end)
+    connection.execute(text(_first_solves), comp_id=comp_id)
+    connection.execute(text(_solve_counts), comp_id=comp_id)
+
+
+def recompute(connection, comp_id, model=None):
+    """
+    Rebuilds the score and last solve timestamp of every team of a
+    competition from the solver sets and the current task values, in the
+    transaction of the connection
+
+    Args:
+        comp_id: competition whose teams are recomputed
+        model: scoring model of the competition, Static by default
+    Returns:
+        The number of teams whose score or timestamp changed.
+    """
+
+    model = model or Static()
+
+    # The values are inlined as integers, many tasks would exceed the bound
+    # parameters of older SQLite. The most solved tasks come first in the
+    # CASE, which is tried in order for every solve.
+    tasks = sorted(connection.execute(text(_task_solves), comp_id=comp_id), key=lambda task: -task[2])
+    task_ids = ', '.join('%d' % task_id for task_id, score, solves in tasks)
+    values = ' '.join('WHEN %d THEN %d' % (task_id, model.value(score or 0, solves))
+                      for task_id, score, solves in tasks)
+    score = _team_solves % ('sum(CASE s.task_id %s END)' % values if tasks else '0', task_ids)
+    timestamp = _team_solves % ('max(s.timestamp)', task_ids)
+
+    statement = _recompute % {'score': score, 'timestamp': timestamp}
+    return connection.execute(text(statement), comp_id=comp_id).rowcount
+
+
+if __name__ == '__main__':
+    import storage
+    from cache import CompetitionInfo
+    from channel import Channel
+    from queries import Queries
+
+    parser = argparse.ArgumentParser(description='Recomputes the scores of the teams of competitions.')
+    parser.add_argument('comp_ids', metavar='comp_id', type=int, nargs='+')
+    args = parser.parse_args()
+
+    with open('config.json', 'rb') as f:
+        config = json.loads(f.read())
+
+    db = storage.connect(config['db'], config.get('storage'))
+    queries = Queries(db.engine)
+    for comp_id in args.comp_ids:
+        row = queries.get_competition(comp_id)
+        if row is None:
+            print('competition %d: not found' % comp_id)
+            continue
+        info = CompetitionInfo(row)
+        with db.engine.begin() as connection:
+            rebuild_solvers(connection, comp_id, to_millis(info.start), to_millis(info.end))
+            changed = recompute(connection, comp_id, get_model(row))
+        print('competition %d: %d teams changed' % (comp_id, changed))
+
+        # Running workers reload the ranking
+        if changed and 'channel' in config:
+            settings = dict(config['channel'])
+            Channel(settings.pop('file'), **settings).publish('scores', comp_id=comp_id)
@@ -10,23 +10,41 @@ import hashlib
 import os
 import dateparser
 import bleach
-import re
-import string
+import math
+import mimetypes
 from datetime import datetime
 
 from spur import LocalShell
-from utils import create_user
+from utils import create_account, create_accounts, hash_password, sanitize_name
+from ranking import RankRegistry
+from cache import VersionedCache, CompetitionCache, Versions, RUNNING, make_etag, parse_date
+from events import EventRegistry
+from submissions import SubmissionEngine
+from flagindex import FlagRegistry
+from catalog import CatalogRegistry
+from ratelimit import RateLimiter
+from attempts import AttemptLog
+from queries import Queries
+from channel import Channel
+from provisioning import ProvisioningQueue
+from passwords import PasswordHasher, Busy
+from attachments import AttachmentStore
+import aggregates
+import scoring
+import storage
 
 from base64 import b64decode
 from functools import wraps
 
-from sqlalchemy import event
+from sqlalchemy import event, text
 from sqlalchemy.engine import Engine
-from sqlite3 import Connection as SQLite3Connection
+from sqlalchemy.exc import IntegrityError
 from werkzeug.contrib.fixers import ProxyFix
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge
 
 from flask import Flask
+from flask import Request
 from flask import jsonify
 from flask import make_response
 from flask import redirect
@@ -35,43 +53,88 @@ from flask import request
 from flask import session
 from flask import url_for
 from flask import Response
+from flask import g
+from flask import has_request_context
+from flask import Markup
+
+class UploadRequest(Request):
+    """
+    Lets the task upload routes take files up to the attachment size limit,
+    written straight into the attachment store. Every other route keeps the
+    default limit and file handling.
+    """
+
+    # Endpoints whose body is the upload of a task attachment
+    upload_endpoints = frozenset(['task_add', 'task_edit'])
+
+    @property
+    def max_content_length(self):
+        # The endpoint is matched before the body is parsed
+        if self.endpoint in self.upload_endpoints:
+            return attachments_max_size
+        return Request.max_content_length.fget(self)
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint in self.upload_endpoints:
+            return attachments.upload()
+        return Request._get_file_stream(self, total_content_length, content_type, filename, content_length)
+
 
 app = Flask(__name__, static_folder='static', static_url_path='')
+app.request_class = UploadRequest
 
 db = None
+reader = None
+queries = None
+channel = None
+provisioner = None
+hasher = None
+attachments = None
+attachments_max_size = None
 lang = None
 config = None
+limiter = None
 
 descAllowedTags = bleach.ALLOWED_TAGS + ['br', 'pre']
 
 
-@event.listens_for(Engine, "connect")
-def _set_sqlite_pragma(dbapi_connection, connection_record):
-    """ Enforces sqlite foreign key constrains """
-    if isinstance(dbapi_connection, SQLite3Connection):
-        cursor = dbapi_connection.cursor()
-        cursor.execute("PRAGMA foreign_keys=ON;")
-        cursor.close()
-
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    """ Counts the SQL statements issued by the current request """
+    if has_request_context():
+        g.sql_statements = getattr(g, 'sql_statements', 0) + 1
 
-def sanitize_name(name):
-    """
-    Sanitize a given name such that it conforms to unix policy.
-    Args:
-        name: the name to sanitize.
-    Returns:
-        The sanitized form of name.
-    """
 
-    if len(name) == 0:
-        raise Exception("Can not sanitize an empty field.")
+@app.after_request
+def _report_statements(response):
+    if config['debug']:
+        count = getattr(g, 'sql_statements', 0)
+        response.headers['X-SQL-Statements'] = str(count)
+        app.logger.debug('%s %s: %d SQL statements', request.method, request.path, count)
+    return response
 
-    sanitized_name = re.sub(r"[^a-z0-9\+-]", "-", name.lower())
 
-    if sanitized_name[0] in string.digits:
-        sanitized_name = "p" + sanitized_name
+def request_cached(f):
+    """
+    Memoizes a lookup on flask.g, so that each entity is loaded at most once
+    per request. Arguments are compared by their string form, since ids
+    arrive both as ints and as url strings.
+    """
 
-    return sanitized_name
+    @wraps(f)
+    def decorated_function(*args):
+        if not has_request_context():
+            return f(*args)
+
+        identity_map = getattr(g, 'identity_map', None)
+        if identity_map is None:
+            identity_map = g.identity_map = {}
+
+        key = (f.__name__,) + tuple(str(arg) for arg in args)
+        if key not in identity_map:
+            identity_map[key] = f(*args)
+        return identity_map[key]
+    return decorated_function
 
 
 def login_required(f):
@@ -99,163 +162,193 @@ def admin_required(f):
     return decorated_function
 
 
+def rate_limit(*limits):
+    """
+    Charges the request to the given (limit name, key) buckets.
+    Returns the number of seconds to wait if any of them is empty, else 0.
+    """
+
+    if limiter is None:
+        return 0
+
+    for name, key in limits:
+        wait = limiter.check(name, key)
+        if wait:
+            return int(math.ceil(wait))
+    return 0
+
+
+def too_many_requests(wait):
+    response = jsonify({'message': 'Too many requests'})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(wait)
+    return response
+
+
 def get_user():
     """Looks up the current user in the database"""
 
     login = 'user_id' in session
     if login:
-        return db['users'].find_one(id=session['user_id'])
+        return get_user_by_id(session['user_id'])
 
     return None
 
 
-def get_task(comp_id, task_id):
-    """Finds a task with a given category and score"""
-
-    task = list(db.query(
-        '''
-        SELECT * FROM tasks t JOIN task_competition tc
-        ON t.id = tc.task_id
-        WHERE t.id = :task_id AND tc.comp_id = :comp_id
-        ''',
-        task_id = task_id, comp_id = comp_id))
-
-    if len(task) == 0:
-        return None
-    return task[0]
+@request_cached
+def get_user_by_id(user_id):
+    return queries.get_user_by_id(user_id)
 
 
+@request_cached
 def get_team(comp_id):
     user = get_user()
     if not user:
         return None
 
-    team = db.query('SELECT * FROM teams t JOIN team_player tp ON t.id = tp.team_id AND tp.user_id = :user_id AND t.comp_id = :comp_id LIMIT 1',
-                    user_id=user['id'], comp_id=comp_id)
-    team = list(team)
-
-    if len(team) == 0:
-        return None
-    return team[0]
+    return queries.get_team(user['id'], comp_id)
 
 
 def get_flags():
     """Returns the flags of the current user"""
 
-    flags = db.query('select f.task_id from flags f where f.user_id = :user_id',
-                     user_id=session['user_id'])
-    return [f['task_id'] for f in list(flags)]
+    return queries.get_flags(session['user_id'])
+
+
+def load_competition(comp_id):
+    return queries.get_competition(comp_id)
 
 
+competitions_cache = CompetitionCache(load_competition)
+
+
+@request_cached
 def get_competition(comp_id):
     """Returns the current competition"""
 
-    competition = db['competitions'].find_one(id=comp_id)
-    return competition
-
+    info = competitions_cache.get(comp_id)
+    if info is None:
+        return None
 
-def is_running(comp_id):
-    """   """
-    competition = get_competition(comp_id)
-    if competition['active'] == False:
-        return False
+    # Routes modify the row they get, never hand out the shared one
+    return dict(info.row)
 
-    startDate = datetime.strptime(competition['date_start'], "%Y-%m-%d %H:%M")
-    endDate = datetime.strptime(competition['date_end'], "%Y-%m-%d %H:%M")
 
-    return datetime.utcnow() > startDate and datetime.utcnow() < endDate:
+def is_running(comp_id):
+    info = competitions_cache.get(comp_id)
+    return info is not None and info.state() == RUNNING
 
 
 def get_time_remaining(comp_id):
     if not is_running(comp_id):
         return None
 
-    competition = get_competition(comp_id)
-    endDate = datetime.strptime(competition['date_end'], "%Y-%m-%d %H:%M")
+    end = competitions_cache.get(comp_id).end
+    return (end - datetime.utcnow()).total_seconds()
 
-    return (endDate - datetime.utcnow()).total_seconds()
+
+def load_catalog(comp_id):
+    return queries.get_categories(), queries.get_competition_tasks(comp_id)
+
+
+catalogs = CatalogRegistry(load_catalog)
 
 
 def get_comp_score(comp_id):
     if not get_competition(comp_id):
         return 0
 
-    score_comp = list(db.query("SELECT ifnull(total(score), 0) as score FROM task_competition WHERE comp_id=:comp_id", comp_id=comp_id))[0]
-    return int(score_comp['score'])
+    return catalogs.get(comp_id).total_score
 
 
-'''
-def recalculate_teams_score(comp_id):
-    if not get_competition(comp_id):
+def get_scoring_model(comp_id):
+    """Returns the scoring model of a competition, see scoring.py"""
+
+    info = competitions_cache.get(comp_id)
+    if info is None:
+        return scoring.Static()
+    return scoring.get_model(info.row)
+
+
+@request_cached
+def get_task_values(comp_id):
+    """
+    Returns the current value of every task of a competition whose tasks
+    decay, by task id, or an empty dict if they are worth their score
+    """
+
+    model = get_scoring_model(comp_id)
+    if not model.dynamic:
+        return {}
+
+    solves = dict(queries.get_solve_counts(comp_id))
+    return dict((task['id'], model.value(task['score'] or 0, solves.get(task['id'], 0)))
+                for task in catalogs.get(comp_id).tasks)
+
+
+def recalculate_teams_score(connection, comp_id, model=None, solvers=False):
+    """
+    Rebuilds the scores of the teams of a competition from the teams
+    credited with each task, in the transaction of the connection. Publish
+    'scores' after the commit if any changed.
+
+    Args:
+        model: scoring model to score with, the one of the competition by
+               default
+        solvers: first rebuild the teams credited with each task from the
+                 flags and the schedule of the competition
+    Returns:
+        The number of teams whose score changed.
+    """
+
+    info = competitions_cache.get(comp_id)
+    if info is None:
         return 0
-'''
+
+    if solvers:
+        scoring.rebuild_solvers(connection, comp_id, scoring.to_millis(info.start), scoring.to_millis(info.end))
+    return scoring.recompute(connection, comp_id, model or scoring.get_model(info.row))
 
 
+@request_cached
 def get_tasks_done(team_id, comp_id):
-    flags = list(db.query(
-        '''
-        SELECT f.task_id
-        FROM flags f JOIN team_player tp JOIN teams t
-        ON f.user_id = tp.user_id AND tp.team_id = t.id
-        WHERE f.comp_id = :comp_id AND t.id = :team_id
-        ''',
-        comp_id=comp_id, team_id=team_id
-    ))
-    flags = [x['task_id'] for x in flags]
-    return flags
+    return queries.get_tasks_done(team_id, comp_id)
+
+
+def load_rank_index(comp_id):
+    return queries.get_rank_entries(comp_id)
+
+
+rankings = RankRegistry(load_rank_index)
+
+# Channel sequence number of the last change to the ranking of a
+# competition, by int comp_id. Every worker agrees on it, so together with
+# the epoch of the channel it versions the leaderboard pages and their ETags.
+ranking_versions = Versions()
 
 
 def get_team_scoreboard(comp_id, offset):
-    scores = list(db.query(
-        '''
-        SELECT t.*,
-        (
-        SELECT count(*)+1
-        FROM teams t2
-        WHERE t2.id != t.id AND t2.spectator = 0 AND (t2.score > t.score OR (t2.score == t.score AND t2.timestamp <= t.timestamp))
-        ) as rank
-        FROM teams as t
-        WHERE comp_id=:comp_id AND t.spectator = 0
-        ORDER BY score DESC, timestamp ASC
-        LIMIT 10
-        OFFSET :offset
-        ''',
-        comp_id=comp_id, offset=offset
-    ))
+    ranks = rankings.get(comp_id).page(offset, 10)
+    if len(ranks) == 0:
+        return []
+
+    teams = queries.get_teams(team_id for team_id, rank in ranks)
+    teams = dict((t['id'], t) for t in teams)
+
+    scores = []
+    for team_id, rank in ranks:
+        if team_id in teams:
+            scores.append(dict(teams[team_id], rank=rank))
 
     return scores
 
 
 def get_team_rank(comp_id, team_id):
-    rank = list(db.query(
-        '''
-        SELECT
-        (
-        SELECT count(*)+1
-        FROM teams t2
-        WHERE t.id != t2.id AND t2.spectator = 0 AND (t2.score > t.score OR (t2.score == t.score AND t2.timestamp <= t.timestamp))
-        ) as rank
-        FROM teams t
-        WHERE comp_id=:comp_id AND t.id = :team_id AND t.spectator = 0
-        ''',
-        comp_id=comp_id, team_id=team_id
-    ))
-    if len(rank) == 0:
-        return 0
-    return rank[0]['rank']
+    return rankings.get(comp_id).rank(team_id)
 
 
 def get_total_users(comp_id):
-    users = list(db.query(
-        '''
-        SELECT ifnull(count(*), 0) as count
-        FROM users u JOIN team_player tp JOIN teams t
-        ON u.id = tp.user_id AND tp.team_id = t.id
-        WHERE t.spectator = 0 AND t.comp_id = :comp_id
-        ''',
-        comp_id=comp_id
-    ))
-    return users[0]['count']
+    return queries.get_total_users(comp_id)
 
 @app.route('/')
 def index():
@@ -288,7 +381,7 @@ def error(msg):
 
 def session_login(username):
     """Initializes the session with the current user's id"""
-    user = db['users'].find_one(username=username)
+    user = queries.get_user_by_name(username)
     session['user_id'] = user['id']
 
 
@@ -304,22 +397,38 @@ def login_page():
 
 @app.route('/login', methods = ['POST'])
 def login():
-    from werkzeug.security import check_password_hash
-    from werkzeug.security import generate_password_hash
-
     username = bleach.clean(request.form['username'], tags=[])
     password = request.form['password']
     if not username:
         return redirect('/error/empty_user')
 
+    wait = rate_limit(('login_ip', request.remote_addr), ('login_user', username))
+    if wait:
+        render = render_template('error.html', lang=lang, message=lang['error']['rate_limited'])
+        return render, 429, {'Retry-After': str(wait)}
+
     if 'login-button' in request.form:
         """Attempts to log the user in"""
 
-        user = db['users'].find_one(username=username)
+        user = queries.get_user_by_name(username)
         if user is None:
             return redirect('/error/invalid_credentials')
 
-        if check_password_hash(user['password'], password):
+        try:
+            valid = hasher.check(user['password'], password)
+        except Busy:
+            render = render_template('error.html', lang=lang, message=lang['error']['busy'])
+            return render, 503, {'Retry-After': '1'}
+
+        if valid and hasher.needs_upgrade(user['password']):
+            # Rehash with the configured method and cost, at a later login
+            # when the hashers are busy
+            try:
+                db['users'].update(dict(id=user['id'], password=hasher.hash(password)), ['id'])
+            except Busy:
+                pass
+
+        if valid:
             session_login(username)
             #return redirect('/competitions')
             return redirect('/competition/1')
@@ -329,8 +438,8 @@ def login():
 
         shell_username = sanitize_name(username)
 
-        user_found = db['users'].find_one(username=username)
-        shell_found = db['users'].find_one(shell_username=shell_username)
+        user_found = queries.get_user_by_name(username)
+        shell_found = queries.get_user_by_shell_username(shell_username)
         if user_found or shell_found:
             return redirect('/error/already_registered')
 
@@ -341,13 +450,21 @@ def login():
         if userCount == 0:
             admin = True
 
-        new_user = dict(username=username, password=generate_password_hash(password), admin=admin, shell_username=shell_username)
-        db['users'].insert(new_user)
+        try:
+            password_hash = hasher.hash(password)
+        except Busy:
+            render = render_template('error.html', lang=lang, message=lang['error']['busy'])
+            return render, 503, {'Retry-After': '1'}
+
+        new_user = dict(username=username, password=password_hash, admin=admin, shell_username=shell_username)
+        user_id = db['users'].insert(new_user)
 
-        create_user(shell_username, password)
+        # The shell account is created in the background
+        provisioner.enqueue(user_id, shell_username, hash_password(password))
 
         # Set up the user id for this session
         session_login(username)
+        session['shell_pending'] = True
 
         #return redirect('/competitions')
         return redirect('/competition/1')
@@ -361,18 +478,58 @@ def logout():
     """Logs the current user out"""
 
     del session['user_id']
+    session.pop('shell_pending', None)
     return redirect('/')
 
 
+@app.context_processor
+def shell_account():
+    """Tells users whose shell account is not ready yet"""
+
+    if not session.get('shell_pending') or 'user_id' not in session:
+        return {}
+
+    job = provisioner.status(session['user_id'])
+    if job is None or job['status'] == 'done':
+        session.pop('shell_pending', None)
+        return {}
+    return {'shell_status': job['status']}
+
+
+@app.route('/account/shell', methods=['GET'])
+@login_required
+def account_shell():
+    """Returns the state of the user's shell account"""
+
+    job = provisioner.status(session['user_id'])
+    if job is None:
+        return jsonify({}), 400
+    return jsonify(job), 200
+
+
+@app.route('/provisioning', methods=['GET'])
+@admin_required
+def provisioning_jobs():
+    """Lists the shell accounts that are not created yet"""
+
+    return jsonify({'jobs': provisioner.unfinished()})
+
+
+@app.route('/provisioning/<int:job_id>/retry', methods=['POST'])
+@admin_required
+def provisioning_retry(job_id):
+    if not provisioner.retry(job_id):
+        return jsonify({'message': 'Not found'}), 400
+    return jsonify({}), 200
+
+
 @app.route('/competitions')
 @login_required
 def competitions():
     """Displays past competitions"""
 
     user = get_user()
-    competitions = db.query('''select * from competitions''')
-
-    competitions = list(competitions)
+    competitions = queries.get_competitions()
 
     # Render template
     render = render_template('competitions.html', lang=lang,
@@ -413,10 +570,19 @@ def competition_add_task(comp_id):
         if not db['tasks'].find_one(id=task_id) or not db['competitions'].find_one(id=comp_id):
             return jsonify({'message': 'Invalid task or competition!'}), 400
 
-        task_competition = db['task_competition']
-        entry = dict(task_id=task_id, comp_id=comp_id, score=score)
-
-        task_competition.insert(entry)
+        try:
+            with db.engine.begin() as connection:
+                aggregates.score_task(connection, comp_id, task_id, score)
+                connection.execute(
+                    text('INSERT INTO task_competition (task_id, comp_id, score) VALUES (:task_id, :comp_id, :score)'),
+                    task_id=task_id, comp_id=comp_id, score=score)
+                # Solves kept from a previous time the task was in it count again
+                rescored = recalculate_teams_score(connection, comp_id)
+        except IntegrityError:
+            return jsonify({'message': 'Task already in competition!'}), 400
+        channel.publish('flags', comp_id=comp_id)
+        if rescored:
+            publish_scores(comp_id)
 
         task = list(db.query("SELECT * FROM tasks t JOIN task_competition tc ON t.id = :task_id AND tc.task_id = :task_id AND tc.comp_id = :comp_id LIMIT 1",
                         task_id = task_id, comp_id = comp_id))
@@ -438,8 +604,15 @@ def competition_edit_task(comp_id):
         if not entry:
             return jsonify({'message': 'Not found'}), 400
 
-        entry['score'] = score
-        task_competition.update(entry, ['task_id', 'comp_id'])
+        with db.engine.begin() as connection:
+            aggregates.score_task(connection, comp_id, task_id, score)
+            connection.execute(
+                text('UPDATE task_competition SET score = :score WHERE task_id = :task_id AND comp_id = :comp_id'),
+                task_id=task_id, comp_id=comp_id, score=score)
+            rescored = recalculate_teams_score(connection, comp_id)
+        channel.publish('flags', comp_id=comp_id)
+        if rescored:
+            publish_scores(comp_id)
 
         task = list(db.query("SELECT * FROM tasks t JOIN task_competition tc ON t.id = :task_id AND tc.task_id = :task_id AND tc.comp_id = :comp_id LIMIT 1",
                         task_id = task_id, comp_id = comp_id))
@@ -455,11 +628,62 @@ def competition_remove_task(comp_id):
     except KeyError:
         return jsonify({'message': "Internal error!"}), 400
     else:
-        db['task_competition'].delete(task_id = task_id, comp_id = comp_id)
+        with db.engine.begin() as connection:
+            aggregates.score_task(connection, comp_id, task_id, 0)
+            connection.execute(
+                text('DELETE FROM task_competition WHERE task_id = :task_id AND comp_id = :comp_id'),
+                task_id=task_id, comp_id=comp_id)
+            rescored = recalculate_teams_score(connection, comp_id)
+        channel.publish('flags', comp_id=comp_id)
+        if rescored:
+            publish_scores(comp_id)
         task = db['tasks'].find_one(id = task_id)
         return jsonify(task), 200
 
 
+@app.route('/competition/<int:comp_id>/recompute', methods=['POST'])
+@admin_required
+def competition_recompute(comp_id):
+    """Rebuilds the scores of the teams from their flags and the task values"""
+    if not get_competition(comp_id):
+        return jsonify({'message': 'Not found'}), 400
+
+    with db.engine.begin() as connection:
+        rescored = recalculate_teams_score(connection, comp_id, solvers=True)
+    if rescored:
+        publish_scores(comp_id)
+    return jsonify({'teams': rescored}), 200
+
+
+def publish_scores(comp_id):
+    """Tells every worker and the players that the scores of a competition were rebuilt"""
+
+    channel.publish('scores', comp_id=comp_id)
+    publish_event(comp_id, 'rescore', {})
+
+
+# Channel sequence number of the last change to the tasks of a competition,
+# by int comp_id
+catalog_versions = Versions()
+
+explorers = VersionedCache()
+
+
+def render_explorer(comp_id):
+    """
+    Renders the categories and tasks of the explorer, which are the same for
+    every team and kept until a task of the competition is edited. The tasks
+    solved by the viewer's team are marked by competition.html.
+    """
+
+    version = catalog_versions.get(comp_id)
+    render = explorers.get(comp_id, version)
+    if render is None:
+        render = explorers.set(comp_id, version, render_template(
+            'competition-explorer.html', comp_id=comp_id, catalog=catalogs.get(comp_id)))
+    return Markup(render)
+
+
 def competition_page(comp_id, page, **kwargs):
     competition = get_competition(comp_id)
     if not competition:
@@ -485,16 +709,13 @@ def competition_page(comp_id, page, **kwargs):
 
     rank = get_team_rank(comp_id, team['id'])
 
-    categories = list(db['categories'].all())
-
-    tasks = db.query("SELECT * FROM tasks t, task_competition tc WHERE t.id = tc.task_id AND tc.comp_id = :comp_id", comp_id=comp_id)
-    tasks = sorted(list(tasks), key=lambda x: x['score'])
+    explorer = render_explorer(competition['id'])
 
     render = render_template('competition.html', lang=lang,
-                             user=user, competition=competition, categories=categories,
-                             tasks=tasks, page=page, team=team, running=running,
+                             user=user, competition=competition, explorer=explorer,
+                             page=page, team=team, running=running,
                              total_score=total_score, tasks_done=tasks_done,
-                             rank=rank, **kwargs)
+                             task_values=get_task_values(competition['id']), rank=rank, **kwargs)
     return make_response(render)
 
 
@@ -504,12 +725,54 @@ def competition(comp_id):
     return redirect('/competition/' + comp_id + '/stats')
 
 
+HOUR = 3600000
+
+
+@request_cached
+def get_task_stats(comp_id):
+    """
+    Returns the statistics of the tasks of a competition, in catalog order,
+    and its solves per hour. Reads one row per task and per task and hour
+    with solves, never the flags.
+    """
+
+    catalog = catalogs.get(comp_id)
+    stats = dict((row['task_id'], row) for row in queries.get_task_stats(comp_id))
+
+    hours = {}
+    totals = {}
+    for task_id, hour, solves in queries.get_solve_hours(comp_id):
+        if catalog.get(task_id) is not None:
+            hours.setdefault(task_id, []).append([hour * HOUR, solves])
+            totals[hour] = totals.get(hour, 0) + solves
+
+    tasks = []
+    for task in catalog.tasks:
+        row = stats.get(task['id'])
+        first_blood = None
+        if row is not None and row['first_team_id'] is not None:
+            first_blood = {'team_id': row['first_team_id'], 'team': row['first_team'],
+                           'timestamp': row['first_timestamp']}
+        tasks.append({'id': task['id'], 'name': task['name'], 'category': task['category'],
+                      'score': task['score'], 'solves': row['solves'] if row is not None else 0,
+                      'first_blood': first_blood, 'hours': sorted(hours.get(task['id'], []))})
+
+    histogram = []
+    if totals:
+        histogram = [[hour * HOUR, totals.get(hour, 0)] for hour in range(min(totals), max(totals) + 1)]
+    return tasks, histogram
+
+
 @app.route('/competition/<comp_id>/stats', methods=['GET'])
 @login_required
 def competition_stats(comp_id):
+    if not get_competition(comp_id):
+        return redirect('/error/competition_not_found')
     users = get_total_users(comp_id)
+    task_stats, histogram = get_task_stats(comp_id)
 
-    return competition_page(comp_id, 'competition-stats.html', users=users)
+    return competition_page(comp_id, 'competition-stats.html', users=users,
+                            task_stats=task_stats, histogram=histogram)
 
 
 @app.route('/competition/<comp_id>/stats', methods=['POST'])
@@ -517,11 +780,31 @@ def competition_stats(comp_id):
 def competition_stats_post(comp_id):
     user = get_user()
     competition = get_competition(comp_id)
+    if not competition:
+        return jsonify({}), 400
     users = get_total_users(comp_id)
-    render = render_template('competition-stats.html', lang=lang, user=user, competition=competition, users=users)
+    task_stats, histogram = get_task_stats(comp_id)
+    render = render_template('competition-stats.html', lang=lang, user=user, competition=competition, users=users,
+                             task_stats=task_stats, histogram=histogram)
     return render, 200
 
 
+@app.route('/competition/<int:comp_id>/stats.json', methods=['GET'])
+@login_required
+def competition_stats_json(comp_id):
+    """Solves and first blood of every task, and the solves per hour"""
+    competition = get_competition(comp_id)
+    if not competition:
+        return jsonify({}), 400
+
+    user = get_user()
+    if not user['admin'] and not get_team(comp_id):
+        return jsonify({}), 400
+
+    task_stats, histogram = get_task_stats(comp_id)
+    return jsonify({'teams': competition['teams'], 'tasks': task_stats, 'histogram': histogram})
+
+
 @app.route('/competition/<comp_id>/launch', methods=['GET'])
 @admin_required
 def competition_launch(comp_id):
@@ -550,8 +833,20 @@ def competition_launch_submit(comp_id):
         desc = bleach.clean(request.form['desc'], tags=descAllowedTags)
         date_start = request.form['date-start']
         date_end   = request.form['date-end']
+        settings = {
+            'scoring': request.form.get('scoring') or competition['scoring'],
+            'decay':   int(request.form.get('decay') or competition['decay']),
+            'minimum': int(request.form.get('minimum') or competition['minimum']),
+        }
     except KeyError:
         return jsonify({}), 400
+    except ValueError:
+        return jsonify({'message': 'Decay and minimum must be numbers'}), 400
+
+    try:
+        model = scoring.get_model(settings)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
     else:
         competition['name']       = name or competition['name']
         competition['desc']       = desc or competition['desc']
@@ -559,7 +854,21 @@ def competition_launch_submit(comp_id):
         competition['date_start'] = date_start or competition['date_start']
         competition['date_end']   = date_end   or competition['date_end']
 
-        competitions.update(competition, ['id'])
+        # Only the edited columns, the counters may have changed meanwhile
+        competitions.update(dict((key, competition[key]) for key in ('id', 'name', 'desc', 'active', 'date_start', 'date_end')), ['id'])
+        channel.publish('competition', comp_id=comp_id)
+
+        # A new scoring model rescores every team with it
+        rescored = 0
+        if any(settings[key] != competition[key] for key in settings):
+            with db.engine.begin() as connection:
+                connection.execute(
+                    text('UPDATE competitions SET scoring = :scoring, decay = :decay, minimum = :minimum WHERE id = :comp_id'),
+                    comp_id=competition['id'], **settings)
+                rescored = recalculate_teams_score(connection, competition['id'], model)
+            channel.publish('competition', comp_id=comp_id)
+        if rescored:
+            publish_scores(competition['id'])
 
         competition = competitions.find_one(id=comp_id)
         return jsonify(competition), 200
@@ -573,9 +882,53 @@ def competition_leaderboard(comp_id):
     return redirect('/competition/' + comp_id + '/leaderboard/0')
 
 
+leaderboards = VersionedCache()
+
+
+def render_leaderboard(comp_id, offset):
+    """
+    Renders a leaderboard page that is shared by all viewers and kept until
+    the scoreboard version changes. The viewer's own team is highlighted on
+    the client side.
+    """
+
+    key = (comp_id, offset)
+    version = ranking_versions.get(comp_id)
+    render = leaderboards.get(key, version)
+    if render is not None:
+        return render
+
+    competition = get_competition(comp_id)
+    scores = get_team_scoreboard(comp_id, offset*10)
+    render = render_template('competition-leaderboard.html', lang=lang,
+                             competition=competition, scores=scores, offset=offset)
+
+    # Do not let out of range offsets grow the cache
+    if scores or offset == 0:
+        leaderboards.set(key, version, render)
+    return render
+
+
+def leaderboard_response(comp_id, offset):
+    etag = make_etag('%x' % channel.epoch, comp_id, offset, ranking_versions.get(comp_id))
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        if not get_team(comp_id):
+            return jsonify({}), 400
+        response = make_response(render_leaderboard(comp_id, offset))
+
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
 @app.route('/competition/<int:comp_id>/leaderboard/<int:offset>', methods=['GET'])
 @login_required
 def competition_leaderboard_offset(comp_id, offset):
+    if request.is_xhr:
+        return leaderboard_response(comp_id, offset)
+
     scores = get_team_scoreboard(comp_id, offset*10)
     return competition_page(comp_id, 'competition-leaderboard.html', scores=scores, offset=offset)
 
@@ -583,16 +936,20 @@ def competition_leaderboard_offset(comp_id, offset):
 @app.route('/competition/<int:comp_id>/leaderboard/<int:offset>', methods=['POST'])
 @login_required
 def competition_leaderboard_offset_post(comp_id, offset):
-    user = get_user()
+    return leaderboard_response(comp_id, offset)
+
+
+@app.route('/competition/<int:comp_id>/rank', methods=['GET'])
+@login_required
+def competition_rank(comp_id):
+    """Rank of the user's team, for competition.html when the solvers of a task move"""
+
+    competition = get_competition(comp_id)
     team = get_team(comp_id)
-    if not team:
+    if not competition or not team:
         return jsonify({}), 400
 
-    competition = db['competitions'].find_one(id=comp_id)
-    scores = get_team_scoreboard(comp_id, offset*10)
-    render = render_template('competition-leaderboard.html', lang=lang, user=user,
-                             competition=competition, scores=scores, team=team, offset=offset)
-    return render, 200
+    return jsonify({'rank': get_team_rank(comp_id, team['id']), 'total_teams': competition['teams']})
 
 
 @app.route('/competition/<comp_id>/task/<task_id>', methods=['GET'])
@@ -602,7 +959,9 @@ def competition_task(comp_id, task_id):
     if not team:
         return jsonify({}), 400
 
-    task = db['tasks'].find_one(id=task_id)
+    task = catalogs.get(comp_id).get(task_id)
+    if not task:
+        return redirect('/error/task_not_found')
 
     tasks_done = get_tasks_done(team['id'], comp_id)
     done = False
@@ -619,7 +978,9 @@ def competition_task_post(comp_id, task_id):
     if not team:
         return jsonify({}), 400
 
-    task = db['tasks'].find_one(id=task_id)
+    task = catalogs.get(comp_id).get(task_id)
+    if not task:
+        return jsonify({}), 400
     competition = get_competition(comp_id)
 
     tasks_done = get_tasks_done(team['id'], comp_id)
@@ -671,19 +1032,25 @@ def competition_team_register(comp_id):
     return make_response(render), 200
 
 
-def create_team(name, comp_id, secret, spectator):
-    teams = db['teams']
+def create_team(connection, name, comp_id, secret, spectator, user_id):
+    """Creates a team with one player and counts them, returns the team id"""
 
-    team = dict(
-        name=name,
-        comp_id=comp_id,
-        secret=secret,
-        spectator=spectator,
-        score=0,
-        timestamp = 0
-    )
+    team_id = connection.execute(
+        text(
+            '''
+            INSERT INTO teams (name, comp_id, secret, spectator, score, timestamp)
+            VALUES (:name, :comp_id, :secret, :spectator, 0, 0)
+            '''),
+        name=name, comp_id=comp_id, secret=secret, spectator=spectator).lastrowid
+    connection.execute(
+        text('INSERT INTO team_player (team_id, user_id) VALUES (:team_id, :user_id)'),
+        team_id=team_id, user_id=user_id)
 
-    return teams.insert(team)
+    if spectator:
+        aggregates.adjust(connection, comp_id, spectators=1)
+    else:
+        aggregates.adjust(connection, comp_id, teams=1, players=1)
+    return team_id
 
 
 @app.route('/competition/<int:comp_id>/team-register', methods=['POST'])
@@ -709,21 +1076,21 @@ def competition_team_register_post(comp_id):
             if len(name) == 0:
                 return redirect('/error/form')
 
-            team_id = create_team(
-                name,
-                comp_id,
-                hashlib.md5(str(datetime.utcnow())).hexdigest(),
-                spectator
-            )
-
-            team_player = db['team_player']
-            team_player.insert(dict(team_id=team_id, user_id=session['user_id']))
+            with db.engine.begin() as connection:
+                team_id = create_team(
+                    connection,
+                    name,
+                    comp_id,
+                    hashlib.md5(str(datetime.utcnow())).hexdigest(),
+                    spectator,
+                    session['user_id']
+                )
 
             if not spectator:
-                competition = get_competition(comp_id)
-                competition['teams'] += 1
-
-            db['competitions'].update(competition, ['id'])
+                rankings.apply(comp_id, lambda ranking: ranking.update(team_id, 0, 0))
+                ranking_versions.bump(int(comp_id), channel.publish(
+                    'rank', local=False, comp_id=comp_id, team_id=team_id))
+            channel.publish('competition', comp_id=comp_id)
 
             #return redirect('/competitions')
             return redirect('/competition/1')
@@ -746,8 +1113,14 @@ def competition_team_register_post(comp_id):
                 if len(team_players) == 3:
                     return redirect('/error/too_many_members')
                 else:
-                    team_playersDB = db['team_player']
-                    team_playersDB.insert(dict(team_id=team['id'], user_id= session['user_id']))
+                    with db.engine.begin() as connection:
+                        connection.execute(
+                            text('INSERT INTO team_player (team_id, user_id) VALUES (:team_id, :user_id)'),
+                            team_id=team['id'], user_id=session['user_id'])
+                        if team['spectator']:
+                            aggregates.adjust(connection, comp_id, spectators=1)
+                        else:
+                            aggregates.adjust(connection, comp_id, players=1)
 
             #return redirect('/competitions')
             return redirect('/competition/1')
@@ -764,7 +1137,9 @@ def competition_countdown(comp_id):
     if not competition['active']:
         return redirect('/error/competition_not_active')
 
-    date_start = datetime.strptime(competition['date_start'], '%Y-%m-%d %H:%M')
+    date_start = competitions_cache.get(comp_id).start
+    if date_start is None:
+        return redirect('/error/competition_not_active')
     diff = (date_start - datetime.utcnow()).total_seconds()
 
     if diff <= 0:
@@ -835,30 +1210,94 @@ def competition_new_submit():
             teams=0
         )
 
-        competitions.insert(competition)
+        comp_id = competitions.insert(competition)
+        channel.publish('competition', comp_id=comp_id)
 
         return redirect('/competitions')
 
 
-def generate_filename(file):
-    filename, ext = os.path.splitext(file.filename)
-    #hash current time for file name
-    filename = secure_filename(filename) + '_' + hashlib.md5(str(datetime.utcnow())).hexdigest()
-
-    #if upload has extension, append to filename
-    if ext:
-        filename = filename + ext
-    return filename
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    return jsonify({'message': 'File too large'}), 413
 
 
 def store_file(file):
-    filename = generate_filename(file)
-    file.save(os.path.join("static/files/", filename))
-    return filename
+    """Stores an upload, returns its file name and the hash of its content"""
 
+    filename = secure_filename(file.filename) or 'file'
+    return filename, attachments.add(file.stream)
+
+
+def delete_file(task):
+    """Drops the attachment of a task"""
+
+    if task.get('file_hash'):
+        attachments.release(task['file_hash'])
+    else:
+        # Uploaded before attachments were content-addressed
+        os.remove(os.path.join("static/files/", task['file']))
 
-def delete_file(filename):
-    os.remove(os.path.join("static/files/", filename))
+
+def file_range(path, start, stop):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            chunk = f.read(min(remaining, AttachmentStore.chunk_size))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+
+
+@app.route('/files/<digest>/<name>', methods=['GET'])
+def attachment(digest, name):
+    """
+    Serves a task attachment. Its URL changes with its content, so it is
+    cached for good. Behind nginx the worker only sets the headers and
+    nginx sends the file, see attachments in config.json.
+    """
+
+    if not attachments.exists(digest):
+        return Response(status=404)
+
+    etag = digest
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    headers = {
+        'Cache-Control': 'public, max-age=31536000, immutable',
+        'Content-Type': mimetypes.guess_type(name)[0] or 'application/octet-stream',
+    }
+    path = attachments.path(digest)
+
+    if attachments_accel:
+        headers['X-Accel-Redirect'] = attachments_accel + digest[:2] + '/' + digest[2:]
+        response = Response(headers=headers)
+        response.set_etag(etag)
+        return response
+
+    size = os.path.getsize(path)
+    status, start, stop = 200, 0, size
+    byte_range = request.range
+    # The content never changes, only another etag makes If-Range fail
+    if request.if_range.etag not in (None, etag):
+        byte_range = None
+    if byte_range:
+        bounds = byte_range.range_for_length(size)
+        if bounds is None:
+            return Response(status=416, headers={'Content-Range': 'bytes */%d' % size})
+        status, (start, stop) = 206, bounds
+        headers['Content-Range'] = 'bytes %d-%d/%d' % (start, stop - 1, size)
+
+    headers['Accept-Ranges'] = 'bytes'
+    headers['Content-Length'] = str(stop - start)
+    response = Response(file_range(path, start, stop), status=status, headers=headers,
+                        direct_passthrough=True)
+    response.set_etag(etag)
+    return response
 
 
 
@@ -900,8 +1339,7 @@ def task_add():
         file = request.files['task-file']
 
         if file:
-            task['file'] = store_file(file)
-            #tasks.update(task, ['id'])
+            task['file'], task['file_hash'] = store_file(file)
 
         task_id = tasks.insert(task)
 
@@ -935,15 +1373,17 @@ def task_edit():
         file = request.files['task-file']
 
         if file:
-            filename = store_file(file)
+            filename, file_hash = store_file(file)
 
-            #remove old file
+            #remove old file, re-uploading the same content keeps it
             if task['file']:
-                delete_file(task['file'])
+                delete_file(task)
 
             task["file"] = filename
+            task["file_hash"] = file_hash
 
         tasks.update(task, ['id'])
+        channel.publish('flags', comp_id=None)
         task = tasks.find_one(name = task["name"], flag = task["flag"])
         return jsonify(task), 200
 
@@ -959,9 +1399,17 @@ def task_delete():
         return jsonify({ 'message': 'Task not found!' }), 400
 
     if task['file']:
-        delete_file(task['file'])
-
-    db['tasks'].delete(id=task_id)
+        delete_file(task)
+
+    with db.engine.begin() as connection:
+        aggregates.delete_task(connection, task_id)
+        comp_ids = [row[0] for row in connection.execute(
+            text('SELECT comp_id FROM task_competition WHERE task_id = :task_id'), task_id=task_id)]
+        connection.execute(text('DELETE FROM tasks WHERE id = :task_id'), task_id=task_id)
+        rescored = [comp_id for comp_id in comp_ids if recalculate_teams_score(connection, comp_id)]
+    channel.publish('flags', comp_id=None)
+    for comp_id in rescored:
+        publish_scores(comp_id)
     return jsonify({}), 200
 
 
@@ -984,6 +1432,69 @@ def task_competition_get(cid, tid):
     return jsonify(task[0]), 200
 
 
+def load_flag_index(comp_id):
+    return queries.get_flag_entries(comp_id)
+
+
+flag_indexes = FlagRegistry(load_flag_index)
+
+
+def accept_flag(comp_id, competition, team, task_id, points):
+    """Records a correct flag and returns the submission response"""
+
+    team_id = team['id']
+    user = get_user()
+    timestamp = int(time.time() * 1000)
+
+    old_rank = rankings.get(comp_id).rank(team_id)
+
+    def update_ranking(score, timestamp, moved):
+        def change(ranking):
+            if not team['spectator']:
+                ranking.update(team_id, score, timestamp)
+            if moved:
+                ranking.update_many((moved_id, moved_score, moved_timestamp)
+                                    for moved_id, moved_score, moved_timestamp, spectator in moved
+                                    if not spectator)
+        rankings.apply(comp_id, change)
+
+    solve = solves.record(comp_id, task_id, team_id, user['id'], points, timestamp,
+                          score=is_running(comp_id), ranked=not team['spectator'],
+                          on_scored=update_ranking, model=get_scoring_model(comp_id))
+
+    score = team['score']
+    if solve.scored:
+        score = solve.score
+        if solve.moved:
+            ranking_versions.bump(int(comp_id), channel.publish(
+                'solvers', local=False, comp_id=comp_id, task_id=task_id))
+        if not team['spectator']:
+            ranking_versions.bump(int(comp_id), channel.publish(
+                'rank', local=False, comp_id=comp_id, team_id=team_id))
+            publish_event(comp_id, 'score', {
+                'team': team_id,
+                'task': task_id,
+                'score': solve.score,
+                'old_rank': old_rank,
+                'rank': rankings.get(comp_id).rank(team_id),
+                'first_blood': solve.first_blood,
+                # Value of the task now, what its earlier solvers lost
+                'value': solve.value,
+                'delta': solve.delta
+            })
+
+    return jsonify(
+        {
+            'success': True,
+            'task': task_id,
+            'score': score,
+            'total_score': get_comp_score(comp_id),
+            'rank': rankings.get(comp_id).rank(team_id),
+            'total_teams': competition['teams']
+        }
+    )
+
+
 @app.route('/competition/<int:comp_id>/task/<int:task_id>/submit', methods=['POST'])
 @login_required
 def submit(comp_id, task_id):
@@ -992,65 +1503,203 @@ def submit(comp_id, task_id):
     if not competition:
         return jsonify({}), 400
 
-    task = get_task(comp_id, task_id)
-    if not task:
+    flags = flag_indexes.get(comp_id)
+    if task_id not in flags:
         return jsonify({}), 400
-    task_id = task['id']
 
     team = get_team(comp_id)
     if not team:
         return jsonify({}), 400
-    team_id = team['id']
+
+    wait = rate_limit(('submit_team', team['id']), ('submit_ip', request.remote_addr))
+    if wait:
+        return too_many_requests(wait)
 
     # Verify if flag is correct
     flag = request.form['flag']
-    if task['flag'] != flag:
+    points = flags.match(task_id, flag)
+    attempt_log.record(comp_id, task_id, team['id'], session['user_id'], flag, points is not None)
+    if points is None:
         return jsonify({ 'success': False }), 200
 
-    user = get_user()
-    user_id = user["id"]
-    timestamp = int(time.time() * 1000)
+    return accept_flag(comp_id, competition, team, task_id, points)
 
-    # Verify if player didn't solved this task yet
-    user_solved = list(db.query('SELECT * FROM flags WHERE task_id = :task_id AND user_id = :user_id AND comp_id = :comp_id',
-                           task_id = task_id, user_id = user_id, comp_id = comp_id))
-
-    # if team have not solved before, update team score
-    team_solved = list(db.query(
-        '''SELECT * FROM
-        flags f JOIN team_player tp JOIN teams t
-        ON
-        f.user_id = tp.user_id AND tp.team_id = t.id
-        WHERE
-        f.task_id = :task_id AND f.comp_id = :comp_id AND t.id = :team_id''',
-        task_id=task_id, user_id=user_id, comp_id=comp_id, team_id=team_id))
-
-    if len(user_solved) == 0:
-        # if not, add new flag to db
-        flag = dict(
-            task_id = task_id,
-            user_id = user_id,
-            comp_id = comp_id,
-            timestamp = timestamp
-        )
-        db['flags'].insert(flag)
 
-    if len(team_solved) == 0 and is_running(comp_id):
-        task_competition = db['task_competition'].find_one(task_id = task_id, comp_id = comp_id)
-        team['score'] += task_competition['score']
-        team['timestamp'] = timestamp
-        db['teams'].update(team, ['id'])
+@app.route('/competition/<int:comp_id>/submit', methods=['POST'])
+@login_required
+def submit_any(comp_id):
+    """Handles the submission of a flag without telling its task"""
+    competition = get_competition(comp_id)
+    if not competition:
+        return jsonify({}), 400
 
-    return jsonify(
-        {
-            'success': True,
-            'score': team['score'],
-            'total_score': get_comp_score(comp_id),
-            'rank': get_team_rank(comp_id, team_id),
-            'total_teams': competition['teams']
-        }
+    team = get_team(comp_id)
+    if not team:
+        return jsonify({}), 400
+
+    wait = rate_limit(('submit_team', team['id']), ('submit_ip', request.remote_addr))
+    if wait:
+        return too_many_requests(wait)
+
+    flag = request.form['flag']
+    task = flag_indexes.get(comp_id).lookup(flag)
+    attempt_log.record(comp_id, task and task[0], team['id'], session['user_id'], flag, task is not None)
+    if task is None:
+        return jsonify({ 'success': False }), 200
+
+    task_id, points = task
+    return accept_flag(comp_id, competition, team, task_id, points)
+
+
+@app.route('/competition/<int:comp_id>/attempts', methods=['GET'])
+@admin_required
+def competition_attempts(comp_id):
+    """Reports submission attempts per task and per team"""
+    attempt_log.flush()
+
+    tasks = reader.query(
+        '''
+        SELECT a.task_id, t.name, count(*) as attempts, sum(a.correct) as correct,
+        count(DISTINCT a.team_id) as teams
+        FROM attempts a LEFT JOIN tasks t ON t.id = a.task_id
+        WHERE a.comp_id = :comp_id
+        GROUP BY a.task_id
+        ORDER BY attempts DESC
+        ''',
+        comp_id=comp_id
+    )
+
+    teams = reader.query(
+        '''
+        SELECT a.team_id, t.name, count(*) as attempts, sum(a.correct) as correct,
+        count(DISTINCT a.flag) as flags
+        FROM attempts a LEFT JOIN teams t ON t.id = a.team_id
+        WHERE a.comp_id = :comp_id
+        GROUP BY a.team_id
+        ORDER BY attempts DESC
+        ''',
+        comp_id=comp_id
     )
 
+    return jsonify({'tasks': list(tasks), 'teams': list(teams), 'dropped': attempt_log.dropped})
+
+
+streams = None
+
+
+def publish_event(comp_id, event, data):
+    """Publishes an event to the subscribers of every worker, returns its id"""
+
+    return channel.publish('event', comp_id=comp_id, event=event, data=data)
+
+
+def _on_event(seq, message):
+    streams.publish(message['comp_id'], message['event'], message['data'], event_id=seq)
+
+
+def _on_competition(seq, message):
+    competitions_cache.invalidate(message['comp_id'])
+
+
+def _on_flags(seq, message):
+    """Tasks of a competition, or of every one, were added, edited or removed"""
+
+    comp_id = message['comp_id']
+    flag_indexes.invalidate(comp_id)
+    catalogs.invalidate(comp_id)
+    catalog_versions.bump(int(comp_id) if comp_id is not None else None, seq)
+
+
+def _on_rank(seq, message):
+    """Reloads a team whose score another worker changed"""
+
+    def change(index):
+        team = queries.get_rank_entry(message['team_id'])
+        if team is None or team['spectator']:
+            index.discard(message['team_id'])
+        else:
+            index.update(message['team_id'], team['score'], team['timestamp'])
+
+    # Replayed on an index loading now, which may have missed the change
+    rankings.apply(message['comp_id'], change)
+    ranking_versions.bump(int(message['comp_id']), seq)
+
+
+def _on_solvers(seq, message):
+    """Reloads the teams credited with a task whose value another worker lowered"""
+
+    def change(index):
+        index.update_many((team_id, score, timestamp) for team_id, spectator, score, timestamp
+                          in queries.get_solver_entries(message['comp_id'], message['task_id'])
+                          if not spectator)
+
+    rankings.apply(message['comp_id'], change)
+    ranking_versions.bump(int(message['comp_id']), seq)
+
+
+def _on_scores(seq, message):
+    """Reloads the ranking of a competition whose scores were rebuilt"""
+
+    rankings.invalidate(message['comp_id'])
+    ranking_versions.bump(int(message['comp_id']), seq)
+
+
+def _on_roster(seq, message):
+    """Reloads a competition after roster.py registered teams in it"""
+
+    competitions_cache.invalidate(message['comp_id'])
+    rankings.invalidate(message['comp_id'])
+    ranking_versions.bump(int(message['comp_id']), seq)
+
+
+def _on_overflow(seq):
+    """Messages were lost, drops everything they could have invalidated"""
+
+    competitions_cache.invalidate()
+    flag_indexes.invalidate()
+    catalogs.invalidate()
+    rankings.invalidate()
+    catalog_versions.bump(None, seq)
+    ranking_versions.bump(None, seq)
+    streams.reset(seq)
+
+
+@app.before_request
+def _poll_channel():
+    channel.start()
+    channel.poll()
+
+
+@app.route('/competition/<int:comp_id>/events', methods=['GET'])
+@login_required
+def competition_events(comp_id):
+    """Streams solves, score/rank changes and announcements as SSE"""
+    if not get_competition(comp_id):
+        return jsonify({}), 400
+
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    body = streams.get(comp_id).subscribe(last_id)
+    return Response(body, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/competition/<int:comp_id>/announce', methods=['POST'])
+@admin_required
+def competition_announce(comp_id):
+    try:
+        message = bleach.clean(request.form['message'], tags=descAllowedTags)
+    except KeyError:
+        return jsonify({'message': 'Internal error!'}), 400
+    else:
+        if not message or not get_competition(comp_id):
+            return jsonify({'message': 'Invalid message or competition!'}), 400
+
+        try:
+            event_id = publish_event(comp_id, 'announcement', {'message': message})
+        except ValueError:
+            return jsonify({'message': 'Invalid message or competition!'}), 400
+        return jsonify({'id': event_id}), 200
+
 
 '''
 @app.route('/competitions.json')
@@ -1077,7 +1726,18 @@ def about():
 """ Filters """
 @app.template_filter('date')
 def format_date(date):
-    return datetime.strptime(date, '%Y-%m-%d %H:%M').strftime('%d/%m/%Y %H:%M')
+    date = parse_date(date)
+    if date is None:
+        return ''
+    return date.strftime('%d/%m/%Y %H:%M')
+
+
+@app.template_filter('timestamp')
+def format_timestamp(timestamp):
+    """Formats a UTC timestamp in milliseconds like the date filter"""
+    if timestamp is None:
+        return ''
+    return datetime.utcfromtimestamp(timestamp // 1000).strftime('%d/%m/%Y %H:%M')
 
 
 """Initializes the database and sets up the language"""
@@ -1098,13 +1758,53 @@ lang = json.loads(lang_str)
 # Only a single language is supported for now
 lang = lang[config['language']]
 
-# Connect to database
-db = dataset.connect(config['db'])
+# Set up rate limiting, shared by all workers through its file
+if 'rate_limits' in config:
+    limiter = RateLimiter(config['rate_limits'])
+
+# Connect to database, read-only routes use their own connections
+db = storage.connect(config['db'], config.get('storage'))
+reader = storage.connect(config['db'], config.get('storage'), readonly=True)
+queries = Queries(reader.engine)
+solves = SubmissionEngine(db.engine)
+attempt_log = AttemptLog(db.engine)
+
+hasher = PasswordHasher(**config.get('passwords', {}))
+
+settings = config.get('attachments', {})
+attachments = AttachmentStore(db.engine, settings.get('path', 'attachments'))
+# Larger task uploads are refused from their Content-Length, before any read
+attachments_max_size = settings.get('max_size')
+# Internal nginx location of the attachments, see config/ctf.nginx
+attachments_accel = settings.get('accel')
+
+settings = dict(config.get('provisioning', {}))
+provisioning_workers = settings.pop('workers', 2)
+provisioner = ProvisioningQueue(db.engine, create_account, batch_task=create_accounts, **settings)
+
+# Share invalidations and events between workers, see config/gunicorn.conf.py
+if 'channel' in config:
+    settings = dict(config['channel'])
+    channel = Channel(settings.pop('file'), **settings)
+else:
+    channel = Channel()
+channel.on('event', _on_event)
+channel.on('competition', _on_competition)
+channel.on('flags', _on_flags)
+channel.on('rank', _on_rank)
+channel.on('roster', _on_roster)
+channel.on('scores', _on_scores)
+channel.on('solvers', _on_solvers)
+channel.on_overflow(_on_overflow)
+streams = EventRegistry(first_id=channel.position)
 
 if config['isProxied']:
     app.wsgi_app = ProxyFix(app.wsgi_app)
 
 if __name__ == '__main__':
+    # Deployments run provisioning.py instead
+    provisioner.start(provisioning_workers)
+
     # Start web server
     app.run(host=config['host'], port=config['port'],
         debug=config['debug'], threaded=True, extra_files=['config.json', config['language_file']])
@@ -0,0 +1,141 @@
+"""
+Database connections configured by the storage profile in config.json.
+"""
+
+import os
+import re
+import sqlite3
+import time
+
+import dataset
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+
+# Pragmas that may be set from the storage profile, in the order they are
+# applied to every new connection
+PRAGMAS = ['journal_mode', 'synchronous', 'busy_timeout', 'cache_size', 'mmap_size', 'temp_store']
+
+
+def apply_profile(dbapi_connection, profile, readonly=False):
+    """
+    Applies a storage profile to a new sqlite connection. Foreign keys are
+    always enforced; read-only connections refuse to write.
+    """
+
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA foreign_keys=ON')
+    for name in PRAGMAS:
+        if name not in profile:
+            continue
+        value = str(profile[name])
+        if not re.match(r'^-?\w+$', value):
+            raise ValueError('Invalid value for PRAGMA %s: %r' % (name, value))
+        cursor.execute('PRAGMA %s=%s' % (name, value))
+    if readonly:
+        cursor.execute('PRAGMA query_only=ON')
+    cursor.close()
+
+
+def _retry(timeout, call, *args):
+    """
+    Calls call(*args) until the database is no longer locked by another
+    connection, sleeping between the attempts for up to timeout seconds.
+    """
+
+    deadline = time.time() + timeout
+    delay = 0.001
+    while True:
+        try:
+            return call(*args)
+        except sqlite3.OperationalError as e:
+            if str(e) != 'database is locked' or time.time() + delay > deadline:
+                raise
+        time.sleep(delay)
+        delay = min(delay * 2, 0.05)
+
+
+class Cursor(sqlite3.Cursor):
+    """Cursor of a Connection, see there"""
+
+    def execute(self, *args):
+        return _retry(self.connection.lock_timeout, sqlite3.Cursor.execute, self, *args)
+
+    def executemany(self, *args):
+        return _retry(self.connection.lock_timeout, sqlite3.Cursor.executemany, self, *args)
+
+
+class Connection(sqlite3.Connection):
+    """
+    sqlite connection that waits for the lock of another connection by
+    sleeping between attempts, for up to lock_timeout seconds, instead of
+    in sqlite's busy handler. The busy handler holds the thread, which
+    under gevent is every request of the worker, while time.sleep is
+    patched to let the other greenlets run.
+
+    A statement that finds the database locked did nothing, so it is safe
+    to run again. executemany is only retried whole, which is what it is
+    used for: inserting rows in a transaction, whose first row takes the
+    lock.
+    """
+
+    lock_timeout = 5.0
+
+    def cursor(self, factory=Cursor):
+        return sqlite3.Connection.cursor(self, factory)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+    def commit(self):
+        return _retry(self.lock_timeout, sqlite3.Connection.commit, self)
+
+
+def connect(url, profile=None, readonly=False):
+    """
+    Opens a dataset database whose engine keeps a pool of connections per
+    worker process, each set up with the storage profile when it is made.
+
+    Connections wait for the write lock for busy_timeout milliseconds of
+    the profile by sleeping, see Connection, not in sqlite.
+
+    Pooled connections move between the threads of the worker, one at a
+    time, so sqlite's same-thread check is turned off. They never move
+    between processes: a worker forked after the pool was used, as with
+    gunicorn --preload, discards the connections it inherited.
+
+    Args:
+        url: SQLAlchemy url of the database
+        profile: the "storage" section of config.json
+        readonly: open connections that only serve reads
+    """
+
+    profile = profile or {}
+    engine_kwargs = {
+        'connect_args': {'check_same_thread': False, 'factory': Connection},
+        'poolclass': QueuePool,
+        'pool_size': profile.get('pool_size', 8),
+        'max_overflow': profile.get('max_overflow', 32),
+    }
+    db = dataset.connect(url, reflect_metadata=not readonly, engine_kwargs=engine_kwargs)
+
+    @event.listens_for(db.engine, 'connect')
+    def _configure(dbapi_connection, connection_record):
+        apply_profile(dbapi_connection, profile, readonly)
+        dbapi_connection.lock_timeout = profile.get('busy_timeout', 5000) / 1000.0
+        dbapi_connection.execute('PRAGMA busy_timeout=0')
+        connection_record.info['pid'] = os.getpid()
+
+    @event.listens_for(db.engine, 'checkout')
+    def _check_pid(dbapi_connection, connection_record, connection_proxy):
+        if connection_record.info['pid'] != os.getpid():
+            # Makes the pool drop the record and connect again
+            connection_record.connection = connection_proxy.connection = None
+            raise exc.DisconnectionError('Connection belongs to pid %d' % connection_record.info['pid'])
+
+    # The connections used for reflection were made before the listener
+    db.engine.dispose()
+    return db
@@ -0,0 +1,196 @@
+"""
+Flag submission pipeline.
+"""
+
+import os
+from collections import namedtuple
+
+try:
+    from Queue import Queue, Empty, Full
+except ImportError:
+    from queue import Queue, Empty, Full
+
+
+Solve = namedtuple('Solve', ['new', 'scored', 'score', 'timestamp', 'first_blood', 'value', 'delta', 'moved'])
+
+
+class SubmissionEngine(object):
+    """
+    Records accepted flags, counts them on the competition, credits the team
+    and updates the statistics of the task in one short write transaction.
+    Under a decaying scoring model, the other teams credited with the task
+    lose what the new solve took off its value in the same transaction.
+
+    The transaction is started with BEGIN IMMEDIATE, so concurrent
+    submissions are serialized by SQLite's write lock and two teammates
+    solving the same task at once cannot both add its score.
+    """
+
+    def __init__(self, engine, pool_size=4):
+        """
+        Args:
+            engine: SQLAlchemy engine of the database, its sqlite connections
+                    must be created with check_same_thread=False
+            pool_size: number of idle connections kept for reuse
+        """
+
+        self._engine = engine
+        self._pool_size = pool_size
+        self._connections = Queue(pool_size)
+        self._pid = os.getpid()
+
+    def _acquire(self):
+        if self._pid != os.getpid():
+            # Forked: the idle connections belong to the parent, drop them
+            # without closing so the parent's are left alone
+            self._connections = Queue(self._pool_size)
+            self._pid = os.getpid()
+        try:
+            return self._connections.get_nowait()
+        except Empty:
+            connection = self._engine.raw_connection()
+            # Take transaction control away from pysqlite
+            connection.connection.isolation_level = None
+            return connection
+
+    def _release(self, connection):
+        try:
+            self._connections.put_nowait(connection)
+        except Full:
+            self._discard(connection)
+
+    def _discard(self, connection):
+        connection.connection.isolation_level = ''
+        connection.close()
+
+    def record(self, comp_id, task_id, team_id, user_id, points, timestamp,
+               score=True, ranked=True, on_scored=None, model=None):
+        """
+        Records that a user found the flag of a task.
+
+        Args:
+            points: score of the task in this competition
+            score: whether the team may be credited (competition running)
+            ranked: whether a solve of the team counts in the statistics of
+                    the task (not a spectator team)
+            on_scored: called with (score, timestamp, moved) of the team
+                       while the write lock is still held, so in-memory
+                       state is updated in commit order. moved lists the
+                       (team_id, score, timestamp, spectator) of the other
+                       teams whose score changed.
+            model: scoring model of the competition, see scoring.py; the
+                   task is worth its score by default
+        Returns:
+            A Solve: new is False if the user already had this flag, scored
+            tells whether the team was credited, score and timestamp are the
+            team's values after the transaction (None if not scored),
+            first_blood whether the team is the first to solve the task,
+            value what the task is now worth, delta what the other teams
+            credited with it gained (negative) and moved how many they are.
+        """
+
+        connection = self._acquire()
+        cursor = connection.connection.cursor()
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                cursor.execute(
+                    '''
+                    INSERT OR IGNORE INTO flags (task_id, user_id, comp_id, timestamp)
+                    VALUES (?, ?, ?, ?)
+                    ''',
+                    (task_id, user_id, comp_id, timestamp))
+                new = cursor.rowcount == 1
+                if new:
+                    # Counter kept for aggregates.py
+                    cursor.execute('UPDATE competitions SET solves = solves + 1 WHERE id = ?', (comp_id,))
+
+                scored = False
+                value = points
+                if new and score:
+                    if model is not None and model.dynamic:
+                        # Value with this solve, from the ranked solves before it
+                        cursor.execute('SELECT solves FROM task_stats WHERE comp_id = ? AND task_id = ?',
+                                       (comp_id, task_id))
+                        row = cursor.fetchone()
+                        solves = row[0] if row else 0
+                        value = model.value(points, solves + 1 if ranked else solves)
+
+                    # Credit the team unless a teammate got there first
+                    cursor.execute(
+                        '''
+                        UPDATE teams SET score = score + ?, timestamp = ?
+                        WHERE id = ? AND NOT EXISTS (
+                            SELECT 1 FROM flags f JOIN team_player tp ON f.user_id = tp.user_id
+                            WHERE tp.team_id = ? AND f.task_id = ? AND f.comp_id = ? AND f.user_id != ?
+                        )
+                        ''',
+                        (value, timestamp, team_id, team_id, task_id, comp_id, user_id))
+                    scored = cursor.rowcount == 1
+
+                team_score = team_timestamp = None
+                first_blood = False
+                delta = 0
+                moved = []
+                if scored:
+                    if model is not None and model.dynamic:
+                        # What the new solve took off the value of the task
+                        delta = value - model.value(points, solves)
+                        if delta:
+                            moved = self._move_solvers(cursor, comp_id, task_id, delta)
+                    cursor.execute(
+                        'INSERT OR IGNORE INTO task_solves (comp_id, task_id, team_id, ranked, timestamp) VALUES (?, ?, ?, ?, ?)',
+                        (comp_id, task_id, team_id, ranked, timestamp))
+
+                    cursor.execute('SELECT score, timestamp FROM teams WHERE id = ?', (team_id,))
+                    team_score, team_timestamp = cursor.fetchone()
+                    if ranked:
+                        first_blood = self._count_solve(cursor, comp_id, task_id, team_id, timestamp)
+                    if on_scored is not None:
+                        on_scored(team_score, team_timestamp, moved)
+
+                cursor.execute('COMMIT')
+            except:
+                cursor.execute('ROLLBACK')
+                raise
+        except:
+            self._discard(connection)
+            raise
+        else:
+            cursor.close()
+            self._release(connection)
+
+        return Solve(new, scored, team_score, team_timestamp, first_blood, value, delta, len(moved))
+
+    def _move_solvers(self, cursor, comp_id, task_id, delta):
+        # Every team credited with the task so far, in one statement, read
+        # back under the same write lock. UPDATE ... RETURNING would need
+        # SQLite 3.35.
+        solvers = 'SELECT team_id FROM task_solves WHERE comp_id = ? AND task_id = ?'
+        cursor.execute('UPDATE teams SET score = score + ? WHERE id IN (%s)' % solvers,
+                       (delta, comp_id, task_id))
+        cursor.execute('SELECT id, score, timestamp, spectator FROM teams WHERE id IN (%s)' % solvers,
+                       (comp_id, task_id))
+        return cursor.fetchall()
+
+    def _count_solve(self, cursor, comp_id, task_id, team_id, timestamp):
+        # Under the write lock, so the team creating the row is the first one
+        cursor.execute(
+            '''
+            INSERT OR IGNORE INTO task_stats (comp_id, task_id, solves, first_team_id, first_timestamp)
+            VALUES (?, ?, 0, ?, ?)
+            ''',
+            (comp_id, task_id, team_id, timestamp))
+        first_blood = cursor.rowcount == 1
+        cursor.execute(
+            'UPDATE task_stats SET solves = solves + 1, last_timestamp = ? WHERE comp_id = ? AND task_id = ?',
+            (timestamp, comp_id, task_id))
+
+        hour = timestamp // 3600000
+        cursor.execute(
+            'INSERT OR IGNORE INTO task_solve_hours (comp_id, task_id, hour, solves) VALUES (?, ?, ?, 0)',
+            (comp_id, task_id, hour))
+        cursor.execute(
+            'UPDATE task_solve_hours SET solves = solves + 1 WHERE comp_id = ? AND task_id = ? AND hour = ?',
+            (comp_id, task_id, hour))
+        return first_blood
@@ -2,12 +2,22 @@
 Low level deployment operations.
 """
 
+import errno
+import os
+import re
+import string
+import subprocess
+import threading
+from collections import deque
 from random import randint, Random
 from os import path, makedirs
-from spur import LocalShell
+from select import select, error as SelectError
+from spur import NoSuchCommandError
+from spur.results import result as execution_result
 from time import time
 from signal import SIGKILL 
 from crypt import crypt
+from pwd import getpwnam
 
 class TimeoutError(Exception):
     """
@@ -15,37 +25,160 @@ class TimeoutError(Exception):
     """
     pass
 
-def execute(cmd, timeout=60, **kwargs):
+# Bytes of stdout and of stderr kept from a command, the end of the output
+OUTPUT_LIMIT = 64 * 1024
+
+class Output(object):
+    """
+    The last `limit` bytes written to a stream, so a chatty command cannot
+    fill the memory of the server.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.size = 0
+        self._chunks = deque()
+        self._kept = 0
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        self._chunks.append(chunk)
+        self._kept += len(chunk)
+        while len(self._chunks) > 1 and self._kept - len(self._chunks[0]) >= self.limit:
+            self._kept -= len(self._chunks.popleft())
+
+    def getvalue(self):
+        return b"".join(self._chunks)[-self.limit:]
+
+def _kill(process):
+    # The command runs in its own process group, which takes its children too
+    try:
+        os.killpg(process.pid, SIGKILL)
+    except OSError:
+        pass
+
+def execute(cmd, timeout=60, cwd=None, update_env=None, allow_error=False, output_limit=OUTPUT_LIMIT):
     """
     Executes the given shell command
 
+    The output is read as it comes with select, and the exit status is
+    waited for with a blocking wait, so waiting costs no CPU.
+
     Args:
         cmd: List of command arguments
         timeout: maximum alloted time for the command
-        **kwargs: passes to LocalShell.spawn
+        cwd: working directory of the command
+        update_env: variables added to the environment of the command
+        allow_error: return the result of a failed command instead of raising
+        output_limit: bytes kept from the end of stdout and of stderr
     Returns:
         An execution result.
     Raises:
-        NoSuchCommandError, RunProcessError, FileNotFoundError
+        NoSuchCommandError, RunProcessError, TimeoutError
     """
 
-    shell = LocalShell()
-
     #It is unlikely that someone actually intends to supply
     #a string based on how spur works.
     if type(cmd) == str:
         cmd = ["bash", "-c"] + [cmd]
 
-    process = shell.spawn(cmd, store_pid=True, **kwargs)
-    start_time = time()
+    env = None
+    if update_env:
+        env = dict(os.environ, **update_env)
+
+    with open(os.devnull, "rb") as devnull:
+        try:
+            process = subprocess.Popen(cmd, stdin=devnull, stdout=subprocess.PIPE,
+                                       stderr=subprocess.PIPE, cwd=cwd, env=env,
+                                       close_fds=True, preexec_fn=os.setsid)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                raise NoSuchCommandError(cmd[0])
+            raise
+
+    timed_out = threading.Event()
+
+    def expire():
+        timed_out.set()
+        _kill(process)
+
+    # Killing the group at the deadline also closes the pipes
+    deadline = time() + timeout
+    timer = threading.Timer(timeout, expire)
+    timer.start()
 
-    while process.is_running():
-        delta_time = time() - start_time
-        if delta_time > timeout:
-            process.send_signal(SIGKILL)
-            raise TimeoutError(cmd, timeout)
+    stdout, stderr = Output(output_limit), Output(output_limit)
+    outputs = {process.stdout.fileno(): stdout, process.stderr.fileno(): stderr}
+    try:
+        open_fds = list(outputs)
+        # A child that left the group may keep the pipes open after a kill
+        while open_fds and not timed_out.is_set():
+            try:
+                ready = select(open_fds, [], [], max(deadline - time(), 0) + 1)[0]
+            except SelectError as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            for fd in ready:
+                chunk = os.read(fd, 65536)
+                if chunk:
+                    outputs[fd].write(chunk)
+                else:
+                    open_fds.remove(fd)
+        return_code = process.wait()
+    finally:
+        timer.cancel()
+        process.stdout.close()
+        process.stderr.close()
 
-    return process.wait_for_result()
+    if timed_out.is_set():
+        raise TimeoutError(cmd, timeout)
+
+    return execution_result(return_code, allow_error, stdout.getvalue(), stderr.getvalue())
+
+def execute_all(cmds, concurrency=4, **kwargs):
+    """
+    Executes a batch of shell commands, at most `concurrency` at a time
+
+    Args:
+        cmds: list of commands, as taken by execute
+        concurrency: number of commands running at once
+        **kwargs: passes to execute
+    Returns:
+        A list with the execution result of every command, in order, or
+        the exception it raised.
+    """
+
+    cmds = list(cmds)
+    results = [None] * len(cmds)
+    pending = iter(range(len(cmds)))
+    lock = threading.Lock()
+
+    def run():
+        while True:
+            with lock:
+                i = next(pending, None)
+            if i is None:
+                return
+            try:
+                results[i] = execute(cmds[i], **kwargs)
+            except Exception as e:
+                results[i] = e
+
+    threads = [threading.Thread(target=run) for _ in range(min(concurrency, len(cmds)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def hash_password(password):
+    """
+    Hashes a password for useradd, so it can be queued without keeping the
+    password itself
+    """
+
+    return crypt(password, "42")
 
 def create_user(username, password):
     """
@@ -56,5 +189,70 @@ def create_user(username, password):
 
     """
 
-    execute(["useradd", "-s", "/bin/bash", "-g", "competitors", "-m", "-p", crypt(password, "42"), username])
+    create_account(username, hash_password(password))
+
+def create_account(username, password_hash):
+    """
+    Creates a user account with an already hashed password. Running it
+    again after a failure finishes the account instead of failing on the
+    existing user.
+
+    Args:
+        username: the username to create
+        password_hash: the password, hashed by hash_password, or None to
+                       lock the password of the account
+    """
+
+    try:
+        getpwnam(username)
+    except KeyError:
+        execute(useradd(username, password_hash))
     execute(["chmod", "700", "/home/"+username])
+
+def useradd(username, password_hash):
+    """Returns the useradd command creating an account, locked without a hash"""
+
+    password = ["-p", password_hash] if password_hash else []
+    return ["useradd", "-s", "/bin/bash", "-g", "competitors", "-m"] + password + [username]
+
+def create_accounts(accounts, chunk=1000):
+    """
+    Creates many user accounts at once. Each new account still takes a
+    useradd, which is faster than newusers since that hashes every password
+    again through PAM, but the home directories are closed with one chmod
+    per chunk. Accounts that already exist are only finished, as in
+    create_account.
+
+    Args:
+        accounts: list of (username, password_hash), see create_account
+        chunk: most home directories given to one chmod
+    """
+
+    for username, password_hash in accounts:
+        try:
+            getpwnam(username)
+        except KeyError:
+            execute(useradd(username, password_hash))
+
+    homes = ["/home/" + username for username, password_hash in accounts]
+    for start in range(0, len(homes), chunk):
+        execute(["chmod", "700"] + homes[start:start + chunk])
+
+def sanitize_name(name):
+    """
+    Sanitize a given name such that it conforms to unix policy.
+    Args:
+        name: the name to sanitize.
+    Returns:
+        The sanitized form of name.
+    """
+
+    if len(name) == 0:
+        raise Exception("Can not sanitize an empty field.")
+
+    sanitized_name = re.sub(r"[^a-z0-9\+-]", "-", name.lower())
+
+    if sanitized_name[0] in string.digits:
+        sanitized_name = "p" + sanitized_name
+
+    return sanitized_name